@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+# Copyright 2019 The GoRE.tk Authors. All rights reserved.
+# Use of this source code is governed by the license that
+# can be found in the LICENSE file.
+
+'''
+Benchmarks for the conversion of libgore results into pygore objects.
+
+The benchmarks run on synthetic results served by the libgore stand-in in
+standin.py, so neither libgore nor any Go binaries are needed. For every
+benchmark the best wall time over a number of runs, the throughput, the peak
+traced memory and the number of memory blocks held by the result are
+reported. The results can be saved as a baseline and later runs compared
+against it:
+
+    python benchmark/bench.py --save benchmark/baseline.json
+    python benchmark/bench.py --baseline benchmark/baseline.json
+
+The exit status is 1 if any metric regressed by more than the tolerance.
+'''
+
+import argparse
+import gc
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+import standin  # noqa: E402
+
+standin.install()
+
+import pygore  # noqa: E402
+import pygore.lib as lib  # noqa: E402
+
+_metrics = ('seconds', 'peak_bytes', 'blocks')
+
+
+def _parse_packages(s):
+    pps = list(s.packages.values())
+    return lambda: [lib._parsePackages(p) for p in pps], s.num_functions
+
+
+def _parse_types(s):
+    return lambda: lib._parseTypes(s.types, dict()), s.num_types
+
+
+def _convert_type(s):
+    # Converts a sample of types each with a fresh cache, so every call
+    # converts everything reachable from the sampled type.
+    roots = [s.types.contents.types[i][0]
+             for i in range(0, s.num_types, max(1, s.num_types // 100))]
+    return lambda: [lib._convert_type(t, dict(), pygore.StringTable())
+                    for t in roots], len(roots)
+
+
+def _lazy_types(s):
+    return lambda: [t.name for t in lib._lazy_types(s.types,
+                                                    lib._LazyCache())], \
+        s.num_types
+
+
+def _get_all(s):
+    def run():
+        f = pygore.GoFile('synthetic')
+        a = f.get_all()
+        f.close()
+        return a
+    return run, s.num_functions + s.num_types
+
+
+def _address_index(s):
+    def run():
+        f = pygore.GoFile('synthetic')
+        idx = pygore.AddressIndex.from_file(f)
+        f.close()
+        return idx
+    return run, s.num_functions
+
+
+benchmarks = [
+    ('parse_packages', _parse_packages),
+    ('parse_types', _parse_types),
+    ('convert_type', _convert_type),
+    ('lazy_types', _lazy_types),
+    ('get_all', _get_all),
+    ('address_index', _address_index),
+]
+
+
+def measure(fn, items, repeat):
+    '''
+    Returns the metrics for fn, which processes items objects per call.
+    '''
+    gc.collect()
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            fn()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+    finally:
+        if enabled:
+            gc.enable()
+
+    gc.collect()
+    tracemalloc.start()
+    try:
+        result = fn()
+        _, peak = tracemalloc.get_traced_memory()
+        blocks = sum(st.count for st in
+                     tracemalloc.take_snapshot().statistics('filename'))
+    finally:
+        tracemalloc.stop()
+    del result
+
+    return {
+        'seconds': best,
+        'per_second': items / best if best else 0.0,
+        'peak_bytes': peak,
+        'blocks': blocks,
+    }
+
+
+def compare(results, baseline, tolerance):
+    '''
+    Returns a list of (benchmark, metric, old, new) for every metric that
+    is worse than the baseline by more than tolerance.
+    '''
+    regressions = []
+    for name, res in results.items():
+        old = baseline.get(name)
+        if old is None:
+            continue
+        for metric in _metrics:
+            if metric in old and res[metric] > old[metric] * (1 + tolerance):
+                regressions.append((name, metric, old[metric], res[metric]))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--packages', type=int, default=20,
+                        help='packages per package class')
+    parser.add_argument('--functions', type=int, default=50,
+                        help='functions per package')
+    parser.add_argument('--methods', type=int, default=10,
+                        help='methods per package')
+    parser.add_argument('--types', type=int, default=2000,
+                        help='number of types')
+    parser.add_argument('--fields', type=int, default=6,
+                        help='fields per struct type')
+    parser.add_argument('--type-methods', type=int, default=2,
+                        help='methods per struct and interface type')
+    parser.add_argument('--cycles', type=float, default=0.1,
+                        help='fraction of type edges that may form cycles')
+    parser.add_argument('--contiguous', action='store_true',
+                        help='allocate function records back to back')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='runs per benchmark, the best time is used')
+    parser.add_argument('--only', action='append',
+                        help='only run the named benchmark')
+    parser.add_argument('--baseline', help='compare against this baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='allowed relative regression')
+    parser.add_argument('--save', help='write the results to this file')
+    args = parser.parse_args(argv)
+
+    # Deep type graphs are converted recursively.
+    sys.setrecursionlimit(max(sys.getrecursionlimit(), 20000))
+
+    s = standin.Synthetic(packages=args.packages, functions=args.functions,
+                          methods=args.methods, types=args.types,
+                          fields=args.fields, type_methods=args.type_methods,
+                          cycles=args.cycles, contiguous=args.contiguous)
+    standin.library.results = s
+
+    results = dict()
+    print('{:<16} {:>12} {:>14} {:>12} {:>10}'.format(
+        'benchmark', 'time (ms)', 'items/s', 'peak (KiB)', 'blocks'))
+    for name, setup in benchmarks:
+        if args.only and name not in args.only:
+            continue
+        fn, items = setup(s)
+        r = results[name] = measure(fn, items, args.repeat)
+        print('{:<16} {:>12.2f} {:>14.0f} {:>12.0f} {:>10}'.format(
+            name, r['seconds'] * 1000, r['per_second'],
+            r['peak_bytes'] / 1024, r['blocks']))
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+            f.write('\n')
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        for name, metric, old, new in regressions:
+            print('REGRESSION {} {}: {:.6g} -> {:.6g} ({:+.0%})'.format(
+                name, metric, old, new, new / old - 1))
+        if regressions:
+            return 1
+        print('No regressions against {}'.format(args.baseline))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
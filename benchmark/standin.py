@@ -0,0 +1,272 @@
+# Copyright 2019 The GoRE.tk Authors. All rights reserved.
+# Use of this source code is governed by the license that
+# can be found in the LICENSE file.
+
+'''
+A stand-in for libgore that serves synthetic results.
+
+install() must be called before pygore is imported. It makes pygore load a
+StandInLibrary instead of the shared library, so every layer of pygore runs
+unchanged on top of Synthetic graphs that are built in ctypes memory with the
+structures from pygore.internal.
+'''
+
+import ctypes
+import random
+
+_kinds = {
+    'bool': 1, 'int': 2, 'string': 24, 'array': 17, 'chan': 18, 'func': 19,
+    'interface': 20, 'map': 21, 'ptr': 22, 'slice': 23, 'struct': 25,
+}
+
+_exports = ('gore_open', 'gore_close', 'gore_setGoVersion',
+            'gore_getCompilerVersion', 'gore_getPackages', 'gore_getVendors',
+            'gore_getSTDLib', 'gore_getUnknown', 'gore_getTypes',
+            'gore_build_id')
+
+
+class _Export:
+    # pygore.internal sets argtypes and restype on the exports.
+    def __init__(self, fn):
+        self.fn = fn
+        self.argtypes = None
+        self.restype = None
+
+    def __call__(self, *args):
+        return self.fn(*args)
+
+
+class StandInLibrary:
+    '''
+    StandInLibrary implements the libgore exports used by pygore. Every file
+    that is opened is served the Synthetic results in the results attribute.
+    '''
+    def __init__(self):
+        self.results = None
+        self.opened = set()
+        for name in _exports:
+            setattr(self, name, _Export(getattr(self, '_' + name)))
+
+    def _gore_open(self, path):
+        self.opened.add(path)
+
+    def _gore_close(self, path):
+        self.opened.discard(path)
+
+    def _gore_setGoVersion(self, path, version):
+        return 1
+
+    def _gore_getCompilerVersion(self, path):
+        return ctypes.pointer(self.results.compiler_version)
+
+    def _gore_getPackages(self, path):
+        return self.results.packages['main']
+
+    def _gore_getVendors(self, path):
+        return self.results.packages['vendor']
+
+    def _gore_getSTDLib(self, path):
+        return self.results.packages['std']
+
+    def _gore_getUnknown(self, path):
+        return self.results.packages['unknown']
+
+    def _gore_getTypes(self, path):
+        return self.results.types
+
+    def _gore_build_id(self, path):
+        return self.results.build_id
+
+
+library = None
+
+
+def install():
+    '''
+    Makes pygore load the stand-in library and returns it. Must be called
+    before pygore is imported.
+    '''
+    global library
+    if library is not None:
+        return library
+    library = StandInLibrary()
+    load = ctypes.cdll.LoadLibrary
+    ctypes.cdll.LoadLibrary = lambda path: library
+    try:
+        import pygore.internal  # noqa: F401
+    finally:
+        ctypes.cdll.LoadLibrary = load
+    return library
+
+
+class Synthetic:
+    '''
+    Synthetic libgore results for one binary, allocated in ctypes memory.
+
+    Parameters
+    ----------
+    packages : int
+        number of packages in each package class.
+    functions : int
+        number of functions per package.
+    methods : int
+        number of methods per package.
+    types : int
+        number of types.
+    fields : int
+        number of fields per struct type.
+    type_methods : int
+        number of methods per struct and interface type.
+    cycles : float
+        the fraction of type edges that may point to any type, which creates
+        cycles. The remaining edges only point to types created earlier.
+    contiguous : bool
+        if True, the function records of a package are allocated back to
+        back, otherwise each record is allocated on its own.
+    seed : int
+        seed for the random choices.
+    '''
+    def __init__(self, packages=20, functions=50, methods=10, types=2000,
+                 fields=6, type_methods=2, cycles=0.1, contiguous=False,
+                 seed=0):
+        import pygore.internal as internal
+        self._internal = internal
+        self._keep = []
+        self._rnd = random.Random(seed)
+        self._addr = 0x401000
+        self._contiguous = contiguous
+
+        self.compiler_version = internal._CompilerVersion(
+            b'go1.12', b'05e77d41914d247a1e7caf37d7125ccaa5a53505',
+            b'2019-02-25T23:01:48Z')
+        self.build_id = b'synthetic/build/id'
+        self.packages = dict()
+        for cls in ('main', 'vendor', 'std', 'unknown'):
+            self.packages[cls] = self._packages(cls, packages, functions,
+                                                methods)
+        self.types = self._types(types, fields, type_methods, cycles)
+
+        self.num_functions = 4 * packages * (functions + methods)
+        self.num_types = types
+
+    def _pointer_array(self, ctype, objs):
+        arr = (ctypes.POINTER(ctype) * len(objs))(
+            *[ctypes.pointer(o) for o in objs])
+        self._keep.append(arr)
+        return arr
+
+    def _function(self, name, pkg, size):
+        f = self._internal._Function(name.encode(), self._addr,
+                                     self._addr + size, pkg.encode())
+        self._addr += size
+        return f
+
+    def _packages(self, cls, n, nfuncs, nmeths):
+        internal = self._internal
+        pkgs = []
+        for i in range(n):
+            name = '{}/pkg{}'.format(cls, i)
+            if self._contiguous:
+                funcs = (internal._Function * nfuncs)()
+                for j in range(nfuncs):
+                    funcs[j] = self._function('{}.func{}'.format(name, j),
+                                              name, 0x40)
+                funcs = [funcs[j] for j in range(nfuncs)]
+            else:
+                funcs = [self._function('{}.func{}'.format(name, j), name,
+                                        0x40) for j in range(nfuncs)]
+            meths = []
+            for j in range(nmeths):
+                f = self._function('Method{}'.format(j % 8), name, 0x20)
+                self._keep.append(f)
+                meths.append(internal._Method(
+                    '(*T{})'.format(j % 3).encode(), ctypes.pointer(f)))
+            self._keep.extend(funcs)
+            self._keep.extend(meths)
+
+            p = internal._Package()
+            p.name = name.encode()
+            p.filepath = '/src/{}'.format(name).encode()
+            p.functions = self._pointer_array(internal._Function, funcs)
+            p.methods = self._pointer_array(internal._Method, meths)
+            p.numFuncs = nfuncs
+            p.numMeths = nmeths
+            pkgs.append(p)
+        self._keep.extend(pkgs)
+        pps = internal._Packages(self._pointer_array(internal._Package, pkgs),
+                                 len(pkgs))
+        self._keep.append(pps)
+        return ctypes.pointer(pps)
+
+    def _type_list(self, types):
+        internal = self._internal
+        ts = internal._Types(self._pointer_array(internal._Type, types),
+                             len(types))
+        self._keep.append(ts)
+        return ctypes.pointer(ts)
+
+    def _types(self, n, nfields, nmeths, cycles):
+        internal = self._internal
+        rnd = self._rnd
+        kinds = ['int', 'string', 'bool', 'struct', 'struct', 'ptr', 'ptr',
+                 'slice', 'map', 'func', 'interface', 'array', 'chan']
+        types = []
+        for i in range(n):
+            t = internal._Type()
+            kind = kinds[i % len(kinds)] if i >= 3 else kinds[i]
+            t.kind = _kinds[kind]
+            t.name = 'pkg{}.T{}'.format(i % 50, i).encode()
+            t.addr = 0x500000 + i * 0x40
+            t.packagePath = 'example.com/pkg{}'.format(i % 50).encode()
+            types.append(t)
+        self._keep.extend(types)
+
+        def target(i):
+            if i < 3 or rnd.random() < cycles:
+                return types[rnd.randrange(n)]
+            return types[rnd.randrange(i)]
+
+        for i, t in enumerate(types):
+            kind = t.kind
+            if kind == _kinds['struct']:
+                fields = []
+                for j in range(nfields):
+                    ft = target(i)
+                    f = internal._Type()
+                    f.kind = ft.kind
+                    f.name = ft.name
+                    f.addr = ft.addr
+                    f.packagePath = b''
+                    f.fieldName = 'Field{}'.format(j).encode()
+                    f.fieldTag = 'json:"field{}"'.format(j).encode()
+                    fields.append(f)
+                self._keep.extend(fields)
+                t.fields = self._type_list(fields)
+            if kind in (_kinds['ptr'], _kinds['slice'], _kinds['array'],
+                        _kinds['chan'], _kinds['map']):
+                t.element = ctypes.pointer(target(i))
+            if kind == _kinds['array']:
+                t.length = 8
+            if kind == _kinds['chan']:
+                t.chanDir = 3
+            if kind == _kinds['map']:
+                t.key = ctypes.pointer(target(i))
+            if kind == _kinds['func']:
+                t.funcArgs = self._type_list([target(i) for _ in range(2)])
+                t.funcReturns = self._type_list([target(i)])
+                t.isVariadic = i % 2
+            if kind in (_kinds['struct'], _kinds['interface']) and nmeths:
+                meths = []
+                for j in range(nmeths):
+                    m = internal._Method_Type(
+                        'Method{}'.format(j).encode(),
+                        ctypes.pointer(target(i)), 0x1000 + i * 8 + j,
+                        0x2000 + i * 8 + j)
+                    meths.append(m)
+                self._keep.extend(meths)
+                ms = internal._Methods_Type(
+                    self._pointer_array(internal._Method_Type, meths),
+                    len(meths))
+                self._keep.append(ms)
+                t.methods = ctypes.pointer(ms)
+        return self._type_list(types)
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+# Copyright 2019 The GoRE.tk Authors. All rights reserved.
+# Use of this source code is governed by the license that
+# can be found in the LICENSE file.
+
+'''
+Benchmarks triage against opening every file with GoFile to get its build
+id and compiler version, on a corpus of real files.
+
+The corpus is given as files or directories, which are searched recursively,
+and should mix Go binaries with other files as in a real feed:
+
+    python benchmark/triage.py /path/to/go/binaries /usr/bin /usr/lib
+
+For every way of getting the build id and compiler version, the best wall
+time over a number of runs is reported for the Go binaries and for the other
+files. 'libgore' opens every file with GoFile, 'native' opens every file
+with the native backend and 'triage' only calls triage. Files that GoFile
+fails to open are counted as errors. Without libgore, --standin runs the
+native and triage benchmarks with the libgore stand-in.
+'''
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+
+def _gofile(backend):
+    # Every file is opened without a pre-filter, which is the baseline
+    # triage is compared against.
+    def run(path):
+        f = pygore.GoFile(path, backend=backend)
+        try:
+            f.get_build_id()
+            f.get_compiler_version()
+        finally:
+            f.close()
+    return run
+
+
+_native = _gofile('native')
+
+
+def _triage(path):
+    pygore.triage(path)
+
+
+def measure(fn, paths, repeat):
+    '''
+    Returns the best wall time in seconds of calling fn on all paths, and
+    the number of calls that raised.
+    '''
+    best, errors = None, 0
+    for _ in range(repeat):
+        errors = 0
+        start = time.perf_counter()
+        for p in paths:
+            try:
+                fn(p)
+            except Exception:
+                errors += 1
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, errors
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('paths', nargs='+', help='files or directories')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='runs per benchmark, the best time is used')
+    parser.add_argument('--limit', type=int, default=None,
+                        help='use at most this many files')
+    parser.add_argument('--standin', action='store_true',
+                        help='use the libgore stand-in, skipping libgore')
+    args = parser.parse_args(argv)
+
+    global pygore
+    if args.standin:
+        sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+        import standin
+        standin.install()
+    import pygore
+    from pygore.cli import iter_paths
+
+    paths = [p for p in iter_paths(args.paths) if os.path.isfile(p)]
+    if args.limit is not None:
+        paths = paths[:args.limit]
+    go = [p for p in paths if pygore.triage(p).is_go]
+    go_set = set(go)
+    other = [p for p in paths if p not in go_set]
+    print('{} files, {} Go binaries'.format(len(paths), len(go)))
+
+    benchmarks = [('triage', _triage), ('native', _native)]
+    if not args.standin:
+        benchmarks.append(('libgore', _gofile('libgore')))
+
+    print('{:<10} {:>15} {:>15} {:>12} {:>7}'.format(
+        'method', 'go (us/file)', 'other (us/file)', 'total (ms)', 'errors'))
+    for name, fn in benchmarks:
+        t_go, e_go = measure(fn, go, args.repeat)
+        t_other, e_other = measure(fn, other, args.repeat)
+        print('{:<10} {:>15.1f} {:>15.1f} {:>12.1f} {:>7}'.format(
+            name, t_go / max(len(go), 1) * 1e6,
+            t_other / max(len(other), 1) * 1e6,
+            (t_go + t_other) * 1000, e_go + e_other))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
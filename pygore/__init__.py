@@ -2,5 +2,21 @@
 # Use of this source code is governed by the license that
 # can be found in the LICENSE file.
 
-from .lib import CompilerVersion, Function, Method, Package, GoFile,\
-                 Method_Type, Type, Kind, ChanDir
+from .lib import Analysis, CompilerVersion, Function, Method, Package, GoFile,\
+                 Method_Type, Type, Kind, ChanDir, PackageClass, StringTable, \
+                 native_memory
+from .backend import Backend, register_backend
+from .native import NativeBackend
+from .triage import Triage, triage
+from .cache import ResultCache
+from .index import AddressIndex, TypeIndex, TypeRef
+from .scan import ScanResult, scan
+from .stats import ExtractionStats
+from .sandbox import SandboxPool, SandboxedGoFile, SandboxError, \
+                     AnalysisError, AnalysisTimeout, MemoryLimitExceeded, \
+                     WorkerCrashed
+from .aio import AsyncExecutor, AsyncGoFile
+from .export import Exporter, export
+from .corpus import CorpusStore
+from .similarity import SimilarityIndex, fingerprint, jaccard, minhash
+from .diff import Delta, Diff, diff
@@ -0,0 +1,9 @@
+# Copyright 2019 The GoRE.tk Authors. All rights reserved.
+# Use of this source code is governed by the license that
+# can be found in the LICENSE file.
+
+import sys
+
+from pygore.cli import main
+
+sys.exit(main())
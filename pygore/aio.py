@@ -0,0 +1,271 @@
+# Copyright 2019 The GoRE.tk Authors. All rights reserved.
+# Use of this source code is governed by the license that
+# can be found in the LICENSE file.
+
+import asyncio
+import os
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
+from pygore.lib import GoFile
+from pygore.sandbox import SandboxedGoFile
+
+
+class AsyncExecutor:
+    '''
+    AsyncExecutor runs the blocking calls of AsyncGoFile on a bounded pool
+    of threads. libgore is called without holding the GIL, so the calls on
+    different files run in parallel while the event loop keeps running.
+
+    Calls wait for a free thread before they are submitted, and opening a
+    file waits while max_files files are open, so callers are slowed down
+    instead of queueing unbounded work. asyncio semaphores belong to one
+    event loop, so an executor used from several event loops, for example
+    from consecutive asyncio.run calls, limits the files open and the calls
+    waiting for a thread on each loop separately. The threads are shared.
+
+    Parameters
+    ----------
+    max_workers : int
+        the number of threads, which is also the number of calls in flight.
+        Defaults to the number of CPUs.
+    max_files : int
+        the maximum number of files open at the same time, or None for no
+        limit.
+    '''
+    def __init__(self, max_workers=None, max_files=None):
+        if max_workers is None:
+            max_workers = os.cpu_count() or 1
+        if max_workers < 1 or (max_files is not None and max_files < 1):
+            raise ValueError('max_workers and max_files must be positive')
+        self.max_workers = max_workers
+        self.max_files = max_files
+        self._executor = ThreadPoolExecutor(max_workers=max_workers,
+                                            thread_name_prefix='pygore')
+        self._lock = threading.Lock()
+        self._loops = weakref.WeakKeyDictionary()
+
+    def close(self, wait=True):
+        '''
+        Shuts down the threads. Calls that have not started are cancelled.
+        '''
+        self._executor.shutdown(wait=wait, cancel_futures=True)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        self.close(wait=False)
+
+    async def run(self, lock, fn, *args):
+        '''
+        Runs fn(*args) on a thread while holding lock, and returns its
+        result.
+
+        If the awaiting task is cancelled before the call started, the call
+        is dropped. A call that already runs can not be interrupted, so it
+        finishes in the background and keeps lock and its thread until then.
+        '''
+        loop = asyncio.get_running_loop()
+        calls, _ = self._semaphores()
+        await lock.acquire()
+        try:
+            await calls.acquire()
+        except BaseException:
+            lock.release()
+            raise
+
+        def release():
+            calls.release()
+            lock.release()
+
+        try:
+            cf = self._executor.submit(fn, *args)
+        except BaseException:
+            release()
+            raise
+        cf.add_done_callback(lambda _: loop.call_soon_threadsafe(release))
+        fut = asyncio.wrap_future(cf, loop=loop)
+        try:
+            return await asyncio.shield(fut)
+        except asyncio.CancelledError:
+            cf.cancel()
+            # Retrieve the outcome so it is not logged as never retrieved.
+            fut.add_done_callback(lambda f: f.cancelled() or f.exception())
+            raise
+
+    def _semaphores(self):
+        # Returns the semaphores limiting the calls and the open files on the
+        # running event loop, created on its first use of the executor.
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            sems = self._loops.get(loop)
+            if sems is None:
+                sems = (asyncio.Semaphore(self.max_workers),
+                        asyncio.Semaphore(self.max_files)
+                        if self.max_files else None)
+                self._loops[loop] = sems
+            return sems
+
+
+_default_executor = None
+_default_lock = threading.Lock()
+
+
+def default_executor():
+    '''
+    Returns the AsyncExecutor used by AsyncGoFile when no executor is given.
+    It is created on first use.
+    '''
+    global _default_executor
+    with _default_lock:
+        if _default_executor is None:
+            _default_executor = AsyncExecutor()
+        return _default_executor
+
+
+class AsyncGoFile:
+    '''
+    AsyncGoFile is an asyncio version of GoFile, with awaitable versions of
+    its methods. Files are opened with the open coroutine:
+
+        async with await AsyncGoFile.open(path) as f:
+            types = await f.get_types()
+
+    The blocking calls run on the threads of an AsyncExecutor. Calls on one
+    file run one at a time in the order they were made, while calls on
+    different files run concurrently up to the limits of the executor.
+
+    Attributes
+    ----------
+    file : GoFile or SandboxedGoFile
+        the file the calls are made on.
+    executor : AsyncExecutor
+        the executor running the calls.
+    '''
+    def __init__(self, file, executor):
+        self.file = file
+        self.executor = executor
+        self._lock = asyncio.Lock()
+        self._closed = False
+        # The semaphore of the event loop the file was opened on, released
+        # when it is closed.
+        self._files = None
+
+    @classmethod
+    async def open(cls, path, executor=None, sandbox=None, **kwargs):
+        '''
+        Opens the file at path and returns an AsyncGoFile.
+
+        Parameters
+        ----------
+        path : str
+            path to the binary.
+        executor : AsyncExecutor
+            the executor for the blocking calls. Defaults to a shared
+            executor.
+        sandbox : SandboxPool
+            if given, the file is analyzed in a worker process of this pool
+            with a SandboxedGoFile, otherwise in this process with a GoFile.
+        kwargs
+            passed on to GoFile or SandboxedGoFile.
+        '''
+        if executor is None:
+            executor = default_executor()
+        _, files = executor._semaphores()
+        if files is not None:
+            await files.acquire()
+        try:
+            if sandbox is not None:
+                f = SandboxedGoFile(path, sandbox, **kwargs)
+            else:
+                f = await executor.run(asyncio.Lock(),
+                                       lambda: GoFile(path, **kwargs))
+        except BaseException:
+            if files is not None:
+                files.release()
+            raise
+        af = cls(f, executor)
+        af._files = files
+        return af
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def close(self):
+        '''
+        Closes the file once the calls made before have finished.
+        '''
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            await self.executor.run(self._lock, self.file.close)
+        finally:
+            if self._files is not None:
+                self._files.release()
+
+    async def set_compiler_version(self, version):
+        '''
+        Set an assumed compiler version to be used when extracting information
+        from the binary.
+        '''
+        return await self._call(self.file.set_compiler_version, version)
+
+    async def get_compiler_version(self):
+        '''
+        Returns compiler information extracted from the binary.
+        '''
+        return await self._call(self.file.get_compiler_version)
+
+    async def get_packages(self):
+        '''
+        Returns all Go packages gore thinks is part of the main project.
+        '''
+        return await self._call(self.file.get_packages)
+
+    async def get_vendor_packages(self):
+        '''
+        Returns all Go packages gore thinks is vendor or 3rd-party packages.
+        '''
+        return await self._call(self.file.get_vendor_packages)
+
+    async def get_std_lib_packages(self):
+        '''
+        Returns all Go packages gore thinks is standard library packages.
+        '''
+        return await self._call(self.file.get_std_lib_packages)
+
+    async def get_unknown_packages(self):
+        '''
+        Returns all Go packages gore could not classify.
+        '''
+        return await self._call(self.file.get_unknown_packages)
+
+    async def get_types(self):
+        '''
+        Returns all Go types extracted from the binary.
+        '''
+        return await self._call(self.file.get_types)
+
+    async def get_build_id(self):
+        '''
+        Returns the extracted build id from the binary.
+        '''
+        return await self._call(self.file.get_build_id)
+
+    async def get_all(self, types=True):
+        '''
+        Returns an Analysis with everything extracted from the binary, see
+        GoFile.get_all.
+        '''
+        return await self._call(self.file.get_all, types)
+
+    async def _call(self, fn, *args):
+        if self._closed:
+            raise ValueError('I/O operation on closed file')
+        return await self.executor.run(self._lock, fn, *args)
@@ -0,0 +1,93 @@
+# Copyright 2019 The GoRE.tk Authors. All rights reserved.
+# Use of this source code is governed by the license that
+# can be found in the LICENSE file.
+
+from abc import ABC, abstractmethod
+
+
+class Backend(ABC):
+    '''
+    Backend is the interface of the extractors a GoFile can use in place of
+    libgore for the compiler version, the build id and the packages of a
+    binary. Types are always extracted by libgore, which GoFile opens on the
+    first request for them.
+
+    A backend is created for one file by GoFile and closed with it. It must
+    be safe to call from several threads, since GoFile does not serialize
+    calls for different results.
+
+    Subclasses must implement compiler_version, build_id and packages, and
+    are made available to GoFile by name with register_backend.
+
+    Attributes
+    ----------
+    name : str
+        the name the backend is registered under.
+    path : str
+        path to the binary.
+    '''
+    name = None
+
+    def __init__(self, path):
+        self.path = path
+
+    @classmethod
+    def supports(cls, path):
+        '''
+        Returns True if the backend can analyze the file at path. Used to
+        pick a backend for GoFile(path, backend='auto').
+        '''
+        return True
+
+    @property
+    def text_start(self):
+        '''
+        The address the method offsets of the types are relative to, or
+        None if it is not known.
+        '''
+        return None
+
+    def close(self):
+        '''
+        Releases the resources held for the file. Closing twice does nothing.
+        '''
+
+    @abstractmethod
+    def compiler_version(self):
+        '''
+        Returns the CompilerVersion of the binary, or None if it is not
+        found.
+        '''
+
+    @abstractmethod
+    def build_id(self):
+        '''
+        Returns the build id of the binary, or an empty string.
+        '''
+
+    @abstractmethod
+    def packages(self, cls, strings):
+        '''
+        Returns the list of Package of the PackageClass cls, with the strings
+        interned in the StringTable strings.
+        '''
+
+
+# The backends available to GoFile by name. 'libgore' is not in here, since
+# GoFile calls libgore itself.
+backends = dict()
+
+
+def register_backend(cls):
+    '''
+    Makes the Backend subclass cls available to GoFile under cls.name, and
+    returns it so it can be used as a class decorator. Raises TypeError if
+    cls does not implement all abstract methods of Backend.
+    '''
+    if not cls.name or cls.name in ('libgore', 'auto'):
+        raise ValueError('invalid backend name: {!r}'.format(cls.name))
+    if cls.__abstractmethods__:
+        raise TypeError('backend {!r} does not implement {}'.format(
+            cls.name, ', '.join(sorted(cls.__abstractmethods__))))
+    backends[cls.name] = cls
+    return cls
@@ -0,0 +1,238 @@
+# Copyright 2019 The GoRE.tk Authors. All rights reserved.
+# Use of this source code is governed by the license that
+# can be found in the LICENSE file.
+
+import hashlib
+import os
+import pickle
+import tempfile
+import time
+import warnings
+
+import pygore.internal as internal
+from pygore.lib import _flat
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+try:
+    import msvcrt
+except ImportError:
+    msvcrt = None
+
+
+_block_size = 1 << 20
+_suffix = '.pickle'
+_tmp_suffix = '.tmp'
+# Temporary files older than this, in seconds, were left behind by writers
+# that were killed, and are removed on eviction.
+_tmp_max_age = 3600
+_library_digest = None
+
+# Changed whenever the pickled model classes change, so entries written by
+# older releases are not loaded.
+_format_version = b'3'
+
+
+class ResultCache:
+    '''
+    ResultCache is a persistent on-disk cache for extracted packages and
+    types.
+
+    Entries are keyed by the content of the analyzed file, the libgore build
+    in use and the compiler version forced with set_compiler_version, so
+    renamed copies of the same binary share entries. The least recently used
+    entries are evicted when the cache grows beyond max_size. The cache can be
+    shared by several processes: entries are written atomically and eviction
+    is serialized with a lock file.
+
+    Attributes
+    ----------
+    directory : str
+        the directory where the entries are stored.
+    max_size : int
+        the maximum total size of all entries in bytes.
+    '''
+    def __init__(self, directory, max_size=1 << 30):
+        '''
+        Parameters
+        ----------
+        directory : str
+            the directory to store the entries in. It is created if it does
+            not exist.
+        max_size : int
+            the maximum total size of all entries in bytes.
+        '''
+        self.directory = directory
+        self.max_size = max_size
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, path, compiler_version=None):
+        '''
+        Returns the cache key for the file at path when analyzed with the
+        given forced compiler version.
+        '''
+        h = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(_block_size), b''):
+                h.update(block)
+        h.update(_get_library_digest())
+        h.update(_format_version)
+        h.update((compiler_version or '').encode('utf-8'))
+        return h.hexdigest()
+
+    def get(self, key, name, default=None):
+        '''
+        Returns the entry stored under key and name or default if there is no
+        such entry.
+        '''
+        path = self._path(key, name)
+        try:
+            with open(path, 'rb') as f:
+                value = pickle.load(f)
+        except FileNotFoundError:
+            return default
+        except (pickle.UnpicklingError, EOFError, AttributeError,
+                ImportError, ValueError):
+            _remove(path)
+            return default
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return value
+
+    def put(self, key, name, value):
+        '''
+        Stores value under key and name. Returns False and warns if the
+        value could not be serialized, otherwise True.
+        '''
+        try:
+            data = pickle.dumps(_flat(value), pickle.HIGHEST_PROTOCOL)
+        except (pickle.PicklingError, RecursionError, TypeError) as e:
+            warnings.warn('cannot cache {}: {!r}'.format(name, e),
+                          RuntimeWarning, stacklevel=2)
+            return False
+
+        path = self._path(key, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path),
+                                   suffix=_tmp_suffix)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except BaseException:
+            _remove(tmp)
+            raise
+        self._evict()
+        return True
+
+    def clear(self):
+        '''
+        Removes all entries from the cache, and the temporary files of
+        writers that were killed.
+        '''
+        with _Lock(self.directory):
+            for path, _, _ in self._entries():
+                _remove(path)
+            self._remove_orphans(_tmp_max_age)
+
+    @property
+    def size(self):
+        '''
+        The total size of all entries in bytes.
+        '''
+        return sum(size for _, size, _ in self._entries())
+
+    def _path(self, key, name):
+        return os.path.join(self.directory, key[:2],
+                            '{}-{}{}'.format(key, name, _suffix))
+
+    def _entries(self):
+        for d in os.scandir(self.directory):
+            if not d.is_dir():
+                continue
+            for e in os.scandir(d.path):
+                if not e.name.endswith(_suffix):
+                    continue
+                try:
+                    st = e.stat()
+                except FileNotFoundError:
+                    continue
+                yield e.path, st.st_size, st.st_mtime
+
+    def _remove_orphans(self, max_age):
+        # Temporary files are renamed to entries by put, unless the writer was
+        # killed in between. Recent ones may still be written.
+        limit = time.time() - max_age
+        for d in os.scandir(self.directory):
+            if not d.is_dir():
+                continue
+            for e in os.scandir(d.path):
+                if not e.name.endswith(_tmp_suffix):
+                    continue
+                try:
+                    if e.stat().st_mtime < limit:
+                        _remove(e.path)
+                except FileNotFoundError:
+                    continue
+
+    def _evict(self):
+        with _Lock(self.directory):
+            self._remove_orphans(_tmp_max_age)
+            entries = list(self._entries())
+            total = sum(size for _, size, _ in entries)
+            if total <= self.max_size:
+                return
+            entries.sort(key=lambda e: e[2])
+            for path, size, _ in entries:
+                if total <= self.max_size:
+                    break
+                _remove(path)
+                total -= size
+
+
+class _Lock:
+    def __init__(self, directory):
+        self.path = os.path.join(directory, '.lock')
+        self.fd = None
+
+    def __enter__(self):
+        self.fd = os.open(self.path, os.O_RDWR | os.O_CREAT)
+        if fcntl is not None:
+            fcntl.flock(self.fd, fcntl.LOCK_EX)
+        elif msvcrt is not None:
+            msvcrt.locking(self.fd, msvcrt.LK_LOCK, 1)
+        return self
+
+    def __exit__(self, *exc):
+        if fcntl is not None:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+        elif msvcrt is not None:
+            os.lseek(self.fd, 0, os.SEEK_SET)
+            msvcrt.locking(self.fd, msvcrt.LK_UNLCK, 1)
+        os.close(self.fd)
+        self.fd = None
+
+
+def _get_library_digest():
+    # The digest of the loaded library identifies the libgore build, which is
+    # what the extracted results depend on.
+    global _library_digest
+    if _library_digest is None:
+        h = hashlib.sha256()
+        with open(internal.libPath, 'rb') as f:
+            for block in iter(lambda: f.read(_block_size), b''):
+                h.update(block)
+        _library_digest = h.digest()
+    return _library_digest
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
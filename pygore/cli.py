@@ -0,0 +1,248 @@
+# Copyright 2019 The GoRE.tk Authors. All rights reserved.
+# Use of this source code is governed by the license that
+# can be found in the LICENSE file.
+
+'''
+Scans Go binaries in parallel and writes a JSON line per file.
+
+Paths can be files, directories, which are searched recursively, or list
+files with one path per line given with --list. Files that do not look like
+Go binaries are skipped without starting an analysis. With --export the
+extracted results are also written as columnar tables. An interrupted run can
+be continued with --resume, which skips every file already in the output.
+'''
+
+import argparse
+import json
+import os
+import sys
+import time
+
+from pygore.export import Exporter, formats
+from pygore.lib import PackageClass
+from pygore.scan import scan
+from pygore.triage import is_go_binary
+
+
+def iter_paths(paths, lists=()):
+    '''
+    Yields the files in paths, searching directories recursively, followed
+    by the paths in the list files. A list file of '-' is read from stdin.
+    '''
+    for p in paths:
+        if os.path.isdir(p):
+            for root, dirs, files in os.walk(p):
+                dirs.sort()
+                for name in sorted(files):
+                    yield os.path.join(root, name)
+        else:
+            yield p
+    for name in lists:
+        f = sys.stdin if name == '-' else open(name)
+        try:
+            for line in f:
+                line = line.rstrip('\r\n')
+                if line:
+                    yield line
+        finally:
+            if f is not sys.stdin:
+                f.close()
+
+
+def done_paths(output):
+    '''
+    Returns the set of paths recorded in an output file of a previous run.
+    A truncated last line from an interrupted run is ignored. Files exported
+    to a Parquet table that was never closed are not done, since the table
+    can not be read without its footer.
+    '''
+    done = set()
+    complete = dict()
+    try:
+        f = open(output, encoding='utf-8')
+    except FileNotFoundError:
+        return done
+    with f:
+        for line in f:
+            try:
+                rec = json.loads(line)
+                path = rec['path']
+                table = rec.get('export')
+            except (ValueError, KeyError, TypeError, AttributeError):
+                continue
+            if table is not None:
+                if table not in complete:
+                    complete[table] = _is_complete(table)
+                if not complete[table]:
+                    continue
+            done.add(path)
+    return done
+
+
+def _is_complete(table):
+    # Tables in JSON Lines are written up to the last record before it is
+    # recorded. Parquet files end with their footer and magic once closed.
+    if not table.endswith('.parquet'):
+        return True
+    try:
+        with open(table, 'rb') as f:
+            f.seek(0, os.SEEK_END)
+            if f.tell() < 12:
+                return False
+            f.seek(-4, os.SEEK_END)
+            return f.read(4) == b'PAR1'
+    except OSError:
+        return False
+
+
+def _truncate_partial_line(output):
+    # Drops a line a killed run did not finish, so the records appended by
+    # the resumed run start on a line of their own.
+    try:
+        f = open(output, 'rb+')
+    except FileNotFoundError:
+        return
+    with f:
+        size = f.seek(0, os.SEEK_END)
+        end = size
+        while end > 0:
+            start = max(end - 4096, 0)
+            f.seek(start)
+            i = f.read(end - start).rfind(b'\n')
+            if i >= 0:
+                end = start + i + 1
+                break
+            end = start
+        if end < size:
+            f.truncate(end)
+
+
+def summary(result):
+    '''
+    Returns the JSON line record of a ScanResult.
+    '''
+    rec = {
+        'path': result.path,
+        'ok': result.ok,
+        'error': result.error,
+        'elapsed': round(result.elapsed, 6),
+    }
+    if not result.ok:
+        return rec
+    cv = result.compiler_version
+    rec['compiler_version'] = cv.name if cv is not None else None
+    rec['build_id'] = result.build_id
+    rec['packages'] = {cls.value: len(result.packages.get(cls, ()))
+                       for cls in PackageClass}
+    pkgs = result.all_packages()
+    rec['functions'] = sum(len(p.functions) for p in pkgs)
+    rec['methods'] = sum(len(p.methods) for p in pkgs)
+    rec['types'] = len(result.types) if result.types is not None else None
+    return rec
+
+
+def _shard(directory, format):
+    # Every run writes its own shard so a resumed run does not overwrite the
+    # tables of the runs before it.
+    i = 0
+    while os.path.exists(os.path.join(
+            directory, 'files-{}.{}'.format(i, format))):
+        i += 1
+    return str(i)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='pygore', description=__doc__.strip().split('\n\n')[0],
+        epilog=__doc__.strip().split('\n\n', 1)[1])
+    parser.add_argument('paths', nargs='*', help='files or directories')
+    parser.add_argument('-l', '--list', action='append', default=[],
+                        help="file with one path per line, '-' for stdin")
+    parser.add_argument('-j', '--workers', type=int, default=None,
+                        help='worker processes, defaults to the CPU count')
+    parser.add_argument('-o', '--output',
+                        help='JSON Lines output file, defaults to stdout')
+    parser.add_argument('--resume', action='store_true',
+                        help='skip files already in the output and append')
+    parser.add_argument('--no-types', action='store_true',
+                        help='do not extract types')
+    parser.add_argument('--all', action='store_true',
+                        help='analyze files that do not look like Go')
+    parser.add_argument('--chunksize', type=int, default=1,
+                        help='files sent to a worker at a time')
+    parser.add_argument('--export', metavar='DIR',
+                        help='also write the results as tables to DIR')
+    parser.add_argument('--format', choices=formats, default='jsonl',
+                        help='format of the exported tables')
+    parser.add_argument('--shard', help='shard name of the exported tables')
+    parser.add_argument('--backend', default='libgore',
+                        help="'libgore', 'native' or 'auto'")
+    args = parser.parse_args(argv)
+
+    if not args.paths and not args.list:
+        parser.error('no paths given')
+    if args.resume and not args.output:
+        parser.error('--resume requires --output')
+
+    done = set()
+    if args.resume:
+        done = done_paths(args.output)
+        _truncate_partial_line(args.output)
+    if args.output:
+        out = open(args.output, 'a' if args.resume else 'w',
+                   encoding='utf-8')
+    else:
+        out = sys.stdout
+    exporter = None
+    if args.export:
+        shard = args.shard
+        if shard is None:
+            os.makedirs(args.export, exist_ok=True)
+            shard = _shard(args.export, args.format)
+        exporter = Exporter(args.export, args.format, shard)
+
+    counts = {'ok': 0, 'error': 0, 'skipped': 0}
+
+    def write(rec):
+        out.write(json.dumps(rec) + '\n')
+        out.flush()
+
+    def candidates():
+        for p in iter_paths(args.paths, args.list):
+            if p in done:
+                continue
+            if not args.all and not is_go_binary(p):
+                counts['skipped'] += 1
+                write({'path': p, 'ok': False, 'skipped': True,
+                       'error': 'not a Go binary'})
+                continue
+            yield p
+
+    start = time.perf_counter()
+    try:
+        for r in scan(candidates(), workers=args.workers,
+                      types=not args.no_types, ordered=False,
+                      chunksize=args.chunksize, backend=args.backend):
+            counts['ok' if r.ok else 'error'] += 1
+            rec = summary(r)
+            if exporter is not None:
+                exporter.add(r)
+                # A file is recorded once its rows are in the tables, so a
+                # resumed run does not skip files that were never exported.
+                # Parquet tables can only be read once closed, which
+                # done_paths checks with the table in the record.
+                if exporter.format == 'jsonl':
+                    exporter.flush()
+                rec['export'] = exporter.path('files')
+            write(rec)
+    except KeyboardInterrupt:
+        print('interrupted, continue with --resume', file=sys.stderr)
+        return 130
+    finally:
+        if exporter is not None:
+            exporter.close()
+        if out is not sys.stdout:
+            out.close()
+    print('{ok} ok, {error} failed, {skipped} skipped in {:.1f}s'.format(
+        time.perf_counter() - start, **counts), file=sys.stderr)
+    return 0
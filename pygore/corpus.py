@@ -0,0 +1,564 @@
+# Copyright 2019 The GoRE.tk Authors. All rights reserved.
+# Use of this source code is governed by the license that
+# can be found in the LICENSE file.
+
+import hashlib
+import os
+from array import array
+
+from pygore.export import formats, pyarrow, _JSONLWriter, _ParquetWriter, \
+                          _column_types
+from pygore.lib import Analysis, Function, GoFile, Method, Method_Type, \
+                       Package, PackageClass, Type, _walk_types
+
+# The columns of every table written by CorpusStore.export. Packages and
+# types are keyed by the hex digest of their content, and functions and
+# methods are stored once per package with offsets relative to its base.
+# The file_* tables hold what differs between binaries: which packages and
+# types a binary has, the base its packages are loaded at and the addresses
+# of its types.
+tables = {
+    'files': ('file', 'path', 'build_id', 'compiler_version', 'error'),
+    'file_packages': ('file', 'class', 'package_id', 'base'),
+    'packages': ('package_id', 'name', 'filepath', 'num_functions',
+                 'num_methods'),
+    'functions': ('package_id', 'package', 'name', 'offset', 'end'),
+    'methods': ('package_id', 'package', 'receiver', 'name', 'offset',
+                'end'),
+    'types': ('type_id', 'kind', 'name', 'package_path', 'length',
+              'chan_dir', 'is_variadic'),
+    'fields': ('type_id', 'index', 'name', 'tag', 'anon', 'field_kind',
+               'field_type'),
+    'edges': ('src_id', 'relation', 'index', 'dst_id'),
+    'type_methods': ('type_id', 'index', 'name', 'method_id'),
+    'file_types': ('file', 'type_id', 'addr', 'ptr_resolved', 'root'),
+    'file_fields': ('file', 'type_addr', 'index', 'field_addr'),
+    'file_type_methods': ('file', 'type_addr', 'index', 'iface_offset',
+                          'func_offset'),
+}
+
+_corpus_column_types = dict(_column_types, package_id='string',
+                            base='uint64', type_id='string',
+                            src_id='string', dst_id='string',
+                            method_id='string', root='bool_')
+
+
+class CorpusStore:
+    '''
+    CorpusStore holds the results of many binaries with every package,
+    function and type structure stored once, however many binaries contain
+    it. Binaries built with the same Go version share most of the standard
+    library and the runtime types, so the memory used and the rows exported
+    grow with the unique code of the corpus rather than with the number of
+    binaries.
+
+    Packages are keyed by a hash of their name, file path and functions,
+    with the function offsets taken relative to the lowest one, which is
+    the base of the package. Functions and methods are shared between
+    packages by the same relative content. Types are keyed by a hash of
+    their structure, including the structure of all types they refer to,
+    but not of their addresses or method offsets. For every binary, only
+    the packages with their bases, the types with their addresses and the
+    method offsets and field addresses are stored.
+
+    analysis rebuilds the Analysis of a binary with its own addresses.
+    Types that are identical in everything but their address within one
+    binary are rebuilt as one type at the address of the first of them.
+    Type methods that were resolved with resolve_methods before the binary
+    was added are rebuilt resolved to the rebuilt functions and methods.
+
+    Attributes
+    ----------
+    files : list of str
+        the ids of the binaries in the store, in the order they were added.
+    '''
+    def __init__(self):
+        self.files = []
+        self._files = dict()
+        self._functions = dict()
+        self._packages = dict()
+        self._package_ids = []
+        self._types = dict()
+        self._type_ids = []
+
+    def __len__(self):
+        return len(self.files)
+
+    def __contains__(self, file_id):
+        return file_id in self._files
+
+    def add(self, result, file_id=None):
+        '''
+        Adds the results of one binary and returns its id.
+
+        Parameters
+        ----------
+        result : Analysis or GoFile
+            the results to add. A GoFile is added with get_all.
+        file_id : str
+            the id of the binary. Defaults to the path. Ids must be unique
+            within the store.
+        '''
+        if isinstance(result, GoFile):
+            result = result.get_all()
+        elif not isinstance(result, Analysis):
+            raise TypeError('expected Analysis or GoFile, got {}'.format(
+                type(result).__name__))
+        fid = result.path if file_id is None else file_id
+        if fid in self._files:
+            raise ValueError('duplicate file id: {}'.format(fid))
+        f = _File(result)
+        pkgs = [(cls, p) for cls in PackageClass
+                for p in result.packages.get(cls, ())]
+        f.packages = [(cls, self._add_package(p)) for cls, p in pkgs]
+        if result.types is not None:
+            self._add_types(f, result.types, [p for _, p in pkgs])
+        self._files[fid] = f
+        self.files.append(fid)
+        return fid
+
+    def analysis(self, file_id, types=True):
+        '''
+        Returns a new Analysis of the binary with the given id, with the
+        addresses of the binary. Unless types is False, the types are rebuilt
+        too. The strings are shared with the store.
+        '''
+        f = self._files[file_id]
+        a = Analysis(f.path, f.compiler_version, f.build_id)
+        for cls in PackageClass:
+            a.packages[cls] = []
+        for cls, (pid, base) in f.packages:
+            a.packages[cls].append(_rebase(self._package_ids[pid], base))
+        if f.error is not None:
+            a.error = f.error
+        if types and f.type_ids is not None:
+            a.types = self._rebuild_types(f, [
+                fn for cls in PackageClass for p in a.packages[cls]
+                for fn in p.functions + p.methods])
+        return a
+
+    def sizes(self):
+        '''
+        Returns a dict with the number of packages, functions, methods and
+        types in all binaries, and with the numbers stored once for the
+        corpus, in the unique_* entries.
+        '''
+        pkgs = [self._package_ids[pid] for f in self._files.values()
+                for _, (pid, _) in f.packages]
+        return {
+            'files': len(self._files),
+            'packages': len(pkgs),
+            'functions': sum(len(p.functions) for p in pkgs),
+            'methods': sum(len(p.methods) for p in pkgs),
+            'types': sum(len(f.type_ids or ()) for f in
+                         self._files.values()),
+            'unique_packages': len(self._package_ids),
+            'unique_functions': sum(1 for f in self._functions.values()
+                                    if not isinstance(f, Method)),
+            'unique_methods': sum(1 for f in self._functions.values()
+                                  if isinstance(f, Method)),
+            'unique_types': len(self._type_ids),
+        }
+
+    def export(self, directory, format='jsonl', shard=None):
+        '''
+        Writes the store into one file per table in directory, see the
+        tables dict for the columns, and returns the number of rows written
+        to each table. The files are named like the ones of Exporter.
+        '''
+        if format not in formats:
+            raise ValueError('unknown format: {}'.format(format))
+        if format == 'parquet' and pyarrow is None:
+            raise ImportError('pyarrow is required for parquet export')
+        os.makedirs(directory, exist_ok=True)
+        rows = dict()
+        for name, columns in self._columns().items():
+            table = name if shard is None else '{}-{}'.format(name, shard)
+            path = os.path.join(directory, table + '.' + format)
+            if format == 'jsonl':
+                w = _JSONLWriter(path, tables[name])
+            else:
+                w = _ParquetWriter(path, tables[name], _corpus_column_types)
+            try:
+                w.write(columns)
+            finally:
+                w.close()
+            rows[name] = len(columns[0])
+        return rows
+
+    def _add_package(self, p):
+        base = min((f.offset for f in p.functions + p.methods), default=0)
+        fkeys = tuple((f.name, f.offset - base, f.end - base, f.package_name)
+                      for f in p.functions)
+        mkeys = tuple((m.name, m.offset - base, m.end - base, m.package_name,
+                       m.receiver) for m in p.methods)
+        digest = _digest(repr((p.name, p.filepath, fkeys, mkeys)))
+        try:
+            return self._packages[digest].id, base
+        except KeyError:
+            pass
+        shared = self._functions
+        funcs = []
+        for k in fkeys:
+            f = shared.get(k)
+            if f is None:
+                f = shared[k] = Function(*k)
+            funcs.append(f)
+        meths = []
+        for k in mkeys:
+            m = shared.get(k)
+            if m is None:
+                m = shared[k] = Method(*k)
+            meths.append(m)
+        pkg = _SharedPackage(len(self._package_ids), digest, p.name,
+                             p.filepath, funcs, meths)
+        self._packages[digest] = pkg
+        self._package_ids.append(pkg)
+        return pkg.id, base
+
+    def _add_types(self, f, roots, pkgs):
+        types = list(_walk_types(list(roots)))
+        pos = {t.addr: i for i, t in enumerate(types)}
+        refs = [_refs(t, pos) for t in types]
+        digests = _type_digests(types, refs)
+
+        # The shared copies of new types are created before they are linked,
+        # since types can refer to each other in cycles.
+        new = []
+        for t, d in zip(types, digests):
+            if d not in self._types:
+                s = self._types[d] = _SharedType(len(self._type_ids), d, t)
+                self._type_ids.append(s)
+                new.append((s, t))
+        for s, t in new:
+            s.link(t, self._types, digests, pos)
+
+        f.type_ids = array('L', (self._types[d].id for d in digests))
+        f.addrs = array('Q', (t.addr for t in types))
+        f.ptrs = array('Q', (t.ptrResolved or 0 for t in types))
+        f.roots = array('L', (pos[t.addr] for t in roots))
+        f.field_addrs = array('Q', (x.addr for t in types
+                                    for x in t.fields or ()))
+        offsets = f.method_offsets = array('Q')
+        for t in types:
+            for m in t.methods or ():
+                offsets.append(m.ifaceOffset)
+                offsets.append(m.funcOffset)
+
+        # Resolved methods are stored as positions in the functions and
+        # methods of the packages of the binary, plus one, or 0 for None.
+        index = None
+        funcs = array('L')
+        for t in types:
+            for m in t.methods or ():
+                for fn in (m.ifaceFunction, m.function):
+                    if fn is not None and index is None:
+                        index = {id(x): i + 1 for i, x in enumerate(
+                            x for p in pkgs for x in p.functions + p.methods)}
+                    funcs.append(0 if fn is None else index.get(id(fn), 0))
+        f.method_funcs = funcs if index is not None else None
+
+    def _rebuild_types(self, f, funcs):
+        shared = self._type_ids
+        types = []
+        first = dict()
+        fields = iter(f.field_addrs)
+        offsets = iter(f.method_offsets)
+        for sid, addr, ptr in zip(f.type_ids, f.addrs, f.ptrs):
+            t = shared[sid].copy(addr, ptr, fields, offsets)
+            types.append(t)
+            first.setdefault(sid, t)
+        get = first.get
+        for sid, t in zip(f.type_ids, types):
+            s = shared[sid]
+            if s.element is not None:
+                t.element = get(s.element)
+            if s.key is not None:
+                t.key = get(s.key)
+            if s.args is not None:
+                t.funcArgs = [get(a) for a in s.args]
+            if s.returns is not None:
+                t.funcReturns = [get(r) for r in s.returns]
+            for m, mid in zip(t.methods or (), s.method_types):
+                if mid is not None:
+                    m.type = get(mid)
+        if f.method_funcs is not None:
+            refs = iter(f.method_funcs)
+            for t in types:
+                for m in t.methods or ():
+                    i, j = next(refs), next(refs)
+                    m.ifaceFunction = funcs[i - 1] if i else None
+                    m.function = funcs[j - 1] if j else None
+        return [types[i] for i in f.roots]
+
+    def _columns(self):
+        cols = {name: [[] for _ in columns] for name, columns in
+                tables.items()}
+
+        def add(name, *row):
+            for col, value in zip(cols[name], row):
+                col.append(value)
+
+        ids = self._package_ids
+        types = self._type_ids
+        for fid in self.files:
+            f = self._files[fid]
+            cv = f.compiler_version.name if f.compiler_version is not None \
+                else None
+            add('files', fid, f.path, f.build_id, cv, f.error)
+            for cls, (pid, base) in f.packages:
+                add('file_packages', fid, cls.value, ids[pid].digest, base)
+            if f.type_ids is None:
+                continue
+            roots = set(f.roots)
+            fields = iter(f.field_addrs)
+            offsets = iter(f.method_offsets)
+            for i, (sid, addr, ptr) in enumerate(zip(f.type_ids, f.addrs,
+                                                     f.ptrs)):
+                s = types[sid]
+                add('file_types', fid, s.digest, addr, ptr, i in roots)
+                for j in range(len(s.type.fields or ())):
+                    add('file_fields', fid, addr, j, next(fields))
+                for j in range(len(s.type.methods or ())):
+                    add('file_type_methods', fid, addr, j, next(offsets),
+                        next(offsets))
+
+        for p in ids:
+            add('packages', p.digest, p.name, p.filepath, len(p.functions),
+                len(p.methods))
+            for fn in p.functions:
+                add('functions', p.digest, fn.package_name, fn.name,
+                    fn.offset, fn.end)
+            for m in p.methods:
+                add('methods', p.digest, m.package_name, m.receiver, m.name,
+                    m.offset, m.end)
+
+        for s in types:
+            t = s.type
+            add('types', s.digest, t.kind.name if t.kind is not None
+                else None, t.name, t.packagePath, t.length,
+                t.chanDir.name if t.chanDir is not None else None,
+                bool(t.isVariadic))
+            for i, x in enumerate(t.fields or ()):
+                add('fields', s.digest, i, x.fieldName, x.fieldTag,
+                    bool(x.fieldAnon), x.kind.name if x.kind is not None
+                    else None, x.name)
+            if s.element is not None:
+                add('edges', s.digest, 'element', 0, types[s.element].digest)
+            if s.key is not None:
+                add('edges', s.digest, 'key', 0, types[s.key].digest)
+            for i, a in enumerate(s.args or ()):
+                add('edges', s.digest, 'arg', i, types[a].digest)
+            for i, r in enumerate(s.returns or ()):
+                add('edges', s.digest, 'return', i, types[r].digest)
+            for i, (m, mid) in enumerate(zip(t.methods or (),
+                                             s.method_types)):
+                add('type_methods', s.digest, i, m.name, None if mid is None
+                    else types[mid].digest)
+                if mid is not None:
+                    add('edges', s.digest, 'method', i, types[mid].digest)
+        return cols
+
+
+class _File:
+    # What is stored for one binary. The types are stored as arrays in the
+    # order of _walk_types: the shared type, the addr and the ptrResolved of
+    # every type, and the field addresses, method offsets and resolved
+    # method functions of all of them in order.
+    __slots__ = ('path', 'build_id', 'compiler_version', 'error', 'packages',
+                 'type_ids', 'addrs', 'ptrs', 'roots', 'field_addrs',
+                 'method_offsets', 'method_funcs')
+
+    def __init__(self, a):
+        self.path = a.path
+        self.build_id = a.build_id
+        self.compiler_version = a.compiler_version
+        self.error = getattr(a, 'error', None)
+        self.packages = []
+        self.type_ids = None
+        self.method_funcs = None
+
+
+class _SharedPackage(Package):
+    # A package with the offsets of its functions relative to its base.
+    __slots__ = ('id', 'digest')
+
+    def __init__(self, id, digest, name, filepath, functions, methods):
+        super().__init__(name, filepath, functions, methods)
+        self.id = id
+        self.digest = digest
+
+
+class _SharedType:
+    # The shared copy of a type, with its references as ids of shared types.
+    # The copy in type has no addresses and no method offsets.
+    __slots__ = ('id', 'digest', 'type', 'element', 'key', 'args', 'returns',
+                 'method_types')
+
+    def __init__(self, id, digest, t):
+        self.id = id
+        self.digest = digest
+        self.type = Type(
+            kind=t.kind, name=t.name, packagePath=t.packagePath,
+            fields=None if t.fields is None else [
+                Type(kind=x.kind, name=x.name, fieldName=x.fieldName,
+                     fieldTag=x.fieldTag, fieldAnon=x.fieldAnon)
+                for x in t.fields],
+            length=t.length, chanDir=t.chanDir, isVariadic=t.isVariadic,
+            methods=None if t.methods is None else [
+                Method_Type(m.name, None, None, None) for m in t.methods])
+
+    def link(self, t, shared, digests, pos):
+        def sid(r):
+            return None if r is None else shared[digests[pos[r.addr]]].id
+        self.element = sid(t.element)
+        self.key = sid(t.key)
+        self.args = None if t.funcArgs is None else tuple(
+            sid(a) for a in t.funcArgs)
+        self.returns = None if t.funcReturns is None else tuple(
+            sid(r) for r in t.funcReturns)
+        self.method_types = tuple(sid(m.type) for m in t.methods or ())
+
+    def copy(self, addr, ptr, fields, offsets):
+        # Returns an unlinked copy at addr, taking the field addresses and
+        # the method offsets from the iterators.
+        s = self.type
+        t = Type(kind=s.kind, name=s.name, addr=addr, ptrResolved=ptr,
+                 packagePath=s.packagePath, length=s.length,
+                 chanDir=s.chanDir, isVariadic=s.isVariadic)
+        if s.fields is not None:
+            t.fields = [Type(kind=x.kind, name=x.name, addr=next(fields),
+                             fieldName=x.fieldName, fieldTag=x.fieldTag,
+                             fieldAnon=x.fieldAnon) for x in s.fields]
+        if s.methods is not None:
+            t.methods = [Method_Type(m.name, None, next(offsets),
+                                     next(offsets)) for m in s.methods]
+        return t
+
+
+def _rebase(p, base):
+    return Package(p.name, p.filepath,
+                   [Function(f.name, f.offset + base, f.end + base,
+                             f.package_name) for f in p.functions],
+                   [Method(m.name, m.offset + base, m.end + base,
+                           m.package_name, m.receiver) for m in p.methods])
+
+
+def _digest(s):
+    return hashlib.blake2b(s.encode('utf-8'), digest_size=16).hexdigest()
+
+
+def _refs(t, pos):
+    # The positions of the types t refers to, in a fixed order, with None
+    # for missing references.
+    def p(r):
+        return None if r is None else pos[r.addr]
+    refs = [p(t.element), p(t.key)]
+    refs.extend(p(a) for a in t.funcArgs or ())
+    refs.extend(p(r) for r in t.funcReturns or ())
+    refs.extend(p(m.type) for m in t.methods or ())
+    return refs
+
+
+def _content(t):
+    # Everything about a type but its references, addresses and method
+    # offsets.
+    return repr((
+        t.kind.value if t.kind is not None else None, t.name,
+        t.packagePath, t.length,
+        t.chanDir.value if t.chanDir is not None else None,
+        bool(t.isVariadic),
+        None if t.fields is None else tuple(
+            (x.fieldName, x.fieldTag, bool(x.fieldAnon),
+             x.kind.value if x.kind is not None else None, x.name)
+            for x in t.fields),
+        None if t.methods is None else tuple(m.name for m in t.methods),
+        None if t.funcArgs is None else len(t.funcArgs),
+        None if t.funcReturns is None else len(t.funcReturns)))
+
+
+def _type_digests(types, refs):
+    '''
+    Returns the digest of the structure of every type, given the positions
+    each type refers to.
+
+    Types that are not part of a cycle are hashed with the digests of the
+    types they refer to. The types of a cycle are hashed by colour
+    refinement: every type starts with the hash of its content and of the
+    digests of the types it refers to outside of the cycle, and is rehashed
+    with the hashes of the types it refers to in the cycle until no more
+    types are told apart. The strongly connected components are visited in
+    reverse topological order, so the digests of the types outside of a
+    component are known when it is hashed.
+    '''
+    digests = [None] * len(types)
+    for scc in _components(refs):
+        members = set(scc)
+        if len(scc) == 1 and scc[0] not in refs[scc[0]]:
+            i = scc[0]
+            digests[i] = _digest(_content(types[i]) + ''.join(
+                '-' if r is None else digests[r] for r in refs[i]))
+            continue
+        colours = {i: _digest(_content(types[i]) + ''.join(
+            '-' if r is None else '*' if r in members else digests[r]
+            for r in refs[i])) for i in scc}
+        n = len(set(colours.values()))
+        while True:
+            colours = {i: _digest(colours[i] + ''.join(
+                '-' if r is None else colours[r] if r in members else
+                digests[r] for r in refs[i])) for i in scc}
+            m = len(set(colours.values()))
+            if m == n:
+                break
+            n = m
+        for i in scc:
+            digests[i] = colours[i]
+    return digests
+
+
+def _components(refs):
+    # Tarjan's algorithm without recursion, since type graphs can be deeper
+    # than the recursion limit. Yields the strongly connected components in
+    # reverse topological order.
+    n = len(refs)
+    index = [None] * n
+    low = [0] * n
+    on_stack = [False] * n
+    stack = []
+    counter = 0
+    for root in range(n):
+        if index[root] is not None:
+            continue
+        work = [(root, 0)]
+        while work:
+            v, i = work.pop()
+            if i == 0:
+                index[v] = low[v] = counter
+                counter += 1
+                stack.append(v)
+                on_stack[v] = True
+            edges = refs[v]
+            while i < len(edges):
+                w = edges[i]
+                i += 1
+                if w is None:
+                    continue
+                if index[w] is None:
+                    work.append((v, i))
+                    work.append((w, 0))
+                    break
+                if on_stack[w]:
+                    low[v] = min(low[v], index[w])
+            else:
+                if low[v] == index[v]:
+                    scc = []
+                    while True:
+                        w = stack.pop()
+                        on_stack[w] = False
+                        scc.append(w)
+                        if w == v:
+                            break
+                    yield scc
+                if work:
+                    u = work[-1][0]
+                    low[u] = min(low[u], low[v])
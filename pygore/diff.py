@@ -0,0 +1,211 @@
+# Copyright 2019 The GoRE.tk Authors. All rights reserved.
+# Use of this source code is governed by the license that
+# can be found in the LICENSE file.
+
+from pygore.lib import Analysis, GoFile, PackageClass, _walk_types
+
+
+class Delta:
+    '''
+    Delta is what changed between two binaries for one kind of item:
+    packages, functions, methods or types. The lists are sorted by the keys
+    of the items.
+
+    Attributes
+    ----------
+    added : list
+        the items only in the new binary.
+    removed : list
+        the items only in the old binary.
+    changed : list of tuple
+        (old, new) pairs of the items in both binaries that differ.
+    '''
+    __slots__ = ('added', 'removed', 'changed')
+
+    def __init__(self, added, removed, changed):
+        self.added = added
+        self.removed = removed
+        self.changed = changed
+
+    def __len__(self):
+        return len(self.added) + len(self.removed) + len(self.changed)
+
+    def __bool__(self):
+        return len(self) > 0
+
+
+class Diff:
+    '''
+    Diff is the structural difference between an old and a new binary,
+    returned by diff.
+
+    Packages are matched by name. A package changed if its file path or
+    class changed, or if any of its functions or methods were added, removed
+    or changed. Functions are matched by package and name, and methods by
+    package, receiver and name, and changed if their size changed. Their
+    addresses are not compared, since they move with every change to the
+    code before them. Types are matched by name and package path, and
+    changed if their kind, length, channel direction, field layout,
+    signature, method names or the names of the types they refer to
+    changed.
+
+    Attributes
+    ----------
+    old_path : str
+        path to the old binary.
+    new_path : str
+        path to the new binary.
+    packages : Delta
+        the Package changes, with (PackageClass, Package) items.
+    functions : Delta
+        the Function changes.
+    methods : Delta
+        the Method changes.
+    types : Delta
+        the Type changes, or None if types were not compared.
+    '''
+    def __init__(self, old_path, new_path, packages, functions, methods,
+                 types=None):
+        self.old_path = old_path
+        self.new_path = new_path
+        self.packages = packages
+        self.functions = functions
+        self.methods = methods
+        self.types = types
+
+    def __bool__(self):
+        return bool(self.packages or self.functions or self.methods or
+                    self.types)
+
+    def summary(self):
+        '''
+        Returns a dict with the number of added, removed and changed items
+        of every kind, for example {'functions': {'added': 1, 'removed': 0,
+        'changed': 2}, ...}.
+        '''
+        deltas = [('packages', self.packages), ('functions', self.functions),
+                  ('methods', self.methods), ('types', self.types)]
+        return {name: {'added': len(d.added), 'removed': len(d.removed),
+                       'changed': len(d.changed)}
+                for name, d in deltas if d is not None}
+
+
+def diff(old, new, types=True):
+    '''
+    Returns the Diff between two binaries.
+
+    Both sides are indexed by their keys in dicts and joined, so the diff
+    takes time linear in the number of items, plus sorting the changes.
+    Only the results are compared, so the old side can be an Analysis kept
+    from an earlier run, for example from pickle, ResultCache or
+    CorpusStore.analysis, instead of the binary itself.
+
+    Parameters
+    ----------
+    old : Analysis or GoFile
+        the results of the old binary.
+    new : Analysis or GoFile
+        the results of the new binary.
+    types : bool
+        if False, types are not compared. Types are also not compared if
+        either Analysis was created without them.
+    '''
+    old_path, old_pkgs, old_types = _results(old, types)
+    new_path, new_pkgs, new_types = _results(new, types)
+
+    old_funcs, old_meths = _functions(old_pkgs)
+    new_funcs, new_meths = _functions(new_pkgs)
+    functions, fkeys = _join(old_funcs, new_funcs, _size)
+    methods, mkeys = _join(old_meths, new_meths, _size)
+
+    # Packages whose functions or methods changed changed too.
+    touched = {k[0] for k in fkeys + mkeys}
+    packages, _ = _join(old_pkgs, new_pkgs,
+                        lambda e: (e[0], e[1].filepath), touched)
+
+    type_delta = None
+    if old_types is not None and new_types is not None:
+        type_delta, _ = _join(_type_keys(old_types), _type_keys(new_types),
+                              _layout)
+    return Diff(old_path, new_path, packages, functions, methods, type_delta)
+
+
+def _results(r, types):
+    # Returns the path, the (class, package) entries by package name and the
+    # types of a GoFile or Analysis.
+    if isinstance(r, GoFile):
+        path = r.path.decode('utf-8')
+        pkgs = [(cls, p) for cls in PackageClass for p in r._packages(cls)]
+        roots = r.get_types() if types else None
+    elif isinstance(r, Analysis):
+        path = r.path
+        pkgs = [(cls, p) for cls in PackageClass
+                for p in r.packages.get(cls, ())]
+        roots = r.types if types else None
+    else:
+        raise TypeError('expected Analysis or GoFile, got {}'.format(
+            type(r).__name__))
+    entries = dict()
+    for cls, p in pkgs:
+        entries.setdefault(p.name, (cls, p))
+    return path, entries, roots
+
+
+def _functions(pkgs):
+    funcs = dict()
+    meths = dict()
+    for _, p in pkgs.values():
+        for f in p.functions:
+            funcs.setdefault((p.name, f.name), f)
+        for m in p.methods:
+            meths.setdefault((p.name, m.receiver, m.name), m)
+    return funcs, meths
+
+
+def _type_keys(roots):
+    # Types with the same name and package path are the same type in a
+    # binary, so only the first one found is kept.
+    types = dict()
+    for t in _walk_types(list(roots)):
+        types.setdefault((t.name, t.packagePath), t)
+    return types
+
+
+def _join(old, new, signature, touched=()):
+    # Returns the Delta of the items of the dicts old and new by key, where
+    # items in both changed if their signatures differ or their key is in
+    # touched, and the keys of all items in the Delta.
+    added = sorted((k for k in new if k not in old), key=_sort_key)
+    removed = sorted((k for k in old if k not in new), key=_sort_key)
+    changed = sorted((k for k, v in new.items() if k in old and (
+        k in touched or signature(old[k]) != signature(v))), key=_sort_key)
+    return Delta([new[k] for k in added], [old[k] for k in removed],
+                 [(old[k], new[k]) for k in changed]), \
+        added + removed + changed
+
+
+def _sort_key(k):
+    # Names can be None in results that were not extracted by libgore.
+    if isinstance(k, tuple):
+        return tuple('' if x is None else x for x in k)
+    return '' if k is None else k
+
+
+def _size(f):
+    return f.end - f.offset
+
+
+def _name(t):
+    return None if t is None else t.name
+
+
+def _layout(t):
+    return (
+        t.kind, t.length, t.chanDir, bool(t.isVariadic),
+        None if t.fields is None else [
+            (f.fieldName, f.name, f.fieldTag, bool(f.fieldAnon))
+            for f in t.fields],
+        _name(t.element), _name(t.key),
+        None if t.funcArgs is None else [a.name for a in t.funcArgs],
+        None if t.funcReturns is None else [r.name for r in t.funcReturns],
+        None if t.methods is None else [m.name for m in t.methods])
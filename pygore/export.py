@@ -0,0 +1,298 @@
+# Copyright 2019 The GoRE.tk Authors. All rights reserved.
+# Use of this source code is governed by the license that
+# can be found in the LICENSE file.
+
+import json
+import os
+
+from pygore.lib import Analysis, GoFile, PackageClass, _walk_types
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+# The columns of every exported table. All tables have a file column with
+# the id of the binary the row belongs to. Types are keyed by addr, and the
+# fields, edges and type_methods tables refer to types by their addr.
+tables = {
+    'files': ('file', 'path', 'build_id', 'compiler_version', 'error'),
+    'packages': ('file', 'class', 'name', 'filepath', 'num_functions',
+                 'num_methods'),
+    'functions': ('file', 'class', 'package', 'name', 'offset', 'end'),
+    'methods': ('file', 'class', 'package', 'receiver', 'name', 'offset',
+                'end'),
+    'types': ('file', 'addr', 'kind', 'name', 'package_path', 'ptr_resolved',
+              'length', 'chan_dir', 'is_variadic'),
+    'fields': ('file', 'type_addr', 'index', 'name', 'tag', 'anon',
+               'field_addr', 'field_kind', 'field_type'),
+    'edges': ('file', 'src_addr', 'relation', 'index', 'dst_addr'),
+    'type_methods': ('file', 'type_addr', 'name', 'method_addr',
+                     'iface_offset', 'func_offset'),
+}
+
+formats = ('jsonl', 'parquet')
+
+# The Arrow type of every column, used for the Parquet schemas.
+_column_types = {
+    'file': 'string', 'path': 'string', 'build_id': 'string',
+    'compiler_version': 'string', 'error': 'string', 'class': 'string',
+    'name': 'string', 'filepath': 'string', 'num_functions': 'int64',
+    'num_methods': 'int64', 'package': 'string', 'receiver': 'string',
+    'offset': 'uint64', 'end': 'uint64', 'addr': 'uint64', 'kind': 'string',
+    'package_path': 'string', 'ptr_resolved': 'uint64', 'length': 'int64',
+    'chan_dir': 'string', 'is_variadic': 'bool_', 'type_addr': 'uint64',
+    'index': 'int64', 'tag': 'string', 'anon': 'bool_',
+    'field_addr': 'uint64', 'field_kind': 'string', 'field_type': 'string',
+    'src_addr': 'uint64', 'relation': 'string', 'dst_addr': 'uint64',
+    'method_addr': 'uint64', 'iface_offset': 'uint64',
+    'func_offset': 'uint64',
+}
+
+
+class Exporter:
+    '''
+    Exporter writes the results of many binaries into one table per kind of
+    record: files, packages, functions, methods, types, fields, edges and
+    type_methods. See the tables dict for the columns.
+
+    Results are collected into columnar batches and written when a batch
+    reaches batch_size rows, so a corpus can be streamed through an Exporter
+    with bounded memory. Every table is written to its own file in directory,
+    named <table>.<format>, or <table>-<shard>.<format> if a shard name is
+    given. Processes exporting different parts of a corpus should use
+    different shard names so they can write to the same directory.
+
+    Parameters
+    ----------
+    directory : str
+        the directory to write the tables to. It is created if needed.
+    format : str
+        'jsonl' for JSON Lines, or 'parquet' which requires pyarrow.
+    shard : str
+        optional name added to the file names.
+    batch_size : int
+        the number of rows of a table buffered before they are written.
+    '''
+    def __init__(self, directory, format='jsonl', shard=None,
+                 batch_size=65536):
+        if format not in formats:
+            raise ValueError('unknown format: {}'.format(format))
+        if format == 'parquet' and pyarrow is None:
+            raise ImportError('pyarrow is required for parquet export')
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.format = format
+        self.shard = shard
+        self.batch_size = batch_size
+        self.rows = {name: 0 for name in tables}
+        self._batches = {name: _empty(name) for name in tables}
+        self._writers = dict()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def path(self, table):
+        '''
+        Returns the path of the file the table is written to.
+        '''
+        name = table if self.shard is None else '{}-{}'.format(
+            table, self.shard)
+        return os.path.join(self.directory, name + '.' + self.format)
+
+    def add(self, result, file_id=None):
+        '''
+        Adds the results of one binary.
+
+        Parameters
+        ----------
+        result : Analysis or GoFile
+            the results to export. A GoFile is exported with get_all. A
+            ScanResult with an error only adds a row to the files table.
+        file_id : str
+            the id of the binary in the file column. Defaults to the path.
+        '''
+        if isinstance(result, GoFile):
+            result = result.get_all()
+        elif not isinstance(result, Analysis):
+            raise TypeError('expected Analysis or GoFile, got {}'.format(
+                type(result).__name__))
+        fid = result.path if file_id is None else file_id
+        for name, columns in _columns(result, fid).items():
+            batch = self._batches[name]
+            for col, values in zip(batch, columns):
+                col.extend(values)
+            if len(batch[0]) >= self.batch_size:
+                self._write(name)
+
+    def flush(self):
+        '''
+        Writes all buffered rows. Rows written to JSON Lines files are
+        flushed to the operating system.
+        '''
+        for name in tables:
+            if self._batches[name][0]:
+                self._write(name)
+
+    def close(self):
+        '''
+        Writes all buffered rows and closes the files. Tables that did not
+        get any rows are written as empty files.
+        '''
+        self.flush()
+        for name in tables:
+            if name not in self._writers:
+                self._open(name)
+        for w in self._writers.values():
+            w.close()
+        self._writers = dict()
+
+    def _open(self, name):
+        path = self.path(name)
+        if self.format == 'jsonl':
+            w = self._writers[name] = _JSONLWriter(path, tables[name])
+        else:
+            w = self._writers[name] = _ParquetWriter(path, tables[name])
+        return w
+
+    def _write(self, name):
+        batch = self._batches[name]
+        w = self._writers.get(name) or self._open(name)
+        w.write(batch)
+        self.rows[name] += len(batch[0])
+        self._batches[name] = _empty(name)
+
+
+def export(results, directory, format='jsonl', shard=None,
+           batch_size=65536):
+    '''
+    Exports an iterable of Analysis objects, for example the results of scan,
+    with an Exporter and returns the number of rows written to each table.
+    '''
+    with Exporter(directory, format, shard, batch_size) as e:
+        for r in results:
+            e.add(r)
+    return dict(e.rows)
+
+
+def _empty(name):
+    return [[] for _ in tables[name]]
+
+
+def _columns(a, fid):
+    cols = dict()
+    cv = a.compiler_version.name if a.compiler_version is not None else None
+    cols['files'] = ([fid], [a.path], [a.build_id], [cv],
+                     [getattr(a, 'error', None)])
+
+    pkgs = [(cls.value, p) for cls in PackageClass
+            for p in a.packages.get(cls, ())]
+    n = len(pkgs)
+    cols['packages'] = (
+        [fid] * n, [c for c, _ in pkgs], [p.name for _, p in pkgs],
+        [p.filepath for _, p in pkgs], [len(p.functions) for _, p in pkgs],
+        [len(p.methods) for _, p in pkgs])
+
+    funcs = [(c, f) for c, p in pkgs for f in p.functions]
+    n = len(funcs)
+    cols['functions'] = (
+        [fid] * n, [c for c, _ in funcs],
+        [f.package_name for _, f in funcs], [f.name for _, f in funcs],
+        [f.offset for _, f in funcs], [f.end for _, f in funcs])
+
+    meths = [(c, m) for c, p in pkgs for m in p.methods]
+    n = len(meths)
+    cols['methods'] = (
+        [fid] * n, [c for c, _ in meths],
+        [m.package_name for _, m in meths], [m.receiver for _, m in meths],
+        [m.name for _, m in meths], [m.offset for _, m in meths],
+        [m.end for _, m in meths])
+
+    cols.update(_type_columns(a.types or (), fid))
+    return cols
+
+
+def _type_columns(roots, fid):
+    types = list(_walk_types(roots))
+    n = len(types)
+    cols = dict()
+    cols['types'] = (
+        [fid] * n, [t.addr for t in types],
+        [t.kind.name if t.kind is not None else None for t in types],
+        [t.name for t in types], [t.packagePath for t in types],
+        [t.ptrResolved for t in types], [t.length for t in types],
+        [t.chanDir.name if t.chanDir is not None else None for t in types],
+        [bool(t.isVariadic) for t in types])
+
+    fields = [(t.addr, i, f) for t in types for i, f in
+              enumerate(t.fields or ())]
+    n = len(fields)
+    cols['fields'] = (
+        [fid] * n, [a for a, _, _ in fields], [i for _, i, _ in fields],
+        [f.fieldName for _, _, f in fields],
+        [f.fieldTag for _, _, f in fields],
+        [bool(f.fieldAnon) for _, _, f in fields],
+        [f.addr for _, _, f in fields],
+        [f.kind.name if f.kind is not None else None for _, _, f in fields],
+        [f.name for _, _, f in fields])
+
+    edges = []
+    for t in types:
+        if t.element is not None:
+            edges.append((t.addr, 'element', 0, t.element.addr))
+        if t.key is not None:
+            edges.append((t.addr, 'key', 0, t.key.addr))
+        for i, arg in enumerate(t.funcArgs or ()):
+            edges.append((t.addr, 'arg', i, arg.addr))
+        for i, ret in enumerate(t.funcReturns or ()):
+            edges.append((t.addr, 'return', i, ret.addr))
+        for i, m in enumerate(t.methods or ()):
+            if m.type is not None:
+                edges.append((t.addr, 'method', i, m.type.addr))
+    n = len(edges)
+    cols['edges'] = (
+        [fid] * n, [e[0] for e in edges], [e[1] for e in edges],
+        [e[2] for e in edges], [e[3] for e in edges])
+
+    meths = [(t.addr, m) for t in types for m in t.methods or ()]
+    n = len(meths)
+    cols['type_methods'] = (
+        [fid] * n, [a for a, _ in meths], [m.name for _, m in meths],
+        [m.type.addr if m.type is not None else None for _, m in meths],
+        [m.ifaceOffset for _, m in meths], [m.funcOffset for _, m in meths])
+    return cols
+
+
+class _JSONLWriter:
+    def __init__(self, path, names):
+        self.names = names
+        self.file = open(path, 'w', encoding='utf-8')
+
+    def write(self, batch):
+        names = self.names
+        dumps = json.JSONEncoder(ensure_ascii=False).encode
+        self.file.write(''.join(
+            dumps(dict(zip(names, row))) + '\n' for row in zip(*batch)))
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class _ParquetWriter:
+    def __init__(self, path, names, column_types=_column_types):
+        self.schema = pyarrow.schema(
+            [(c, getattr(pyarrow, column_types[c])()) for c in names])
+        self.writer = pyarrow.parquet.ParquetWriter(path, self.schema)
+
+    def write(self, batch):
+        self.writer.write_table(pyarrow.Table.from_arrays(
+            [pyarrow.array(col, t) for col, t in
+             zip(batch, self.schema.types)], schema=self.schema))
+
+    def close(self):
+        self.writer.close()
@@ -0,0 +1,186 @@
+# Copyright 2019 The GoRE.tk Authors. All rights reserved.
+# Use of this source code is governed by the license that
+# can be found in the LICENSE file.
+
+import threading
+from ctypes import c_char_p
+
+import pygore.internal as internal
+
+
+class Handle:
+    '''
+    Handle is a reference to a file opened in libgore, unique to the GoFile
+    holding it. Handles to the same path share one open file in libgore,
+    which is closed when the last handle is closed.
+
+    Attributes
+    ----------
+    path : bytes
+        the path the file was opened with.
+    lock : RLock
+        the lock that must be held while calling libgore for the path.
+    '''
+    __slots__ = ('path', 'lock', '_entry', '_registry')
+
+    def __init__(self, registry, entry):
+        self.path = entry.path
+        self.lock = entry.lock
+        self._entry = entry
+        self._registry = registry
+
+    @property
+    def closed(self):
+        '''
+        True if the handle has been closed.
+        '''
+        return self._entry is None
+
+    @property
+    def generation(self):
+        '''
+        A counter that changes whenever libgore may interpret the file
+        differently, for example after set_compiler_version. Results
+        extracted under another generation are stale.
+        '''
+        return self._entry.generation
+
+    @property
+    def results(self):
+        '''
+        The results libgore returned for the path, keyed by name. They stay
+        valid until the path is closed or the generation changes, and must
+        only be used while holding lock.
+        '''
+        return self._entry.results
+
+    @property
+    def compiler_version(self):
+        '''
+        The compiler version last forced for the path, or None.
+        '''
+        return self._entry.compiler_version
+
+    def set_compiler_version(self, version):
+        '''
+        Forces the compiler version for the path, for all handles sharing it.
+        Returns True if libgore accepted the version.
+        '''
+        with self.lock:
+            c_ver = c_char_p(version.encode('utf-8'))
+            if internal._c_setCompilerVersion(self.path, c_ver) == 0:
+                return False
+            self._entry.compiler_version = version
+            self._entry.generation += 1
+            self._entry.results.clear()
+            return True
+
+    def close(self):
+        '''
+        Closes the handle. Closing a handle twice does nothing.
+        '''
+        if self._entry is not None:
+            self._registry._release(self._entry)
+            self._entry = None
+
+
+class HandleRegistry:
+    '''
+    HandleRegistry reference counts the files opened in libgore, which keeps
+    its state per path. Every open returns a new Handle, while libgore opens
+    each path only once and closes it when its last handle is closed, so
+    files sharing a path can be opened and closed from any thread.
+
+    Calls into libgore for one path must hold the lock of the handle. Calls
+    for different paths do not share a lock and, since ctypes releases the
+    GIL, run in parallel.
+    '''
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = dict()
+
+    def open(self, path):
+        '''
+        Returns a new Handle for path, opening it in libgore if it is not
+        open already.
+        '''
+        with self._lock:
+            e = self._entries.get(path)
+            if e is None:
+                e = self._entries[path] = _Entry(path)
+            e.refs += 1
+        try:
+            with e.lock:
+                if not e.opened:
+                    internal._c_open(path)
+                    e.opened = True
+        except BaseException:
+            self._release(e)
+            raise
+        return Handle(self, e)
+
+    def refs(self, path):
+        '''
+        Returns the number of open handles for path.
+        '''
+        with self._lock:
+            e = self._entries.get(path)
+            return e.refs if e is not None else 0
+
+    def compiler_version(self, path):
+        '''
+        Returns the compiler version forced for path if it is open, or None.
+        '''
+        with self._lock:
+            e = self._entries.get(path)
+            return e.compiler_version if e is not None else None
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def handles(self):
+        '''
+        Returns a new Handle for every open path. The handles must be closed
+        when done with them.
+        '''
+        with self._lock:
+            entries = [e for e in self._entries.values() if e.opened]
+            for e in entries:
+                e.refs += 1
+        return [Handle(self, e) for e in entries]
+
+    def _release(self, e):
+        with self._lock:
+            e.refs -= 1
+            if e.refs > 0:
+                return
+        with e.lock:
+            # A concurrent open may have taken a new reference, in which
+            # case the file stays open for it.
+            if e.refs == 0 and e.opened:
+                internal._c_close(e.path)
+                e.opened = False
+                e.compiler_version = None
+                e.generation += 1
+                e.results.clear()
+        with self._lock:
+            if e.refs == 0 and self._entries.get(e.path) is e:
+                del self._entries[e.path]
+
+
+class _Entry:
+    __slots__ = ('path', 'lock', 'refs', 'opened', 'generation',
+                 'compiler_version', 'results')
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.RLock()
+        self.refs = 0
+        self.opened = False
+        self.generation = 0
+        self.compiler_version = None
+        self.results = dict()
+
+
+registry = HandleRegistry()
@@ -0,0 +1,326 @@
+# Copyright 2019 The GoRE.tk Authors. All rights reserved.
+# Use of this source code is governed by the license that
+# can be found in the LICENSE file.
+
+from array import array
+from bisect import bisect_right
+from collections import namedtuple
+import pygore.internal as internal
+from pygore.lib import Function, Kind, Method, PackageClass, \
+                       _get_c_packages, _columns, _pointers, _walk_types
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class AddressIndex:
+    '''
+    AddressIndex is a sorted index over the code ranges of functions and
+    methods, used to resolve addresses to the function that contains them.
+
+    Single addresses are resolved with a binary search. Sequences of
+    addresses can be resolved in one call with lookup_many, which is
+    vectorized if NumPy is installed.
+    '''
+    def __init__(self, packages):
+        '''
+        Parameters
+        ----------
+        packages : iterable of Package
+            the packages whose functions and methods should be indexed.
+        '''
+        funcs = []
+        for p in packages:
+            funcs.extend(p.functions)
+            funcs.extend(p.methods)
+        funcs.sort(key=lambda f: f.offset)
+        self._starts = array('Q', (f.offset for f in funcs))
+        self._ends = array('Q', (f.end for f in funcs))
+        self._funcs = funcs
+        self._refs = None
+        self._owners = None
+        self._file = None
+        self._np = None
+
+    @classmethod
+    def from_file(cls, gofile, classes=None):
+        '''
+        Builds an index straight from the function tables returned by
+        libgore, without creating a Function object for every function.
+        Functions are only materialized when they are returned from a lookup,
+        so lookups raise ValueError after the GoFile has been closed. The
+        index keeps the GoFile alive, so it is not closed by its finalizer
+        while the index is in use. For files using another backend, the index
+        is built from the packages.
+
+        Parameters
+        ----------
+        gofile : GoFile
+            the file to index.
+        classes : iterable of PackageClass
+            the package classes to include. Defaults to all classes.
+        '''
+        if classes is None:
+            classes = list(PackageClass)
+        if gofile._backend is not None:
+            # Only libgore has tables to index in place.
+            return cls(p for c in classes for p in gofile._packages(c))
+
+        starts = array('Q')
+        ends = array('Q')
+        refs = array('Q')
+        owners = []
+        for c in classes:
+            pps = gofile._ffi('packages-' + c.value, _get_c_packages,
+                              gofile.path, c)
+            owners.append(pps)
+            for i in range(pps.contents.length):
+                p = pps.contents.packages[i][0]
+                ptrs = _pointers(p.functions, p.numFuncs)
+                offs, fends = _columns(ptrs, internal._Function,
+                                       ('offset', 'end'))
+                starts.extend(offs)
+                ends.extend(fends)
+                refs.extend(ptr << 1 for ptr in ptrs)
+
+                ptrs = _pointers(p.methods, p.numMeths)
+                funcs, = _columns(ptrs, internal._Method, ('function',))
+                offs, fends = _columns(funcs, internal._Function,
+                                       ('offset', 'end'))
+                starts.extend(offs)
+                ends.extend(fends)
+                refs.extend(ptr << 1 | 1 for ptr in ptrs)
+
+        order = sorted(range(len(starts)), key=starts.__getitem__)
+        idx = cls.__new__(cls)
+        idx._starts = array('Q', (starts[i] for i in order))
+        idx._ends = array('Q', (ends[i] for i in order))
+        idx._funcs = None
+        idx._refs = array('Q', (refs[i] for i in order))
+        idx._owners = owners
+        idx._file = gofile
+        idx._np = None
+        return idx
+
+    def __len__(self):
+        return len(self._starts)
+
+    def function(self, i):
+        '''
+        Returns the function at position i in the index.
+        '''
+        if self._funcs is not None:
+            return self._funcs[i]
+        if self._file.closed:
+            raise ValueError('I/O operation on closed file')
+        return _materialize(self._refs[i])
+
+    def find(self, addr):
+        '''
+        Returns the position in the index of the function containing addr,
+        or -1 if no function contains it.
+        '''
+        i = bisect_right(self._starts, addr) - 1
+        if i >= 0 and addr < self._ends[i]:
+            return i
+        return -1
+
+    def lookup(self, addr):
+        '''
+        Returns the Function or Method containing addr, or None if the
+        address is not inside any indexed function.
+        '''
+        i = self.find(addr)
+        return self.function(i) if i >= 0 else None
+
+    def find_many(self, addrs):
+        '''
+        Returns the positions in the index of the functions containing each
+        of the addresses, with -1 for addresses outside any function. The
+        result is a NumPy array if NumPy is installed, otherwise an array of
+        signed 64-bit integers.
+        '''
+        if numpy is None:
+            return array('q', (self.find(a) for a in addrs))
+        if self._np is None:
+            self._np = (numpy.frombuffer(self._starts, dtype=numpy.uint64),
+                        numpy.frombuffer(self._ends, dtype=numpy.uint64))
+        starts, ends = self._np
+        addrs = numpy.asarray(addrs, dtype=numpy.uint64)
+        idx = numpy.searchsorted(starts, addrs, side='right').astype(
+            numpy.int64) - 1
+        if len(starts) == 0:
+            return idx
+        hit = (idx >= 0) & (addrs < ends[numpy.maximum(idx, 0)])
+        return numpy.where(hit, idx, -1)
+
+    def lookup_many(self, addrs):
+        '''
+        Returns a list with the Function or Method containing each of the
+        addresses, or None for addresses outside any function.
+        '''
+        cache = dict()
+        vals = []
+        for i in self.find_many(addrs):
+            i = int(i)
+            if i < 0:
+                vals.append(None)
+                continue
+            try:
+                vals.append(cache[i])
+            except KeyError:
+                f = cache[i] = self.function(i)
+                vals.append(f)
+        return vals
+
+
+TypeRef = namedtuple('TypeRef', ('type', 'relation', 'index'))
+TypeRef.__doc__ = '''
+A reference to a type from another type, returned by TypeIndex.referrers.
+type is the referring Type, relation is one of 'element', 'key', 'field',
+'arg', 'return' or 'method', and index is the position of the reference in
+the fields, arguments, returns or methods of the referring type.
+'''
+
+
+class TypeIndex:
+    '''
+    TypeIndex indexes a type graph by addr, name, package path, kind and
+    method name, and records the reverse of every reference between types.
+    It is built in one pass over every type reachable from the given types,
+    after which all lookups are dict lookups.
+
+    The lists returned are copies, while the types in them are the indexed
+    objects.
+    '''
+    def __init__(self, types):
+        '''
+        Parameters
+        ----------
+        types : iterable of Type
+            the types to index, for example the result of GoFile.get_types.
+        '''
+        by_addr = self._by_addr = dict()
+        by_name = self._by_name = dict()
+        by_package = self._by_package = dict()
+        by_kind = self._by_kind = dict()
+        by_method = self._by_method = dict()
+        refs = self._referrers = dict()
+
+        def ref(addr, r):
+            try:
+                refs[addr].append(r)
+            except KeyError:
+                refs[addr] = [r]
+
+        for t in _walk_types(list(types)):
+            by_addr[t.addr] = t
+            by_name.setdefault(t.name, []).append(t)
+            by_package.setdefault(t.packagePath, []).append(t)
+            by_kind.setdefault(t.kind, []).append(t)
+            if t.element is not None:
+                ref(t.element.addr, TypeRef(t, 'element', 0))
+            if t.key is not None:
+                ref(t.key.addr, TypeRef(t, 'key', 0))
+            for i, f in enumerate(t.fields or ()):
+                ref(f.addr, TypeRef(t, 'field', i))
+            for i, a in enumerate(t.funcArgs or ()):
+                ref(a.addr, TypeRef(t, 'arg', i))
+            for i, a in enumerate(t.funcReturns or ()):
+                ref(a.addr, TypeRef(t, 'return', i))
+            for i, m in enumerate(t.methods or ()):
+                by_method.setdefault(m.name, set()).add(t.addr)
+                if m.type is not None:
+                    ref(m.type.addr, TypeRef(t, 'method', i))
+
+    @classmethod
+    def from_file(cls, gofile):
+        '''
+        Builds an index over the types of gofile.
+        '''
+        return cls(gofile.get_types())
+
+    def __len__(self):
+        return len(self._by_addr)
+
+    def __iter__(self):
+        return iter(list(self._by_addr.values()))
+
+    def __contains__(self, addr):
+        return addr in self._by_addr
+
+    def get(self, addr, default=None):
+        '''
+        Returns the type at addr, or default if there is none.
+        '''
+        return self._by_addr.get(addr, default)
+
+    def by_name(self, name):
+        '''
+        Returns the types with the given name.
+        '''
+        return list(self._by_name.get(name, ()))
+
+    def by_package(self, package_path):
+        '''
+        Returns the types with the given package path.
+        '''
+        return list(self._by_package.get(package_path, ()))
+
+    def by_kind(self, kind):
+        '''
+        Returns the types of the given Kind.
+        '''
+        return list(self._by_kind.get(Kind(kind), ()))
+
+    def packages(self):
+        '''
+        Returns the package paths of the indexed types.
+        '''
+        return list(self._by_package)
+
+    def field_type(self, field):
+        '''
+        Returns the type of a struct field, or None if it is not indexed.
+        '''
+        return self._by_addr.get(field.addr)
+
+    def referrers(self, typ, relation=None):
+        '''
+        Returns a TypeRef for every reference to typ, which is a Type or an
+        addr, optionally only the references of the given relation.
+        '''
+        addr = getattr(typ, 'addr', typ)
+        refs = self._referrers.get(addr, ())
+        if relation is None:
+            return list(refs)
+        return [r for r in refs if r.relation == relation]
+
+    def implementers(self, iface):
+        '''
+        Returns the types that have a method with the name of every method of
+        the interface type iface. Method signatures are not compared.
+        '''
+        names = [m.name for m in iface.methods or ()]
+        if not names:
+            return []
+        sets = sorted((self._by_method.get(n, set()) for n in names), key=len)
+        addrs = set(sets[0]).intersection(*sets[1:])
+        addrs.discard(iface.addr)
+        return [self._by_addr[a] for a in sorted(addrs)
+                if self._by_addr[a].kind != Kind.Interface]
+
+
+def _materialize(ref):
+    if ref & 1:
+        m = internal._Method.from_address(ref >> 1)
+        f = m.function[0]
+        return Method(str(f.name.decode('utf-8', 'replace')), int(f.offset),
+                      int(f.end),
+                      str(f.packageName.decode('utf-8', 'replace')),
+                      str(m.receiver.decode('utf-8', 'replace')))
+    f = internal._Function.from_address(ref >> 1)
+    return Function(str(f.name.decode('utf-8', 'replace')), int(f.offset),
+                    int(f.end), str(f.packageName.decode('utf-8', 'replace')))
@@ -18,7 +18,8 @@ elif platform == 'darwin':
 else:
     raise Exception('{} not supported'.format(platform))
 
-lib = cdll.LoadLibrary(os.path.dirname(__file__) + '/' + libFile)
+libPath = os.path.dirname(__file__) + '/' + libFile
+lib = cdll.LoadLibrary(libPath)
 
 
 class _CompilerVersion(Structure):
@@ -2,10 +2,17 @@
 # Use of this source code is governed by the license that
 # can be found in the LICENSE file.
 
-import pygore.internal as internal
-from ctypes import c_char_p
+import threading
+import time
+import weakref
+from ctypes import POINTER, c_char, c_char_p, c_uint64, c_void_p, cast, \
+    sizeof
 from enum import Enum
 
+import pygore.internal as internal
+from pygore.backend import Backend, backends
+from pygore.handles import registry
+
 
 class Kind(Enum):
     Invalid = 0
@@ -44,6 +51,16 @@ class ChanDir(Enum):
     ChanBoth = (1 << 0) | (1 << 1)
 
 
+class PackageClass(Enum):
+    '''
+    PackageClass is the classification gore assigns to an extracted package.
+    '''
+    Main = 'main'
+    Vendor = 'vendor'
+    Std = 'std'
+    Unknown = 'unknown'
+
+
 class CompilerVersion:
     '''
     CompilerVersion is a representation of the Go compiler used to compile
@@ -58,6 +75,8 @@ class CompilerVersion:
     timestamp : str
         string of the time stamp the git tag was committed.
     '''
+    __slots__ = ('name', 'sha', 'timestamp')
+
     def __init__(self, name, sha, timestamp):
         '''
         Parameters
@@ -89,6 +108,8 @@ class Function:
     package_name : str
         the name of the Go package the function belongs to.
     '''
+    __slots__ = ('name', 'offset', 'end', 'package_name')
+
     def __init__(self, name, offset, end, package_name):
         self.name = name
         self.offset = offset
@@ -113,6 +134,8 @@ class Method(Function):
     receiver : str
         the name of the method receiver.
     '''
+    __slots__ = ('receiver',)
+
     def __init__(self, name, offset, end, package_name, receiver):
         self.receiver = receiver
         super().__init__(name, offset, end, package_name)
@@ -133,6 +156,8 @@ class Package:
     methods : list of Method
         a list of methods that are part of the package.
     '''
+    __slots__ = ('name', 'filepath', 'functions', 'methods')
+
     def __init__(self, name, filepath, functions, methods):
         self.name = name
         self.filepath = filepath
@@ -163,12 +188,24 @@ class Method_Type:
         code starts. According to code comments in the standard library, it is
         used for normal method calls.  Can be 0 if the code is not called in
         the binary and was optimized out by the compiler or linker.
+    function : Function
+        the function at funcOffset, once the methods have been resolved with
+        resolve_methods. None if it was not found.
+    ifaceFunction : Function
+        the function at ifaceOffset, once the methods have been resolved with
+        resolve_methods. None if it was not found.
     '''
-    def __init__(self, name, type, ifaceOffset, funcOffset):
+    __slots__ = ('name', 'type', 'ifaceOffset', 'funcOffset', 'function',
+                 'ifaceFunction')
+
+    def __init__(self, name, type, ifaceOffset, funcOffset, function=None,
+                 ifaceFunction=None):
         self.name = name
         self.type = type
         self.ifaceOffset = ifaceOffset
         self.funcOffset = funcOffset
+        self.function = function
+        self.ifaceFunction = ifaceFunction
 
 
 class Type:
@@ -215,11 +252,17 @@ class Type:
     methods : list of Method_Type
         holds information of the types methods.
     '''
+    __slots__ = ('kind', 'name', 'addr', 'ptrResolved', 'packagePath',
+                 'fields', 'fieldName', 'fieldTag', 'fieldAnon', 'element',
+                 'length', 'chanDir', 'key', 'funcArgs', 'funcReturns',
+                 'isVariadic', 'methods')
+
     def __init__(self, kind=None, name=None, addr=None,
                  ptrResolved=None, packagePath=None, fields=None,
                  fieldName=None, fieldTag=None, fieldAnon=None,
                  element=None, length=None, chanDir=None, key=None,
-                 funcArgs=None, funcReturns=None, isVariadic=None):
+                 funcArgs=None, funcReturns=None, isVariadic=None,
+                 methods=None):
         self.kind = kind
         self.name = name
         self.addr = addr
@@ -236,88 +279,797 @@ class Type:
         self.funcArgs = funcArgs
         self.funcReturns = funcReturns
         self.isVariadic = isVariadic
+        self.methods = methods
+
+    @property
+    def typeAnon(self):
+        # Older releases stored fieldAnon under this name for struct fields.
+        return self.fieldAnon
+
+
+class StringTable:
+    '''
+    StringTable interns the strings decoded from libgore, so equal strings
+    are only decoded once and share a single str object.
+
+    A new table is used for every extraction unless one is passed to GoFile.
+    Passing the same table to several GoFile objects shares the strings
+    across all of them, for example for the package paths of the standard
+    library when analyzing a corpus.
+    '''
+    __slots__ = ('_strings',)
+
+    def __init__(self):
+        self._strings = dict()
+
+    def __len__(self):
+        return len(self._strings)
+
+    def decode(self, b):
+        '''
+        Returns the interned str for the UTF-8 encoded bytes b. None is
+        decoded as an empty string.
+        '''
+        s = self._strings.get(b)
+        if s is None:
+            if b is None:
+                return ''
+            s = self._strings[b] = b.decode('utf-8', 'replace')
+        return s
+
+    def clear(self):
+        '''
+        Removes all strings from the table.
+        '''
+        self._strings.clear()
+
+
+class Analysis:
+    '''
+    Analysis holds everything extracted from a Go binary by GoFile.get_all.
+
+    Attributes
+    ----------
+    path : str
+        path to the binary.
+    compiler_version : CompilerVersion
+        the compiler version.
+    build_id : str
+        the extracted build id.
+    packages : dict of PackageClass to list of Package
+        the extracted packages for each package class.
+    types : list of Type
+        the extracted types, or None if types were not requested.
+    '''
+    def __init__(self, path, compiler_version=None, build_id=None,
+                 packages=None, types=None):
+        self.path = path
+        self.compiler_version = compiler_version
+        self.build_id = build_id
+        self.packages = packages if packages is not None else dict()
+        self.types = types
+
+    def all_packages(self):
+        '''
+        Returns a list of the packages of all package classes.
+        '''
+        return [p for cls in PackageClass
+                for p in self.packages.get(cls, [])]
+
+    def resolve_methods(self, text_base=None):
+        '''
+        Links the methods of the types to the functions of the packages, see
+        GoFile.resolve_methods. Returns the text base used.
+        '''
+        return _resolve_methods(self.types or (), self.all_packages(),
+                                text_base)
+
+    def __getstate__(self):
+        # The types are pickled flat, see _FlatTypes.
+        state = self.__dict__.copy()
+        if self.types is not None:
+            state['types'] = _FlatTypes(self.types)
+        return state
 
 
 class GoFile:
     '''
     GoFile is a representation of a Go binary file.
 
+    Extracted results are memoized per GoFile, so repeated calls return the
+    same objects without going through libgore again. The memoized results
+    are dropped when set_compiler_version changes how the binary is
+    interpreted, or when clear_memo is called. The lists returned are copies,
+    while the objects in them are shared.
+
+    GoFile can be used from many threads. Files opened with the same path
+    share one open file in libgore through the handle registry, and calls for
+    the same path are serialized while calls for different paths run in
+    parallel. The compiler version set with set_compiler_version applies to
+    all files sharing the path, and drops their memoized results.
+
+    The tables returned by libgore are requested once per path and are held
+    by libgore until the last GoFile for the path is closed. GoFile is a
+    context manager that closes the file on exit, and a file that is garbage
+    collected without being closed is closed then. native_bytes reports how
+    much memory libgore holds for the tables of the path.
+
+    The compiler version, build id and packages can be extracted by another
+    Backend instead of libgore, for example the pure Python 'native' backend
+    for ELF binaries. libgore is then only opened when types are requested or
+    the compiler version is set. With a result cache, libgore is also only
+    opened on the first cache miss, so a file whose results are all cached is
+    never parsed by libgore.
+
     Attributes
     ----------
     path : str
         path to the binary.
+    cache : ResultCache
+        optional persistent cache for extracted packages and types.
+    strings : StringTable
+        optional string table shared with other files. If None, strings are
+        interned per extraction.
+    stats : ExtractionStats
+        optional statistics that record the time spent in libgore and in the
+        conversion of its results, and counters for the converted objects.
+        Instrumentation is disabled if None.
+    backend : str
+        the name of the backend extracting the compiler version, build id
+        and packages. GoFile takes the name of a registered Backend, 'libgore'
+        which is the default, 'auto' for the native backend if it supports
+        the file and libgore otherwise, or a Backend subclass.
     '''
-    def __init__(self, path):
+    def __init__(self, path, cache=None, strings=None, stats=None,
+                 backend=None):
         self.path = path.encode('utf-8')
-        internal._c_open(self.path)
+        self.cache = cache
+        self.strings = strings
+        self.stats = stats
+        self._cache_key = None
+        self._memo = dict()
+        self._type_cache = dict()
+        self._lazy_cache = _LazyCache()
+        self._lock = threading.RLock()
+        cls = _backend_class(backend, path)
+        self._backend = None
+        self._handle = None
+        self._generation = None
+        # Everything opened for the file, which includes libgore if it is
+        # opened later on for the types.
+        self._opened = []
+        self._finalizer = weakref.finalize(self, _close_all, self._opened)
+        if cls is None:
+            self.backend = 'libgore'
+            if cache is None:
+                self._libgore()
+        else:
+            self.backend = cls.name
+            self._backend = self._timed(cls.name + ':open', cls, path)
+            self._opened.append(self._backend)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
 
     def close(self):
         '''
-        Closes the file handler and freeing up all memory allocated by the Go
-        runtime and objects on the C-heap. This must be called when done with
-        the files, otherwise it will lead to memory leak.
+        Closes the file handler. When the last GoFile for the path is closed,
+        all memory allocated by the Go runtime and objects on the C-heap for
+        the file is freed. Results that have been extracted stay usable, except
+        for lazy types. Closing a file twice does nothing.
         '''
-        internal._c_close(self.path)
+        if not self._finalizer.alive:
+            return
+        self._timed('ffi:close' if self._backend is None else
+                    self.backend + ':close', self._finalizer)
         self.path = None
+        self._memo.pop('types-lazy', None)
+        self._lazy_cache = _LazyCache()
+
+    @property
+    def closed(self):
+        '''
+        True if the file has been closed.
+        '''
+        return not self._finalizer.alive
+
+    @property
+    def native_bytes(self):
+        '''
+        An estimate of the memory in bytes that libgore holds for the package
+        and type tables returned for the path. The memory is shared by all
+        open GoFiles for the path and is freed when the last one is closed.
+        '''
+        if self.closed or self._handle is None:
+            return 0
+        return _native_size(self._handle)
 
     def set_compiler_version(self, version):
         '''
         Set an assumed compiler version to be used when extracting information
-        from the binary.
+        from the binary. The version applies to all open GoFiles for the same
+        path. With a backend other than libgore, it only applies to the types.
         '''
-        c_ver = c_char_p(version.encode('utf-8'))
-        v = internal._c_setCompilerVersion(self.path, c_ver)
-        if v != 0:
-            return True
-        return False
+        return self._timed('ffi:set-compiler-version',
+                           self._libgore().set_compiler_version, version)
+
+    @property
+    def memoized(self):
+        '''
+        The names of the results that are currently memoized, for example
+        'types' or 'packages-std'.
+        '''
+        self._check_generation()
+        return frozenset(self._memo)
+
+    def clear_memo(self):
+        '''
+        Drops all memoized results. The next call for each result extracts it
+        again.
+        '''
+        self._memo.clear()
+        self._type_cache = dict()
+        self._lazy_cache = _LazyCache()
 
     def get_compiler_version(self):
         '''
         Returns compiler information extracted from the binary.
         '''
-        return _get_compiler_version(self.path)
+        if self._backend is not None:
+            return self._memoized('compiler-version', lambda: self._timed(
+                self.backend + ':compiler-version',
+                self._backend.compiler_version), False)
+        return self._memoized('compiler-version', lambda: self._ffi(
+            'compiler-version', _get_compiler_version, self.path), False)
 
     def get_packages(self):
         '''
         Returns all Go packages gore thinks is part of the main project.
         '''
-        pps = internal._c_getPackages(self.path)
-        return _parsePackages(pps)
+        return list(self._packages(PackageClass.Main))
 
     def get_vendor_packages(self):
         '''
         Returns all Go packages gore thinks is vendor or 3rd-party packages.
         '''
-        pps = internal._c_getVendors(self.path)
-        return _parsePackages(pps)
+        return list(self._packages(PackageClass.Vendor))
 
     def get_std_lib_packages(self):
         '''
         Returns all Go packages gore thinks is standard library packages.
         '''
-        pps = internal._c_getstd(self.path)
-        return _parsePackages(pps)
+        return list(self._packages(PackageClass.Std))
 
     def get_unknown_packages(self):
         '''
         Returns all Go packages gore could not classify.
         '''
-        pps = internal._c_getunknown(self.path)
-        return _parsePackages(pps)
+        return list(self._packages(PackageClass.Unknown))
 
-    def get_types(self):
+    def get_types(self, lazy=False):
         '''
         Returns all Go types extracted from the binary.
+
+        If lazy is True, the types are returned as thin proxies over the data
+        held by libgore and their attributes are only decoded when accessed.
+        This is much faster when only a few types are inspected, but all
+        attributes must be accessed before the file is closed. Lazy results
+        bypass the result cache.
+        '''
+        if lazy:
+            return list(self._memoized('types-lazy', self._extract_lazy_types,
+                                       False))
+        return list(self._types())
+
+    def iter_packages(self, cls=PackageClass.Main):
+        '''
+        Returns a generator that yields the Go packages of the given
+        PackageClass one at a time as they are decoded.
+        '''
+        name = 'packages-' + cls.value
+        self._check_generation()
+        if name in self._memo or self._backend is not None:
+            return iter(list(self._packages(cls)))
+        return self._guarded(_iterPackages(
+            self._ffi(name, _get_c_packages, self.path, cls), self.strings))
+
+    def iter_functions(self, cls=PackageClass.Main):
+        '''
+        Returns a generator that yields the functions and methods of all Go
+        packages of the given PackageClass one at a time, without building
+        Package objects.
+        '''
+        name = 'packages-' + cls.value
+        self._check_generation()
+        if name in self._memo or self._backend is not None:
+            return (f for p in list(self._packages(cls))
+                    for f in p.functions + p.methods)
+        return self._guarded(_iterFunctions(
+            self._ffi(name, _get_c_packages, self.path, cls), self.strings))
+
+    def iter_types(self, lazy=False):
+        '''
+        Returns a generator that yields the Go types extracted from the binary
+        one at a time as they are decoded. The types are the same objects as
+        the ones returned by get_types.
+        '''
+        name = 'types-lazy' if lazy else 'types'
+        self._check_generation()
+        if name in self._memo:
+            return iter(list(self._memo[name]))
+        types = self._ffi('types', internal._c_getTypes, self.path)
+        if lazy:
+            return self._guarded(_iterTypes(
+                types, self._lazy_type_cache(), self.strings, _lazy_type))
+        return self._guarded(_iterTypes(types, self._type_cache,
+                                        self.strings))
+
+    def resolve_methods(self, text_base=None):
+        '''
+        Links the method tables of the types to the extracted functions and
+        methods of all package classes, and returns the text base used.
+
+        Every Method_Type gets the Function or Method starting at its
+        funcOffset in function, and the one starting at its ifaceOffset in
+        ifaceFunction, or None if there is no such function. The offsets are
+        relative to the start of the text section, which is given by
+        text_base. If text_base is None, it is inferred as the base that
+        matches the most offsets to function starts, out of 0 for absolute
+        offsets, the lowest function address, and that address rounded down
+        to a page. A backend other than libgore may know the text base, which
+        is then used instead.
         '''
-        types = internal._c_getTypes(self.path)
-        cache = dict()
-        return _parseTypes(types, cache)
+        if text_base is None and self._backend is not None:
+            text_base = self._backend.text_start
+        pkgs = [p for cls in PackageClass for p in self._packages(cls)]
+        return _resolve_methods(self._types(), pkgs, text_base)
 
     def get_build_id(self):
         '''
         Returns the extracted build id from the binary.
         '''
-        return str(internal._c_build_id(self.path).decode('utf-8', 'replace'))
+        if self._backend is not None:
+            return self._memoized('build-id', lambda: self._timed(
+                self.backend + ':build-id', self._backend.build_id), False)
+        return self._memoized('build-id', lambda: str(self._ffi(
+            'build-id', internal._c_build_id, self.path).decode(
+                'utf-8', 'replace')), False)
+
+    def get_all(self, types=True):
+        '''
+        Returns an Analysis with the compiler version, build id, packages of
+        every package class and, unless types is False, the types of the
+        binary. All results are decoded with one shared string table and are
+        memoized like the results of the individual calls.
+        '''
+        if self.closed:
+            raise ValueError('I/O operation on closed file')
+        strings = self.strings
+        if strings is None:
+            strings = StringTable()
+        a = Analysis(self.path.decode('utf-8'), self.get_compiler_version(),
+                     self.get_build_id())
+        for cls in PackageClass:
+            a.packages[cls] = list(self._packages(cls, strings))
+        if types:
+            a.types = list(self._types(strings))
+        return a
+
+    def _packages(self, cls, strings=None):
+        if strings is None:
+            strings = self.strings
+        return self._memoized('packages-' + cls.value,
+                              lambda: self._extract_packages(cls, strings))
+
+    def _types(self, strings=None):
+        if strings is None:
+            strings = self.strings
+        types = self._memoized('types', lambda: self._extract_types(strings))
+        if not self._type_cache:
+            # Loaded from the result cache.
+            self._type_cache.update((t.addr, t) for t in types)
+        return types
+
+    def _extract_packages(self, cls, strings):
+        name = 'packages-' + cls.value
+        if self._backend is not None:
+            return self._backend_packages(name, cls, strings)
+        pps = self._ffi(name, _get_c_packages, self.path, cls)
+        if self.stats is None:
+            return _parsePackages(pps, strings)
+        if strings is None:
+            strings = StringTable()
+        n = len(strings)
+        start = time.perf_counter()
+        pkgs = _parsePackages(pps, strings)
+        self.stats.record('convert:' + name, time.perf_counter() - start,
+                          _package_counters(pkgs, len(strings) - n, True))
+        return pkgs
+
+    def _backend_packages(self, name, cls, strings):
+        # The backend decodes and converts in one go, so both are recorded
+        # as the phase of the backend.
+        if strings is None:
+            strings = StringTable()
+        if self.stats is None:
+            return self._backend.packages(cls, strings)
+        n = len(strings)
+        start = time.perf_counter()
+        pkgs = self._backend.packages(cls, strings)
+        self.stats.record(self.backend + ':' + name,
+                          time.perf_counter() - start,
+                          _package_counters(pkgs, len(strings) - n))
+        return pkgs
+
+    def _extract_types(self, strings):
+        types = self._ffi('types', internal._c_getTypes, self.path)
+        if self.stats is None:
+            return _parseTypes(types, self._type_cache, strings)
+        if strings is None:
+            strings = StringTable()
+        n, converted = len(strings), len(self._type_cache)
+        start = time.perf_counter()
+        ts = _parseTypes(types, self._type_cache, strings)
+        elapsed = time.perf_counter() - start
+        new = list(self._type_cache.values())[converted:]
+        self.stats.record('convert:types', elapsed,
+                          _type_counters(new, len(ts), len(strings) - n))
+        return ts
+
+    def _extract_lazy_types(self):
+        types = self._ffi('types', internal._c_getTypes, self.path)
+        if self.stats is None:
+            return _lazy_types(types, self._lazy_type_cache(), self.strings)
+        start = time.perf_counter()
+        ts = _lazy_types(types, self._lazy_type_cache(), self.strings)
+        self.stats.record('convert:types-lazy', time.perf_counter() - start,
+                          {'types_converted': len(ts)})
+        return ts
+
+    def _lazy_type_cache(self):
+        # Returns the addr cache of the lazy types. The lazy types reach the
+        # GoFile through it, so libgore is not closed by the finalizer while
+        # they are in use.
+        cache = self._lazy_cache
+        if cache.owner is None:
+            cache.owner = self
+        return cache
+
+    def _guarded(self, it):
+        # The iter_* generators read the libgore tables, which must not be
+        # touched once the file is closed.
+        while not self.closed:
+            try:
+                value = next(it)
+            except StopIteration:
+                return
+            yield value
+        raise ValueError('I/O operation on closed file')
+
+    def _ffi(self, name, call, *args):
+        # libgore allocates new tables on every call and only frees them when
+        # the path is closed, so every table is requested once per path.
+        h = self._libgore()
+        with h.lock:
+            results = h.results
+            try:
+                return results[name]
+            except KeyError:
+                pass
+            value = results[name] = self._timed('ffi:' + name, call, *args)
+            return value
+
+    def _libgore(self):
+        # Returns the handle, opening the file in libgore on first use if
+        # another backend is used.
+        if self.closed:
+            raise ValueError('I/O operation on closed file')
+        h = self._handle
+        if h is not None:
+            return h
+        with self._lock:
+            if self._handle is None:
+                if self.closed:
+                    raise ValueError('I/O operation on closed file')
+                h = self._timed('ffi:open', registry.open, self.path)
+                self._opened.append(h)
+                self._generation = h.generation
+                self._handle = h
+            return self._handle
+
+    def _timed(self, phase, call, *args):
+        if self.stats is None:
+            return call(*args)
+        start = time.perf_counter()
+        try:
+            return call(*args)
+        finally:
+            self.stats.record(phase, time.perf_counter() - start)
+
+    def _check_generation(self):
+        # Another GoFile for the same path may have changed the compiler
+        # version, which makes the memoized results stale.
+        h = self._handle
+        if h is None or h.closed or self._generation == h.generation:
+            return
+        with self._lock:
+            if self._generation != h.generation:
+                self._generation = h.generation
+                self._cache_key = None
+                self.clear_memo()
+
+    def _memoized(self, name, extract, persist=True):
+        self._check_generation()
+        try:
+            value = self._memo[name]
+        except KeyError:
+            pass
+        else:
+            if self.stats is not None:
+                self.stats.count('memo_hits')
+            return value
+        with self._lock:
+            if name in self._memo:
+                return self._memo[name]
+            if self.closed:
+                raise ValueError('I/O operation on closed file')
+            return self._extract(name, extract, persist)
+
+    def _extract(self, name, extract, persist):
+        if not persist or self.cache is None:
+            value = self._memo[name] = extract()
+            return value
+        if self._cache_key is None:
+            h = self._handle
+            self._cache_key = self.cache.key(
+                self.path, h.compiler_version if h is not None else
+                registry.compiler_version(self.path))
+        # Results of other backends are cached apart from the ones of
+        # libgore, since they may differ.
+        cached = name
+        if self._backend is not None and not name.startswith('types'):
+            cached = self.backend + ':' + name
+        value = self.cache.get(self._cache_key, cached)
+        if self.stats is not None:
+            self.stats.count('result_cache_misses' if value is None else
+                             'result_cache_hits')
+        if value is None:
+            value = extract()
+            self.cache.put(self._cache_key, cached, value)
+        self._memo[name] = value
+        return value
+
+
+def _backend_class(backend, path):
+    # Returns the Backend subclass for the backend argument of GoFile, or
+    # None for libgore.
+    if backend is None or backend == 'libgore':
+        return None
+    if isinstance(backend, type) and issubclass(backend, Backend):
+        return backend
+    if backend == 'auto':
+        cls = backends.get('native')
+        return cls if cls is not None and cls.supports(path) else None
+    try:
+        return backends[backend]
+    except (KeyError, TypeError):
+        raise ValueError('unknown backend: {!r}'.format(backend)) from None
+
+
+def _close_all(opened):
+    for o in opened:
+        o.close()
+
+
+def native_memory():
+    '''
+    Returns an estimate of the memory in bytes that libgore holds for the
+    package and type tables of all open files, see GoFile.native_bytes.
+    '''
+    size = 0
+    for h in registry.handles():
+        try:
+            size += _native_size(h)
+        finally:
+            h.close()
+    return size
+
+
+def _native_size(handle):
+    with handle.lock:
+        size = 0
+        for name, value in handle.results.items():
+            if name == 'types':
+                size += _types_size(value)
+            elif name.startswith('packages-'):
+                size += _packages_size(value)
+        return size
+
+
+def _walk_types(roots):
+    # Yields every type reachable from roots once per addr, depth first in
+    # the order of roots. Types that are only referenced from other types,
+    # for example through an element, are included.
+    seen = set()
+    stack = list(reversed(roots))
+    while stack:
+        t = stack.pop()
+        if t is None or t.addr in seen:
+            continue
+        seen.add(t.addr)
+        yield t
+        refs = [t.element, t.key]
+        refs.extend(t.funcArgs or ())
+        refs.extend(t.funcReturns or ())
+        refs.extend(m.type for m in t.methods or ())
+        stack.extend(reversed(refs))
+
+
+class _FlatTypes:
+    # Pickles a list of types as flat records keyed by addr, which are
+    # linked again on load. The default pickle of a type recurses into the
+    # types it references and fails for deep type graphs with a
+    # RecursionError. Unpickling returns a plain list.
+    __slots__ = ('types',)
+
+    def __init__(self, types):
+        self.types = types
+
+    def __reduce__(self):
+        records = [_type_record(t) for t in _walk_types(self.types)]
+        return _unflatten_types, (records, [_addr(t) for t in self.types])
+
+
+def _flat(value):
+    # Wraps a list of types for pickling, see _FlatTypes.
+    if isinstance(value, list) and value and isinstance(value[0], Type):
+        return _FlatTypes(value)
+    return value
+
+
+def _addr(t):
+    return None if t is None else t.addr
+
+
+def _addrs(types):
+    return None if types is None else [_addr(t) for t in types]
+
+
+def _type_record(t):
+    fields = t.fields
+    if fields is not None:
+        fields = [_type_record(f) for f in fields]
+    methods = t.methods
+    if methods is not None:
+        methods = [(m.name, _addr(m.type), m.ifaceOffset, m.funcOffset,
+                    m.function, m.ifaceFunction) for m in methods]
+    return (t.kind, t.name, t.addr, t.ptrResolved, t.packagePath, fields,
+            t.fieldName, t.fieldTag, t.fieldAnon, _addr(t.element), t.length,
+            t.chanDir, _addr(t.key), _addrs(t.funcArgs),
+            _addrs(t.funcReturns), t.isVariadic, methods)
+
+
+def _unflatten_types(records, roots):
+    types = {r[2]: Type() for r in records}
+    get = types.get
+    for r in records:
+        _link_type(types[r[2]], r, get)
+    return [get(a) for a in roots]
+
+
+def _link_type(t, record, get):
+    (t.kind, t.name, t.addr, t.ptrResolved, t.packagePath, fields,
+     t.fieldName, t.fieldTag, t.fieldAnon, element, t.length, t.chanDir,
+     key, args, returns, t.isVariadic, methods) = record
+    if fields is not None:
+        fields = [_link_type(Type(), f, get) for f in fields]
+    t.fields = fields
+    t.element = None if element is None else get(element)
+    t.key = None if key is None else get(key)
+    t.funcArgs = None if args is None else [get(a) for a in args]
+    t.funcReturns = None if returns is None else [get(a) for a in returns]
+    if methods is not None:
+        methods = [Method_Type(name, None if a is None else get(a), iface,
+                               func, f, iface_f)
+                   for name, a, iface, func, f, iface_f in methods]
+    t.methods = methods
+    return t
+
+
+def _resolve_methods(types, packages, text_base=None):
+    # A hash join of the method offsets against the function starts.
+    starts = dict()
+    for p in packages:
+        for f in p.functions:
+            starts.setdefault(f.offset, f)
+        for m in p.methods:
+            starts.setdefault(m.offset, m)
+    meths = [m for t in _walk_types(types) for m in t.methods or ()]
+    if text_base is None:
+        text_base = _infer_text_base(meths, starts)
+    get = starts.get
+    for m in meths:
+        m.function = get(m.funcOffset + text_base) \
+            if _is_text_offset(m.funcOffset) else None
+        m.ifaceFunction = get(m.ifaceOffset + text_base) \
+            if _is_text_offset(m.ifaceOffset) else None
+    return text_base
+
+
+def _is_text_offset(off):
+    # Methods the linker removed have an offset of 0 or -1, which libgore
+    # may return as an unsigned 32 or 64-bit value.
+    return off not in (0, 0xffffffff, 0xffffffffffffffff)
+
+
+def _infer_text_base(meths, starts):
+    if not starts:
+        return 0
+    low = min(starts)
+    offs = [m.funcOffset for m in meths if _is_text_offset(m.funcOffset)]
+    best, hits = low, -1
+    for base in (low, low & ~0xfff, 0):
+        n = sum(1 for off in offs if off + base in starts)
+        if n > hits:
+            best, hits = base, n
+    return best
+
+
+def _package_counters(pkgs, strings, function_names=False):
+    # Strings are decoded on a miss in the string table, which is what
+    # strings counts. With function_names, the names of the functions were
+    # decoded without the table as well, see _iter_functions.
+    funcs = sum(len(p.functions) for p in pkgs)
+    meths = sum(len(p.methods) for p in pkgs)
+    return {
+        'packages': len(pkgs),
+        'functions': funcs,
+        'methods': meths,
+        'strings_decoded': strings + funcs if function_names else strings,
+    }
+
+
+def _type_counters(new, roots, strings):
+    # Derived from the types a conversion added to the addr cache, so the
+    # conversion itself does not pay for the counting. Every edge followed
+    # that did not convert a new type was a hit in the addr cache.
+    fields = methods = edges = 0
+    for t in new:
+        if t.fields:
+            fields += len(t.fields)
+        if t.methods:
+            methods += len(t.methods)
+            edges += sum(1 for m in t.methods if m.type is not None)
+        if t.element is not None:
+            edges += 1
+        if t.key is not None:
+            edges += 1
+        if t.funcArgs:
+            edges += len(t.funcArgs)
+        if t.funcReturns:
+            edges += len(t.funcReturns)
+    return {
+        'types_converted': len(new),
+        'type_cache_hits': roots + edges - len(new),
+        'struct_fields': fields,
+        'type_methods': methods,
+        'strings_decoded': strings,
+    }
+
+
+_package_calls = {
+    PackageClass.Main: '_c_getPackages',
+    PackageClass.Vendor: '_c_getVendors',
+    PackageClass.Std: '_c_getstd',
+    PackageClass.Unknown: '_c_getunknown',
+}
+
+
+def _get_c_packages(path, cls):
+    return getattr(internal, _package_calls[cls])(path)
 
 
 def _get_compiler_version(path):
@@ -328,50 +1080,208 @@ def _get_compiler_version(path):
                            str(cv.timestamp.decode('utf-8', 'replace')))
 
 
-def _parsePackages(pps):
-    pkgs = []
+def _parsePackages(pps, strings=None):
+    return list(_iterPackages(pps, strings))
+
+
+def _iterPackages(pps, strings=None):
+    if strings is None:
+        strings = StringTable()
     for i in range(pps.contents.length):
-        fcks = []
-        meths = []
         p = pps.contents.packages[i][0]
-
-        # Functions
-        for j in range(p.numFuncs):
-            f = p.functions[j][0]
-            name = str(f.name.decode('utf-8', 'replace'))
-            off = int(f.offset)
-            end = int(f.end)
-            pn = str(f.packageName.decode('utf-8', 'replace'))
-            fcks.append(Function(name, off, end, pn))
-        
-        # Methods
-        for j in range(p.numMeths):
-            f = p.methods[j][0]
-            name = str(f.function[0].name.decode('utf-8', 'replace'))
-            off = int(f.function[0].offset)
-            end = int(f.function[0].end)
-            pn = str(f.function[0].packageName.decode('utf-8', 'replace'))
-            rec = str(f.receiver.decode('utf-8', 'replace'))
-            meths.append(Method(name, off, end, pn, rec))
+        fcks = list(_iter_functions(p, strings))
+        meths = list(_iter_methods(p, strings))
 
         # Package
-        name = str(p.name.decode('utf-8', 'replace'))
-        fp = str(p.filepath.decode('utf-8', 'replace'))
-        pkgs.append(Package(name, fp, fcks, meths))
-    return pkgs
+        name = strings.decode(p.name)
+        fp = strings.decode(p.filepath)
+        yield Package(name, fp, fcks, meths)
+
+
+def _iterFunctions(pps, strings=None):
+    if strings is None:
+        strings = StringTable()
+    for i in range(pps.contents.length):
+        p = pps.contents.packages[i][0]
+        yield from _iter_functions(p, strings)
+        yield from _iter_methods(p, strings)
+
+
+def _iter_functions(p, strings):
+    ptrs = _pointers(p.functions, p.numFuncs)
+    offs, ends = _columns(ptrs, internal._Function, ('offset', 'end'))
+    get, decode = strings._strings.get, strings.decode
+    char_p = c_char_p.from_address
+    for f, off, end in zip(ptrs, offs, ends):
+        # Function names are unique within a file and are not interned.
+        name = char_p(f + _func_name).value or b''
+        pn = char_p(f + _func_pkg).value
+        yield Function(name.decode('utf-8', 'replace'), off, end,
+                       get(pn) or decode(pn))
+
+
+def _iter_methods(p, strings):
+    ptrs = _pointers(p.methods, p.numMeths)
+    funcs, = _columns(ptrs, internal._Method, ('function',))
+    offs, ends = _columns(funcs, internal._Function, ('offset', 'end'))
+    get, decode = strings._strings.get, strings.decode
+    char_p = c_char_p.from_address
+    for m, f, off, end in zip(ptrs, funcs, offs, ends):
+        name = char_p(f + _func_name).value
+        pn = char_p(f + _func_pkg).value
+        rec = char_p(m + _meth_receiver).value
+        yield Method(get(name) or decode(name), off, end,
+                     get(pn) or decode(pn), get(rec) or decode(rec))
+
+
+# Offsets of the char* fields of _Function and _Method.
+_func_name = internal._Function.name.offset
+_func_pkg = internal._Function.packageName.offset
+_meth_receiver = internal._Method.receiver.offset
+
+
+def _pointers(arr, n):
+    # Reads an array of pointers in one call instead of indexing it element by
+    # element.
+    if n == 0:
+        return []
+    return cast(arr, POINTER(c_void_p))[:n]
 
 
-def _parse_method_type(ms, cache):
+def _columns(ptrs, ctype, names):
+    '''
+    Returns a list for each field in names with the value of that field for
+    every ctype record at the addresses in ptrs. Pointer fields are returned
+    as addresses. The fields are read from the C memory as 64-bit words.
+    '''
+    n = len(ptrs)
+    if n == 0:
+        return [[] for _ in names]
+    fields = [getattr(ctype, name).offset // 8 for name in names]
+    size = sizeof(ctype)
+    stride = size // 8
+
+    # libgore usually allocates the records of a table back to back. If so,
+    # each column is a strided slice of the memory.
+    lo = ptrs[0]
+    if ptrs[-1] == lo + (n - 1) * size and \
+            ptrs == list(range(lo, lo + n * size, size)):
+        words = _words(lo, n * size)
+        return [words[f:n * stride:stride].tolist() for f in fields]
+
+    # Otherwise every word is read on its own, so no memory between the
+    # records is mapped into a view.
+    read = c_uint64.from_address
+    return [[read(ptr + off).value for ptr in ptrs]
+            for off in (f * 8 for f in fields)]
+
+
+def _strsize(b):
+    return len(b) + 1 if b is not None else 0
+
+
+def _packages_size(pps):
+    ptr = sizeof(c_void_p)
+    n = pps.contents.length
+    size = sizeof(internal._Packages) + n * ptr
+    char_p = c_char_p.from_address
+    for i in range(n):
+        p = pps.contents.packages[i][0]
+        size += sizeof(internal._Package) + _strsize(p.name) + \
+            _strsize(p.filepath)
+        funcs = _pointers(p.functions, p.numFuncs)
+        meths = _pointers(p.methods, p.numMeths)
+        size += len(funcs) * (ptr + sizeof(internal._Function))
+        size += len(meths) * (ptr + sizeof(internal._Method) +
+                              sizeof(internal._Function))
+        for m in meths:
+            size += _strsize(char_p(m + _meth_receiver).value)
+        funcs.extend(_columns(meths, internal._Method, ('function',))[0])
+        for f in funcs:
+            size += _strsize(char_p(f + _func_name).value) + \
+                _strsize(char_p(f + _func_pkg).value)
+    return size
+
+
+def _types_size(types):
+    ptr = sizeof(c_void_p)
+    size = 0
+    seen = set()
+    stack = []
+
+    def table(ts):
+        nonlocal size
+        n = ts.contents.length
+        size += sizeof(internal._Types) + n * ptr
+        stack.extend(_pointers(ts.contents.types, n))
+
+    def push(p):
+        if p:
+            stack.append(cast(p, c_void_p).value)
+
+    table(types)
+    while stack:
+        addr = stack.pop()
+        if addr in seen:
+            continue
+        seen.add(addr)
+        t = internal._Type.from_address(addr)
+        size += sizeof(internal._Type) + _strsize(t.name) + \
+            _strsize(t.packagePath) + _strsize(t.fieldName) + \
+            _strsize(t.fieldTag)
+        push(t.element)
+        push(t.key)
+        for ts in (t.fields, t.funcArgs, t.funcReturns):
+            if ts:
+                table(ts)
+        if t.methods:
+            ms = t.methods.contents
+            size += sizeof(internal._Methods_Type) + ms.length * (
+                ptr + sizeof(internal._Method_Type))
+            for i in range(ms.length):
+                m = ms.methods[i][0]
+                size += _strsize(m.name)
+                push(m.gotype)
+    return size
+
+
+def _words(addr, size):
+    # The view is rounded up to a power of two so only a few ctypes array
+    # types are ever created. Only the words that are indexed are read.
+    size = 1 << (size - 1).bit_length()
+    buf = (c_char * size).from_address(addr)
+    return memoryview(buf).cast('B').cast('Q')
+
+
+def _parse_method_type(ms, cache, strings, convert=None):
+    convert = convert or _convert_type
     methods = []
     for i in range(ms.contents.length):
         m = ms.contents.methods[i][0]
-        typ = _convert_type(m.gotype.contents, cache) if m.gotype else None
-        methods.append(Method_Type(str(m.name.decode('utf-8', 'replace')), typ,
+        typ = convert(m.gotype.contents, cache,
+                      strings) if m.gotype else None
+        methods.append(Method_Type(strings.decode(m.name), typ,
                                    int(m.ifaceAddr), int(m.funcAddr)))
     return methods
 
 
-def _convert_type(t, cache):
+def _convert_fields(fields, strings):
+    vals = []
+    for i in range(fields.contents.length):
+        field = fields.contents.types[i].contents
+        f = Type()
+        f.fieldName = strings.decode(field.fieldName)
+        if field.fieldTag:
+            f.fieldTag = strings.decode(field.fieldTag)
+        f.fieldAnon = True if field.fieldAnon > 0 else False
+        f.kind = Kind(field.kind)
+        f.addr = int(field.addr)
+        f.name = strings.decode(field.name)
+        vals.append(f)
+    return vals
+
+
+def _convert_type(t, cache, strings):
     try:
         return cache[int(t.addr)]
     except KeyError:
@@ -380,24 +1290,13 @@ def _convert_type(t, cache):
     typ = Type()
     typ.addr = int(t.addr)
     typ.kind = Kind(t.kind)
-    typ.name = str(t.name.decode('utf-8', 'replace'))
+    typ.name = strings.decode(t.name)
     typ.ptrResolved = int(t.ptrResolved)
-    typ.packagePath = str(t.packagePath.decode('utf-8', 'replace'))
+    typ.packagePath = strings.decode(t.packagePath)
 
     # If the type is a struct and has fields, extract field information.
     if t.kind == Kind.Struct.value and t.fields:
-        typ.fields = []
-        for i in range(t.fields.contents.length):
-            field = t.fields.contents.types[i].contents
-            f = Type()
-            f.fieldName = str(field.fieldName.decode('utf-8', 'replace'))
-            if field.fieldTag:
-                f.fieldTag = str(field.fieldTag.decode('utf-8', 'replace'))
-            f.typeAnon = True if field.fieldAnon > 0 else False
-            f.kind = Kind(field.kind)
-            f.addr = int(field.addr)
-            f.name = str(field.name.decode('utf-8', 'replace'))
-            typ.fields.append(f)
+        typ.fields = _convert_fields(t.fields, strings)
 
     typ.length = int(t.length)
     if t.chanDir != 0:
@@ -406,21 +1305,121 @@ def _convert_type(t, cache):
     cache[int(t.addr)] = typ
     
     typ.isVariadic = True if t.isVariadic > 0 else False
-    typ.element = _convert_type(t.element.contents,
-                                cache) if t.element else None
-    typ.key = _convert_type(t.key.contents,
-                            cache) if t.key else None
-    typ.funcArgs = _parseTypes(t.funcArgs, cache) if t.funcArgs else None
-    typ.funcReturns = _parseTypes(t.funcReturns,
-                                  cache) if t.funcReturns else None
-    typ.methods = _parse_method_type(t.methods, cache) if t.methods else None
+    typ.element = _convert_type(t.element.contents, cache,
+                                strings) if t.element else None
+    typ.key = _convert_type(t.key.contents, cache,
+                            strings) if t.key else None
+    typ.funcArgs = _parseTypes(t.funcArgs, cache,
+                               strings) if t.funcArgs else None
+    typ.funcReturns = _parseTypes(t.funcReturns, cache,
+                                  strings) if t.funcReturns else None
+    typ.methods = _parse_method_type(t.methods, cache,
+                                     strings) if t.methods else None
 
     return typ
 
 
-def _parseTypes(types, cache):
-    vals = []
+def _parseTypes(types, cache, strings=None):
+    return list(_iterTypes(types, cache, strings))
+
+
+def _iterTypes(types, cache, strings=None, convert=None):
+    if strings is None:
+        strings = StringTable()
+    convert = convert or _convert_type
     for i in range(types.contents.length):
         t = types.contents.types[i][0]
-        vals.append(_convert_type(t, cache))
-    return vals
+        yield convert(t, cache, strings)
+
+
+class _LazyCache(dict):
+    '''
+    _LazyCache is the addr cache of the lazy types of a GoFile. It refers to
+    the GoFile that owns the C structures of the types.
+    '''
+    __slots__ = ('owner',)
+
+    def __init__(self):
+        self.owner = None
+
+
+class _LazyType(Type):
+    '''
+    _LazyType is a Type that decodes its attributes from the underlying C
+    structure the first time they are accessed. Edges to other types are
+    resolved to other _LazyType objects through the shared addr cache, so
+    identity is the same as for eagerly converted types.
+
+    The C structure is owned by libgore, so all attributes that are needed
+    must be accessed before the GoFile is closed, afterwards accessing an
+    attribute that has not been decoded raises ValueError. The GoFile is kept
+    alive through the cache, so it is not closed by its finalizer while lazy
+    types are still referenced. Pickling a _LazyType decodes all attributes
+    and produces a regular Type.
+    '''
+    __slots__ = ('_t', '_cache', '_strings')
+
+    def __init__(self, t, cache, strings):
+        self._t = t
+        self._cache = cache
+        self._strings = strings
+        self.addr = int(t.addr)
+
+    def __getattr__(self, name):
+        try:
+            decode = _lazy_decoders[name]
+        except KeyError:
+            raise AttributeError(name) from None
+        owner = self._cache.owner
+        if owner is not None and owner.closed:
+            raise ValueError('I/O operation on closed file')
+        value = decode(self._t, self._cache, self._strings)
+        setattr(self, name, value)
+        return value
+
+    def __reduce_ex__(self, protocol):
+        state = {name: getattr(self, name) for name in _lazy_decoders}
+        state['addr'] = self.addr
+        return (Type, (), (None, state))
+
+
+def _lazy_type(t, cache, strings):
+    try:
+        return cache[int(t.addr)]
+    except KeyError:
+        pass
+    typ = _LazyType(t, cache, strings)
+    cache[typ.addr] = typ
+    return typ
+
+
+def _lazy_types(types, cache, strings=None):
+    return list(_iterTypes(types, cache, strings, _lazy_type))
+
+
+_lazy_decoders = {
+    'kind': lambda t, c, s: Kind(t.kind),
+    'name': lambda t, c, s: s.decode(t.name),
+    'ptrResolved': lambda t, c, s: int(t.ptrResolved),
+    'packagePath': lambda t, c, s: s.decode(t.packagePath),
+    'fields': lambda t, c, s: _convert_fields(t.fields, s)
+    if t.kind == Kind.Struct.value and t.fields else None,
+    'fieldName': lambda t, c, s: None,
+    'fieldTag': lambda t, c, s: None,
+    'fieldAnon': lambda t, c, s: None,
+    'element': lambda t, c, s: _lazy_type(t.element.contents, c, s)
+    if t.element else None,
+    'length': lambda t, c, s: int(t.length),
+    'chanDir': lambda t, c, s: ChanDir(t.chanDir) if t.chanDir != 0
+    else None,
+    'key': lambda t, c, s: _lazy_type(t.key.contents, c, s)
+    if t.key else None,
+    'funcArgs': lambda t, c, s: _lazy_types(t.funcArgs, c, s)
+    if t.funcArgs else None,
+    'funcReturns': lambda t, c, s: _lazy_types(t.funcReturns, c, s)
+    if t.funcReturns else None,
+    'isVariadic': lambda t, c, s: True if t.isVariadic > 0 else False,
+    'methods': lambda t, c, s: _parse_method_type(t.methods, c, s,
+                                                  _lazy_type)
+    if t.methods else None,
+}
@@ -0,0 +1,412 @@
+# Copyright 2019 The GoRE.tk Authors. All rights reserved.
+# Use of this source code is governed by the license that
+# can be found in the LICENSE file.
+
+import mmap
+import re
+import struct
+import threading
+
+from pygore.backend import Backend, register_backend
+from pygore.lib import (CompilerVersion, Function, Method, Package,
+                        PackageClass)
+from pygore.triage import (_ELF, _PF_W, _build_id, _read_build_info,
+                           _uvarint)
+
+# The pclntab magics and the Go versions that introduced them.
+_pclntab_magics = {
+    0xfffffffb: (1, 2),
+    0xfffffffa: (1, 16),
+    0xfffffff0: (1, 18),
+    0xfffffff1: (1, 20),
+}
+
+# Before Go 1.13 there is no build info, and the version is only found as
+# the value of runtime.buildVersion somewhere in the read-only data.
+_version_re = re.compile(rb'go1\.\d{1,2}(?:\.\d{1,2})?(?:beta\d|rc\d)?')
+
+
+@register_backend
+class NativeBackend(Backend):
+    '''
+    NativeBackend extracts the compiler version, the build id and the
+    packages of an ELF binary without libgore. The file is memory-mapped and
+    the pclntab, the moduledata and the build info are decoded in place, so
+    opening a file is cheap and a NativeBackend can be used from many
+    threads.
+
+    Functions are read from the pclntab of Go 1.2 and later and are named
+    and split into packages the same way as libgore does. Packages are
+    classified by the module information of the build info if it is present,
+    and by the source paths of the functions otherwise. The compiler version
+    is taken from the build info, or from the version string of the runtime
+    for binaries built before Go 1.13. Its sha and timestamp are empty,
+    since they come from a table of releases in libgore.
+
+    PE and Mach-O files are not supported, GoFile(path, backend='auto') uses
+    libgore for them.
+    '''
+    name = 'native'
+
+    def __init__(self, path):
+        super().__init__(path)
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            self._elf = _ELF(self._map)
+            self._table = _LineTable(self._map, self._elf)
+        except (ValueError, IndexError, struct.error) as e:
+            self._map.close()
+            raise ValueError('{}: {}'.format(path, e)) from None
+        self._lock = threading.RLock()
+        self._buildinfo = None
+        self._classes = None
+
+    @classmethod
+    def supports(cls, path):
+        '''
+        Returns True if the file at path is an ELF file.
+        '''
+        try:
+            with open(path, 'rb') as f:
+                return f.read(4) == b'\x7fELF'
+        except OSError:
+            return False
+
+    @property
+    def text_start(self):
+        '''
+        The start of the text section, which the method offsets of the types
+        are relative to.
+        '''
+        return self._table.text_start
+
+    def close(self):
+        '''
+        Unmaps the file. Closing twice does nothing.
+        '''
+        self._map.close()
+
+    def compiler_version(self):
+        '''
+        Returns the CompilerVersion of the binary, or None if it is not
+        found. Only the name is set.
+        '''
+        version = self._build_info()[0]
+        if not version:
+            rodata = self._elf.sections.get('.rodata')
+            start, end = 0, len(self._map)
+            if rodata is not None and rodata.offset is not None:
+                start, end = rodata.offset, rodata.offset + rodata.size
+            match = _version_re.search(self._map, start, end)
+            if match is None:
+                return None
+            version = match.group().decode('ascii')
+        return CompilerVersion(version, '', '')
+
+    def build_id(self):
+        '''
+        Returns the Go build id of the binary, or an empty string.
+        '''
+        return _build_id(self._map, self._elf)
+
+    def packages(self, cls, strings):
+        '''
+        Returns the list of Package of the PackageClass cls, sorted by name.
+        '''
+        decode = strings.decode
+        pkgs = []
+        for name, filepath, funcs in self._packages()[cls]:
+            pkg = decode(name)
+            fs, ms = [], []
+            for base, recv, entry, end in funcs:
+                if recv is None:
+                    fs.append(Function(decode(base), entry, end, pkg))
+                else:
+                    ms.append(Method(decode(base), entry, end, pkg,
+                                     decode(recv)))
+            pkgs.append(Package(pkg, decode(filepath), fs, ms))
+        return pkgs
+
+    def _build_info(self):
+        with self._lock:
+            if self._buildinfo is None:
+                self._buildinfo = _read_build_info(self._map, self._elf)
+            return self._buildinfo
+
+    def _packages(self):
+        with self._lock:
+            if self._classes is None:
+                self._classes = self._classify()
+            return self._classes
+
+    def _classify(self):
+        t = self._table
+        prefixes = (b'go:', b'type:') if t.version >= (1, 20) else \
+            (b'go.', b'type.')
+        groups = dict()
+        for i, (name, entry, end) in enumerate(t.functions()):
+            pkg, recv, base = _split_name(name, prefixes)
+            if pkg is None:
+                # Compiler generated functions belong to no package.
+                continue
+            g = groups.get(pkg)
+            if g is None:
+                g = groups[pkg] = (dict(), [])
+            f = t.file(i)
+            if f is not None and f != b'<autogenerated>':
+                d = _dir(f)
+                g[0][d] = g[0].get(d, 0) + 1
+            g[1].append((base, recv, entry, end))
+
+        # The file path of a package is the directory most of its functions
+        # are in, since functions can be inlined from or linked to other
+        # packages.
+        paths = {pkg: max(dirs, key=dirs.get) if dirs else b''
+                 for pkg, (dirs, _) in groups.items()}
+        main_dir = paths.get(b'main', b'').decode('utf-8', 'replace')
+        runtime = paths.get(b'runtime', b'')
+        goroot = None
+        if runtime.endswith(b'runtime'):
+            goroot = runtime[:-len(b'runtime')].decode('utf-8', 'replace')
+        mods = _modules(self._build_info()[1])
+
+        classes = {cls: [] for cls in PackageClass}
+        for pkg in sorted(groups):
+            filepath, funcs = paths[pkg], groups[pkg][1]
+            cls = _classify(pkg.decode('utf-8', 'replace'),
+                            filepath.decode('utf-8', 'replace'),
+                            main_dir, goroot, mods)
+            classes[cls].append((pkg, filepath, funcs))
+        return classes
+
+
+def _classify(name, filepath, main_dir, goroot, mods):
+    main_mod, deps = mods
+    if name == 'main':
+        return PackageClass.Main
+    if main_mod and (name == main_mod or name.startswith(main_mod + '/')):
+        return PackageClass.Main
+    if main_dir and (filepath == main_dir or
+                     filepath.startswith(main_dir + '/')):
+        if '/vendor/' in filepath[len(main_dir):] + '/':
+            return PackageClass.Vendor
+        return PackageClass.Main
+    first = name.split('/', 1)[0]
+    if '.' not in first and (goroot is None or not filepath or
+                             filepath.startswith(goroot)):
+        return PackageClass.Std
+    if ('.' in first or '/vendor/' in filepath or
+            any(name == d or name.startswith(d + '/') for d in deps)):
+        return PackageClass.Vendor
+    return PackageClass.Unknown
+
+
+def _split_name(name, generated):
+    # Splits a function name into package, receiver and base name like
+    # the PackageName, ReceiverName and BaseName of debug/gosym.
+    start = name.find(b'[')
+    end = name.rfind(b']')
+    plain = name if start < 0 or end < 0 else name[:start] + name[end + 1:]
+    if plain.startswith(generated):
+        return None, None, None
+    pathend = max(plain.rfind(b'/'), 0)
+    i = plain.find(b'.', pathend)
+    if i < 0:
+        return None, None, None
+    recv = None
+    if plain.rfind(b'.', pathend) != i:
+        recv = name[i + 1:name.rfind(b'.', pathend)]
+    j = plain.rfind(b'.')
+    if plain is not name and j > start:
+        j = name.rfind(b'.')
+    return plain[:i], recv, name[j + 1:]
+
+
+def _dir(path):
+    # path.Dir for the cleaned paths of the pclntab.
+    i = path.rfind(b'/')
+    if i < 0:
+        return b'.'
+    return path[:i] or b'/'
+
+
+def _modules(mod):
+    # Returns the main module path and the dependency paths from the module
+    # information of the build info.
+    main, deps = None, []
+    for line in mod.split('\n'):
+        fields = line.split('\t')
+        if len(fields) >= 2 and fields[0] == 'mod':
+            main = fields[1]
+        elif len(fields) >= 2 and fields[0] == 'dep':
+            deps.append(fields[1])
+    if main == 'command-line-arguments':
+        main = None
+    return main, deps
+
+
+class _LineTable:
+    # The function table of the pclntab, see golang.org/s/go12symtab and
+    # runtime/symtab.go.
+
+    def __init__(self, m, elf):
+        self.map = m
+        o = elf.order
+        # Position independent binaries keep the pclntab in the relocated
+        # read-only data.
+        sec = elf.sections.get('.gopclntab') or \
+            elf.sections.get('.data.rel.ro.gopclntab')
+        if sec is not None and sec.offset is not None:
+            off, addr = sec.offset, sec.addr
+        else:
+            off = _find_pclntab(m, o)
+            addr = elf.address(off)
+        magic = struct.unpack_from(o + 'I', m, off)[0]
+        self.version = _pclntab_magics.get(magic)
+        if self.version is None or m[off + 4:off + 6] != b'\x00\x00':
+            raise ValueError('unknown pclntab version')
+        self.quantum, self.ptrsize = m[off + 6], m[off + 7]
+        if self.quantum not in (1, 2, 4) or self.ptrsize not in (4, 8):
+            raise ValueError('invalid pclntab header')
+        self.u32 = o + 'I'
+        uptr = o + ('Q' if self.ptrsize == 8 else 'I')
+
+        def word(k):
+            return struct.unpack_from(uptr, m, off + 8 + k * self.ptrsize)[0]
+
+        self.nfunc = word(0)
+        if self.version >= (1, 18):
+            self.funcnametab = off + word(3)
+            self.cutab = off + word(4)
+            self.filetab = off + word(5)
+            self.pctab = off + word(6)
+            self.funcdata = self.functab = off + word(7)
+        elif self.version >= (1, 16):
+            self.funcnametab = off + word(2)
+            self.cutab = off + word(3)
+            self.filetab = off + word(4)
+            self.pctab = off + word(5)
+            self.funcdata = self.functab = off + word(6)
+        else:
+            self.funcnametab = self.funcdata = self.pctab = off
+            self.functab = off + 8 + self.ptrsize
+            self.cutab = None
+            self.filetab = off + struct.unpack_from(
+                self.u32, m, self.functab +
+                (2 * self.nfunc + 1) * self.ptrsize)[0]
+
+        # Method offsets are relative to the text of the moduledata, which
+        # is also the base of the function entries since Go 1.18.
+        text = elf.sections.get('.text')
+        self.text_start = _moduledata_text(m, elf, addr, self.version)
+        if self.text_start is None and text is not None:
+            self.text_start = text.addr
+        if self.text_start is None and self.version >= (1, 18):
+            self.text_start = word(2)
+        # Since Go 1.18 the function table holds 32-bit offsets from the
+        # text, and the _func structs start with one.
+        if self.version >= (1, 18):
+            self.field = self.u32
+            self.entrysize = 4
+        else:
+            self.field = uptr
+            self.entrysize = self.ptrsize
+
+    def functions(self):
+        '''
+        Returns a list of (name, entry, end) for all functions in the table.
+        '''
+        m = self.map
+        tab = struct.unpack_from('{}{}{}'.format(
+            self.field[0], 2 * self.nfunc + 1, self.field[1]), m,
+            self.functab)
+        base = self.text_start if self.version >= (1, 18) else 0
+        entries = [pc + base for pc in tab[0::2]]
+        nameoff = self.funcdata + self.entrysize
+        u32, names, find = self.u32, self.funcnametab, m.find
+        funcs = []
+        for i in range(self.nfunc):
+            start = names + struct.unpack_from(
+                u32, m, nameoff + tab[2 * i + 1])[0]
+            funcs.append((m[start:find(b'\x00', start)], entries[i],
+                          entries[i + 1]))
+        return funcs
+
+    def file(self, i):
+        '''
+        Returns the source file at the entry of the i-th function, or None.
+        '''
+        m = self.map
+        funcoff = struct.unpack_from(
+            self.field, m, self.functab + (2 * i + 1) * self.entrysize)[0]
+        fields = self.funcdata + funcoff + self.entrysize
+        pcfile = struct.unpack_from(self.u32, m, fields + 16)[0]
+        fno = self._value_at_entry(self.pctab + pcfile)
+        if self.cutab is None:
+            if fno <= 0:
+                return None
+            off = struct.unpack_from(self.u32, m, self.filetab + 4 * fno)[0]
+            start = self.funcdata + off
+        else:
+            if fno < 0:
+                return None
+            cu = struct.unpack_from(self.u32, m, fields + 28)[0]
+            off = struct.unpack_from(self.u32, m,
+                                     self.cutab + (cu + fno) * 4)[0]
+            if off == 0xffffffff:
+                return None
+            start = self.filetab + off
+        return m[start:m.find(b'\x00', start)]
+
+    def _value_at_entry(self, p):
+        # Decodes the pc-value table at p up to the first value that covers
+        # the entry of the function.
+        val, pc, first = -1, 0, True
+        while True:
+            uv, p = _uvarint(self.map, p)
+            if uv == 0 and not first:
+                return -1
+            first = False
+            val += -(uv >> 1) - 1 if uv & 1 else uv >> 1
+            delta, p = _uvarint(self.map, p)
+            pc += delta * self.quantum
+            if pc > 0:
+                return val
+
+
+def _find_pclntab(m, order):
+    # Searches for a pclntab header when the section headers are stripped.
+    for magic in _pclntab_magics:
+        header = struct.pack(order + 'I', magic) + b'\x00\x00'
+        i = m.find(header)
+        while i >= 0:
+            if m[i + 6] in (1, 2, 4) and m[i + 7] in (4, 8):
+                return i
+            i = m.find(header, i + 1)
+    raise ValueError('no pclntab found')
+
+
+def _moduledata_text(m, elf, pclntab, version):
+    # Finds the moduledata by the pointer to the pclntab it starts with, and
+    # returns its text field. The field follows the function table slices,
+    # findfunctab, minpc and maxpc.
+    if pclntab is None:
+        return None
+    ptr = elf.order + ('Q' if elf.ptrsize == 8 else 'I')
+    size = elf.ptrsize
+    text = 22 if version >= (1, 16) else 12
+    needle = struct.pack(ptr, pclntab)
+    for vaddr, off, filesz, flags in elf.segments:
+        if not flags & _PF_W:
+            continue
+        end = off + filesz
+        i = m.find(needle, off, end)
+        while i >= 0:
+            if (i - off) % size == 0 and i + (text + 1) * size <= end:
+                minpc, maxpc, start = struct.unpack_from(
+                    elf.order + 3 * ptr[1], m, i + (text - 2) * size)
+                if 0 < start <= minpc < maxpc:
+                    return start
+            i = m.find(needle, i + 1, end)
+    return None
@@ -0,0 +1,450 @@
+# Copyright 2019 The GoRE.tk Authors. All rights reserved.
+# Use of this source code is governed by the license that
+# can be found in the LICENSE file.
+
+import atexit
+import multiprocessing
+import os
+import pickle
+import signal
+import threading
+import time
+import traceback
+
+from pygore.lib import GoFile, _flat
+
+# How often a waiting call checks the worker for its time and memory budget.
+_poll_interval = 0.05
+
+
+class SandboxError(Exception):
+    '''
+    Base class for errors raised by sandboxed analyses.
+    '''
+
+
+class AnalysisError(SandboxError):
+    '''
+    The analysis raised an exception in the worker process.
+
+    Attributes
+    ----------
+    type_name : str
+        the name of the exception type raised in the worker.
+    remote_traceback : str
+        the formatted traceback from the worker.
+    '''
+    def __init__(self, type_name, message, remote_traceback=None):
+        super().__init__('{}: {}'.format(type_name, message))
+        self.type_name = type_name
+        self.remote_traceback = remote_traceback
+
+
+class AnalysisTimeout(SandboxError):
+    '''
+    The file used up its wall-clock budget and the worker was killed.
+    '''
+
+
+class MemoryLimitExceeded(SandboxError):
+    '''
+    The worker used more memory than allowed and was killed.
+    '''
+
+
+class WorkerCrashed(SandboxError):
+    '''
+    The worker process died while analyzing the file.
+
+    Attributes
+    ----------
+    exitcode : int
+        the exit code of the worker, negative if it was killed by a signal.
+    '''
+    def __init__(self, exitcode):
+        if exitcode is not None and exitcode < 0:
+            try:
+                reason = 'terminated by {}'.format(
+                    signal.Signals(-exitcode).name)
+            except ValueError:
+                reason = 'terminated by signal {}'.format(-exitcode)
+        else:
+            reason = 'exited with code {}'.format(exitcode)
+        super().__init__('worker process ' + reason)
+        self.exitcode = exitcode
+
+
+class SandboxPool:
+    '''
+    SandboxPool is a pool of worker processes that run GoFile analyses on
+    behalf of SandboxedGoFile, so a binary that makes libgore hang or crash
+    only takes down a worker.
+
+    Each worker holds at most one file at a time. Workers are reused for
+    many files and are replaced after max_files files, or as soon as a call
+    fails with a timeout, a crash or too much memory.
+
+    Parameters
+    ----------
+    workers : int
+        the maximum number of worker processes, and so of files analyzed at
+        the same time. Defaults to the number of CPUs. Opening more files
+        blocks until a worker is free.
+    timeout : float
+        the default wall-clock budget in seconds for each file, or None for
+        no limit.
+    memory_limit : int
+        the default limit in bytes of the resident memory of a worker, or
+        None for no limit. The limit is enforced by polling the memory use
+        of the worker, which is only supported on Linux.
+    max_files : int
+        the number of files a worker analyzes before it is replaced.
+    context : multiprocessing context
+        the context used to start workers. Defaults to 'spawn', since
+        libgore does not survive a fork of a process it has started in.
+    '''
+    def __init__(self, workers=None, timeout=None, memory_limit=None,
+                 max_files=100, context=None):
+        if workers is None:
+            workers = os.cpu_count() or 1
+        if workers < 1 or max_files < 1:
+            raise ValueError('workers and max_files must be positive')
+        self.workers = workers
+        self.timeout = timeout
+        self.memory_limit = memory_limit
+        self.max_files = max_files
+        self._context = context or multiprocessing.get_context('spawn')
+        self._idle = []
+        self._busy = 0
+        self._closed = False
+        self._cond = threading.Condition()
+
+    def close(self):
+        '''
+        Stops all idle workers. Workers still holding a file are stopped when
+        the file is closed.
+        '''
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._cond.notify_all()
+        for w in idle:
+            w.stop()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _checkout(self):
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise SandboxError('sandbox pool is closed')
+                if self._idle:
+                    w = self._idle.pop()
+                    break
+                if self._busy < self.workers:
+                    w = None
+                    break
+                self._cond.wait()
+            self._busy += 1
+        if w is None:
+            try:
+                w = _Worker(self._context)
+            except BaseException:
+                self._checkin(None)
+                raise
+        return w
+
+    def _checkin(self, worker):
+        if worker is not None and (worker.files >= self.max_files or
+                                   not worker.alive()):
+            worker.stop()
+            worker = None
+        with self._cond:
+            self._busy -= 1
+            if worker is not None:
+                if self._closed:
+                    worker.stop()
+                else:
+                    self._idle.append(worker)
+            self._cond.notify()
+
+
+class SandboxedGoFile:
+    '''
+    SandboxedGoFile analyzes a Go binary in a worker process of a
+    SandboxPool. It has the same methods as GoFile, and failures in the
+    worker are raised as SandboxError subclasses: AnalysisTimeout,
+    MemoryLimitExceeded, WorkerCrashed, or AnalysisError for exceptions
+    raised by the analysis itself.
+
+    The file holds a worker from the first call until it is closed. After a
+    timeout, a crash or too much memory, the worker is replaced and the next
+    call opens the file again in a fresh worker, so results that can still be
+    extracted are not lost with the failing one.
+
+    Attributes
+    ----------
+    path : str
+        path to the binary.
+    pool : SandboxPool
+        the pool the file is analyzed in. Defaults to a shared pool that is
+        created on first use.
+    timeout : float
+        the wall-clock budget in seconds for all calls on this file. Defaults
+        to the timeout of the pool.
+    memory_limit : int
+        the limit in bytes of the resident memory of the worker. Defaults to
+        the memory limit of the pool.
+    elapsed : float
+        the wall time in seconds used of the budget so far.
+    '''
+    def __init__(self, path, pool=None, timeout=None, memory_limit=None):
+        if pool is None:
+            pool = default_pool()
+        self.path = path
+        self.pool = pool
+        self.timeout = pool.timeout if timeout is None else timeout
+        self.memory_limit = pool.memory_limit if memory_limit is None \
+            else memory_limit
+        self.elapsed = 0.0
+        self._compiler_version = None
+        self._worker = None
+        self._closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        '''
+        Closes the file in the worker and returns the worker to the pool.
+        '''
+        if self._closed:
+            return
+        self._closed = True
+        w, self._worker = self._worker, None
+        if w is None:
+            return
+        try:
+            w.call('close', (), self._deadline(), self.memory_limit)
+        except SandboxError:
+            w.stop()
+        self.pool._checkin(w)
+
+    def set_compiler_version(self, version):
+        '''
+        Set an assumed compiler version to be used when extracting information
+        from the binary.
+        '''
+        ok = self._call('set_compiler_version', version)
+        if ok:
+            self._compiler_version = version
+        return ok
+
+    def get_compiler_version(self):
+        '''
+        Returns compiler information extracted from the binary.
+        '''
+        return self._call('get_compiler_version')
+
+    def get_packages(self):
+        '''
+        Returns all Go packages gore thinks is part of the main project.
+        '''
+        return self._call('get_packages')
+
+    def get_vendor_packages(self):
+        '''
+        Returns all Go packages gore thinks is vendor or 3rd-party packages.
+        '''
+        return self._call('get_vendor_packages')
+
+    def get_std_lib_packages(self):
+        '''
+        Returns all Go packages gore thinks is standard library packages.
+        '''
+        return self._call('get_std_lib_packages')
+
+    def get_unknown_packages(self):
+        '''
+        Returns all Go packages gore could not classify.
+        '''
+        return self._call('get_unknown_packages')
+
+    def get_types(self):
+        '''
+        Returns all Go types extracted from the binary.
+        '''
+        return self._call('get_types')
+
+    def get_build_id(self):
+        '''
+        Returns the extracted build id from the binary.
+        '''
+        return self._call('get_build_id')
+
+    def get_all(self, types=True):
+        '''
+        Returns an Analysis with everything extracted from the binary, see
+        GoFile.get_all. This is a single round trip to the worker.
+        '''
+        return self._call('get_all', types)
+
+    def _deadline(self):
+        if self.timeout is None:
+            return None
+        return time.monotonic() + max(0.0, self.timeout - self.elapsed)
+
+    def _call(self, method, *args):
+        if self._closed:
+            raise ValueError('I/O operation on closed file')
+        try:
+            if self._worker is None:
+                self._open()
+            return self._worker_call(method, *args)
+        except SandboxError as e:
+            if not isinstance(e, AnalysisError) and self._worker is not None:
+                # The state of the file in the worker is gone.
+                w, self._worker = self._worker, None
+                w.stop()
+                self.pool._checkin(w)
+            raise
+
+    def _worker_call(self, method, *args):
+        # Only the time spent in the worker counts against the timeout, not
+        # the time spent waiting for a worker of the pool.
+        start = time.monotonic()
+        try:
+            return self._worker.call(method, args, self._deadline(),
+                                     self.memory_limit)
+        finally:
+            self.elapsed += time.monotonic() - start
+
+    def _open(self):
+        w = self.pool._checkout()
+        self._worker = w
+        w.files += 1
+        try:
+            self._worker_call('open', self.path)
+        except AnalysisError:
+            self._worker = None
+            self.pool._checkin(w)
+            raise
+        if self._compiler_version is not None:
+            self._worker_call('set_compiler_version', self._compiler_version)
+
+
+_default_pool = None
+_default_lock = threading.Lock()
+
+
+def default_pool():
+    '''
+    Returns the SandboxPool used by SandboxedGoFile when no pool is given.
+    It is created on first use and closed when the interpreter exits.
+    '''
+    global _default_pool
+    with _default_lock:
+        if _default_pool is None:
+            _default_pool = SandboxPool()
+            atexit.register(_default_pool.close)
+        return _default_pool
+
+
+class _Worker:
+    def __init__(self, context):
+        self.conn, child = context.Pipe()
+        self.process = context.Process(target=_worker_main, args=(child,),
+                                       daemon=True)
+        self.process.start()
+        child.close()
+        self.files = 0
+
+    def alive(self):
+        return self.process.is_alive()
+
+    def stop(self):
+        if self.process.is_alive():
+            self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+    def call(self, method, args, deadline, memory_limit):
+        try:
+            self.conn.send((method, args))
+        except (BrokenPipeError, ConnectionResetError):
+            raise self._crashed()
+        while True:
+            wait = _poll_interval
+            if deadline is not None:
+                wait = min(wait, max(0.0, deadline - time.monotonic()))
+            if self.conn.poll(wait):
+                try:
+                    status, value = self.conn.recv()
+                except (EOFError, ConnectionResetError):
+                    raise self._crashed()
+                if status == 'ok':
+                    return value
+                if status == 'memory':
+                    raise MemoryLimitExceeded(value)
+                raise AnalysisError(*value)
+            if not self.process.is_alive():
+                raise self._crashed()
+            if memory_limit is not None:
+                rss = _rss(self.process.pid)
+                if rss is not None and rss > memory_limit:
+                    self.stop()
+                    raise MemoryLimitExceeded(
+                        'worker used {} bytes, the limit is {}'.format(
+                            rss, memory_limit))
+            if deadline is not None and time.monotonic() >= deadline:
+                self.stop()
+                raise AnalysisTimeout('{} did not finish in time'.format(
+                    method))
+
+    def _crashed(self):
+        self.process.join()
+        return WorkerCrashed(self.process.exitcode)
+
+
+def _rss(pid):
+    try:
+        with open('/proc/{}/statm'.format(pid), 'rb') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _worker_main(conn):
+    f = None
+    while True:
+        try:
+            method, args = conn.recv()
+        except (EOFError, KeyboardInterrupt):
+            break
+        try:
+            if method == 'open':
+                f = GoFile(*args)
+                value = None
+            elif method == 'close':
+                f, value = None, f.close()
+            else:
+                value = getattr(f, method)(*args)
+            # Pickle here so a result that can not be sent back is reported
+            # as an error instead of killing the worker.
+            reply = pickle.dumps(('ok', _flat(value)),
+                                 pickle.HIGHEST_PROTOCOL)
+        except MemoryError:
+            reply = pickle.dumps(('memory', 'worker ran out of memory'),
+                                 pickle.HIGHEST_PROTOCOL)
+        except Exception as e:
+            reply = pickle.dumps(('error', (type(e).__name__, str(e),
+                                            traceback.format_exc())),
+                                 pickle.HIGHEST_PROTOCOL)
+        conn.send_bytes(reply)
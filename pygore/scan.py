@@ -0,0 +1,210 @@
+# Copyright 2019 The GoRE.tk Authors. All rights reserved.
+# Use of this source code is governed by the license that
+# can be found in the LICENSE file.
+
+import multiprocessing
+import os
+import pickle
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from itertools import islice
+
+from pygore.lib import Analysis, GoFile
+
+
+class ScanResult(Analysis):
+    '''
+    ScanResult is the Analysis of a single file scanned by scan. If the scan
+    failed, the extracted attributes are None or empty.
+
+    Attributes
+    ----------
+    error : str
+        a description of the error if the scan failed, otherwise None.
+    elapsed : float
+        wall time in seconds spent on the file.
+    '''
+    def __init__(self, path):
+        super().__init__(path)
+        self.error = None
+        self.elapsed = 0.0
+
+    @property
+    def ok(self):
+        '''
+        True if the file was scanned without errors.
+        '''
+        return self.error is None
+
+
+def scan(paths, workers=None, types=True, ordered=True, chunksize=1,
+         backend=None):
+    '''
+    Scans Go binaries in parallel using a pool of worker processes and yields
+    a ScanResult for each file as it is finished.
+
+    Each worker process has its own copy of libgore, so files are analyzed
+    concurrently without sharing any global state. Errors are captured per
+    file and reported in ScanResult.error instead of being raised. If a worker
+    process dies, the files it was working on are rescanned one at a time in
+    a fresh process so the failure can be attributed to the right file.
+
+    Parameters
+    ----------
+    paths : iterable of str
+        paths to the files to scan. The iterable is consumed lazily.
+    workers : int
+        number of worker processes. Defaults to the number of CPUs.
+    types : bool
+        if False, type extraction is skipped.
+    ordered : bool
+        if True, results are yielded in the same order as paths. Otherwise
+        results are yielded as soon as they are done.
+    chunksize : int
+        number of files sent to a worker in one task. Larger chunks reduce
+        the inter-process overhead for small files.
+    backend : str
+        the backend of the GoFile objects, see GoFile.
+    '''
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers < 1 or chunksize < 1:
+        raise ValueError('workers and chunksize must be positive')
+
+    paths = iter(paths)
+    chunks = iter(lambda: list(islice(paths, chunksize)), [])
+    pool = _Pool(workers, types, backend)
+    try:
+        for chunk in chunks:
+            pool.submit(chunk)
+            while len(pool.pending) >= workers * 2:
+                yield from pool.collect(ordered)
+        while pool.pending:
+            yield from pool.collect(ordered)
+    finally:
+        pool.shutdown()
+
+
+class _Pool:
+    def __init__(self, workers, types, backend):
+        self.workers = workers
+        self.types = types
+        self.backend = backend
+        self.pending = deque()
+        self.executor = _executor(workers)
+
+    def submit(self, chunk):
+        try:
+            fut = self.executor.submit(_scan_chunk, chunk, self.types,
+                                       self.backend)
+        except BrokenProcessPool:
+            self.restart()
+            fut = self.executor.submit(_scan_chunk, chunk, self.types,
+                                       self.backend)
+        self.pending.append((chunk, fut, self.executor))
+
+    def restart(self):
+        # Everything still in flight was lost with the pool. Resubmit it to
+        # a fresh pool so the remaining files are not all attributed to the
+        # crash.
+        old = self.executor
+        old.shutdown(wait=False)
+        self.executor = _executor(self.workers)
+        for i, (chunk, fut, executor) in enumerate(self.pending):
+            if executor is old and _lost(fut):
+                fut = self.executor.submit(_scan_chunk, chunk, self.types,
+                                           self.backend)
+                self.pending[i] = (chunk, fut, self.executor)
+
+    def collect(self, ordered):
+        if ordered:
+            done = [self.pending.popleft()]
+            done[0][1].exception()
+        else:
+            wait([fut for _, fut, _ in self.pending],
+                 return_when=FIRST_COMPLETED)
+            done = [entry for entry in self.pending if entry[1].done()]
+            for entry in done:
+                self.pending.remove(entry)
+
+        results = []
+        broken = False
+        for chunk, fut, executor in done:
+            try:
+                payloads = fut.result()
+            except BrokenProcessPool:
+                broken = broken or executor is self.executor
+                payloads = _quarantine(chunk, self.types, self.backend)
+            results.extend(pickle.loads(p) for p in payloads)
+        if broken:
+            self.restart()
+        return results
+
+    def shutdown(self):
+        for _, fut, _ in self.pending:
+            fut.cancel()
+        self.executor.shutdown(wait=False)
+
+
+def _executor(workers):
+    # Workers are spawned rather than forked, so they do not inherit the
+    # threads and open libgore handles of the parent.
+    return ProcessPoolExecutor(max_workers=workers,
+                               mp_context=multiprocessing.get_context('spawn'))
+
+
+def _lost(fut):
+    # Futures that completed before the pool broke keep their results.
+    if not fut.done() or fut.cancelled():
+        return True
+    return isinstance(fut.exception(), BrokenProcessPool)
+
+
+def _quarantine(chunk, types, backend):
+    payloads = []
+    for path in chunk:
+        with _executor(1) as executor:
+            try:
+                payloads.extend(executor.submit(_scan_chunk, [path], types,
+                                                backend).result())
+            except BrokenProcessPool:
+                r = ScanResult(path)
+                r.error = 'worker process terminated abruptly'
+                payloads.append(pickle.dumps(r, pickle.HIGHEST_PROTOCOL))
+    return payloads
+
+
+def _scan_chunk(chunk, types, backend):
+    return [_scan_file(path, types, backend) for path in chunk]
+
+
+def _scan_file(path, types, backend):
+    r = ScanResult(path)
+    start = time.perf_counter()
+    f = None
+    try:
+        f = GoFile(path, backend=backend)
+        a = f.get_all(types)
+        r.compiler_version = a.compiler_version
+        r.build_id = a.build_id
+        r.packages = a.packages
+        r.types = a.types
+    except Exception as e:
+        r.error = '{}: {}'.format(type(e).__name__, e)
+    finally:
+        if f is not None:
+            f.close()
+    r.elapsed = time.perf_counter() - start
+
+    # Results are pickled here, rather than by the executor, so a result that
+    # can not be sent back is reported as an error for this file only.
+    try:
+        return pickle.dumps(r, pickle.HIGHEST_PROTOCOL)
+    except Exception as e:
+        r.packages = dict()
+        r.types = None
+        r.error = 'failed to serialize result: {}: {}'.format(
+            type(e).__name__, e)
+        return pickle.dumps(r, pickle.HIGHEST_PROTOCOL)
@@ -0,0 +1,367 @@
+# Copyright 2019 The GoRE.tk Authors. All rights reserved.
+# Use of this source code is governed by the license that
+# can be found in the LICENSE file.
+
+import hashlib
+import random
+import re
+import sqlite3
+import struct
+import threading
+from array import array
+
+from pygore.lib import Analysis, GoFile, Kind, PackageClass, _walk_types
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# The permutations of MinHash are the hash functions (a * x + b) % _prime of
+# the symbol hashes x, with a, b and x below the prime so the products fit in
+# 64 bits with and without NumPy. No hash is equal to the prime, which marks
+# the signature of an empty set.
+_prime = (1 << 31) - 1
+_empty = _prime
+
+# The number of symbols hashed at a time with NumPy, which bounds the memory
+# of the products to num_perm * _chunk_size * 8 bytes, 4 MiB by default.
+_chunk_size = 4096
+
+# Changed whenever fingerprint or minhash change, so indexes written by
+# older releases are not mixed with new signatures.
+_format_version = '1'
+
+_vendor_re = re.compile(r'^.*/vendor/')
+_inst_re = re.compile(r'\[.*\]')
+_closure_re = re.compile(r'\.(func|gowrap|deferwrap)\d+')
+
+
+def fingerprint(result, classes=(PackageClass.Main, PackageClass.Vendor),
+                types=True):
+    '''
+    Returns the set of normalized symbols of a binary that minhash turns
+    into a signature: the names of its packages, functions, methods and
+    method receivers, and unless types is False, the names of the types of
+    the packages.
+
+    Symbols are normalized so the same code matches across builds: vendor
+    directories are removed from package paths, type parameters are removed
+    from instantiated generics, and closures are not numbered.
+
+    Parameters
+    ----------
+    result : Analysis or GoFile
+        the results of the binary. For a GoFile, only the packages of the
+        given classes and the types are extracted.
+    classes : iterable of PackageClass
+        the package classes to take symbols from, by default the main and
+        vendor packages.
+    types : bool
+        if False, type names are left out.
+    '''
+    if isinstance(result, GoFile):
+        pkgs = [p for cls in classes for p in result._packages(cls)]
+        roots = result.get_types() if types else ()
+    elif isinstance(result, Analysis):
+        pkgs = [p for cls in classes for p in result.packages.get(cls, ())]
+        roots = (result.types or ()) if types else ()
+    else:
+        raise TypeError('expected Analysis or GoFile, got {}'.format(
+            type(result).__name__))
+    symbols = set()
+    add = symbols.add
+    for p in pkgs:
+        pkg = _normalize(p.name)
+        add('p:' + pkg)
+        for f in p.functions:
+            add('f:' + pkg + '.' + _normalize(f.name))
+        for m in p.methods:
+            rec = _normalize(m.receiver).strip('(*)')
+            add('r:' + pkg + '.' + rec)
+            add('m:' + pkg + '.' + rec + '.' + _normalize(m.name))
+    if roots:
+        paths = {p.name for p in pkgs}
+        for t in _walk_types(list(roots)):
+            if t.packagePath in paths and t.kind != Kind.Ptr and t.name:
+                add('t:' + _normalize(t.name))
+    return symbols
+
+
+def minhash(symbols, num_perm=128, seed=1):
+    '''
+    Returns the MinHash signature of a set of symbols as an array of
+    num_perm unsigned 32-bit integers. The fraction of equal values in the
+    signatures of two sets estimates their Jaccard similarity, if both were
+    computed with the same num_perm and seed. The signature is vectorized if
+    NumPy is installed, over chunks of symbols so the memory used does not
+    grow with the number of symbols.
+    '''
+    a, b = _permutations(num_perm, seed)
+    hashes = [_hash32(s) % _prime for s in symbols]
+    if not hashes:
+        return array('I', [_empty]) * num_perm
+    if numpy is not None:
+        xs = numpy.array(hashes, dtype=numpy.uint64)
+        pa = numpy.array(a, dtype=numpy.uint64)[:, None]
+        pb = numpy.array(b, dtype=numpy.uint64)[:, None]
+        prime = numpy.uint64(_prime)
+        sig = numpy.full(num_perm, _empty, dtype=numpy.uint64)
+        for i in range(0, len(xs), _chunk_size):
+            h = pa * xs[i:i + _chunk_size]
+            h += pb
+            h %= prime
+            numpy.minimum(sig, h.min(axis=1), out=sig)
+        return array('I', sig.tolist())
+    return array('I', (min((ai * x + bi) % _prime for x in hashes)
+                       for ai, bi in zip(a, b)))
+
+
+def jaccard(a, b):
+    '''
+    Returns the Jaccard similarity estimated from the MinHash signatures a
+    and b.
+    '''
+    if len(a) != len(b):
+        raise ValueError('signatures of different lengths')
+    return sum(1 for x, y in zip(a, b) if x == y) / len(a)
+
+
+class SimilarityIndex:
+    '''
+    SimilarityIndex finds the binaries that share code with a sample out of
+    a large corpus, without comparing the sample with every binary.
+
+    Every binary is added with the MinHash signature of its fingerprint,
+    which is split into bands of rows values. Binaries that agree on all
+    values of at least one band with the sample are the candidates of a
+    query, and are ranked by the similarity estimated from the whole
+    signatures. With the default 32 bands of 4 values, binaries sharing half
+    of their symbols with the sample are found with a probability above
+    0.87, and the ones sharing a fifth with a probability below 0.05.
+
+    The index is stored in an SQLite database, where the bands are looked
+    up through a B-tree, so queries take a few milliseconds for corpora of
+    millions of binaries. Binaries can be added at any time, and every add
+    is committed. An index opened again must use the num_perm, bands and
+    seed it was created with. The index can be used from many threads.
+
+    Attributes
+    ----------
+    path : str
+        the path to the database, or ':memory:' for an index that is not
+        persisted.
+    num_perm : int
+        the number of values in a signature.
+    bands : int
+        the number of bands a signature is split into, which must divide
+        num_perm.
+    seed : int
+        the seed of the MinHash permutations.
+    '''
+    def __init__(self, path=':memory:', num_perm=128, bands=32, seed=1):
+        if num_perm % bands:
+            raise ValueError('bands must divide num_perm')
+        self.path = path
+        self.num_perm = num_perm
+        self.bands = bands
+        self.seed = seed
+        self._rows = num_perm // bands
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        try:
+            self._init_db()
+        except BaseException:
+            self._db.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute('SELECT count(*) FROM files').fetchone()[0]
+
+    def __contains__(self, file_id):
+        with self._lock:
+            return self._db.execute('SELECT 1 FROM files WHERE id = ?',
+                                    (file_id,)).fetchone() is not None
+
+    def close(self):
+        '''
+        Closes the database. Closing twice does nothing.
+        '''
+        with self._lock:
+            self._db.close()
+
+    def signature(self, result):
+        '''
+        Returns the signature of an Analysis or GoFile for this index.
+        '''
+        return minhash(fingerprint(result), self.num_perm, self.seed)
+
+    def add(self, file_id, result):
+        '''
+        Adds the binary with the given id and the results in an Analysis or
+        GoFile, replacing a binary with the same id.
+        '''
+        self.add_signatures([(file_id, self.signature(result))])
+
+    def add_signatures(self, items):
+        '''
+        Adds the binaries of an iterable of (file_id, signature) pairs in
+        one transaction, which is much faster than adding them one by one.
+        '''
+        with self._lock, self._db:
+            db = self._db
+            for fid, sig in items:
+                if len(sig) != self.num_perm:
+                    raise ValueError('signature of {} values, expected {}'
+                                     .format(len(sig), self.num_perm))
+                row = db.execute('SELECT rowid FROM files WHERE id = ?',
+                                 (fid,)).fetchone()
+                if row is not None:
+                    db.execute('DELETE FROM bands WHERE file = ?', row)
+                    db.execute('DELETE FROM files WHERE rowid = ?', row)
+                rowid = db.execute(
+                    'INSERT INTO files (id, signature) VALUES (?, ?)',
+                    (fid, _pack(sig))).lastrowid
+                if not _is_empty(sig):
+                    db.executemany(
+                        'INSERT OR IGNORE INTO bands VALUES (?, ?, ?)',
+                        ((i, key, rowid) for i, key in
+                         enumerate(self._band_keys(sig))))
+
+    def remove(self, file_id):
+        '''
+        Removes the binary with the given id. Returns False if it is not in
+        the index.
+        '''
+        with self._lock, self._db:
+            row = self._db.execute('SELECT rowid FROM files WHERE id = ?',
+                                   (file_id,)).fetchone()
+            if row is None:
+                return False
+            self._db.execute('DELETE FROM bands WHERE file = ?', row)
+            self._db.execute('DELETE FROM files WHERE rowid = ?', row)
+            return True
+
+    def query(self, result, threshold=0.5, limit=None):
+        '''
+        Returns a list of (file_id, similarity) for the binaries sharing
+        code with a sample, most similar first, where the similarity is the
+        estimated Jaccard similarity of the fingerprints. Only binaries with
+        a similarity of at least threshold are returned, and at most limit
+        of them if it is not None.
+
+        Parameters
+        ----------
+        result : Analysis, GoFile or array
+            the results of the sample, or its signature.
+        '''
+        if isinstance(result, (Analysis, GoFile)):
+            sig = self.signature(result)
+        else:
+            sig = result
+        if len(sig) != self.num_perm:
+            raise ValueError('signature of {} values, expected {}'.format(
+                len(sig), self.num_perm))
+        if _is_empty(sig):
+            return []
+        with self._lock:
+            db = self._db
+            rowids = set()
+            for i, key in enumerate(self._band_keys(sig)):
+                rowids.update(r for r, in db.execute(
+                    'SELECT file FROM bands WHERE band = ? AND key = ?',
+                    (i, key)))
+            rows = []
+            rowids = list(rowids)
+            # SQLite limits the number of parameters of a statement.
+            for i in range(0, len(rowids), 500):
+                chunk = rowids[i:i + 500]
+                rows.extend(db.execute(
+                    'SELECT id, signature FROM files WHERE rowid IN ({})'
+                    .format(','.join('?' * len(chunk))), chunk))
+        matches = []
+        for fid, blob in rows:
+            s = jaccard(sig, _unpack(blob))
+            if s >= threshold:
+                matches.append((fid, s))
+        matches.sort(key=lambda m: (-m[1], m[0]))
+        return matches if limit is None else matches[:limit]
+
+    def _band_keys(self, sig):
+        r = self._rows
+        fmt = '<{}I'.format(r)
+        for i in range(self.bands):
+            d = hashlib.blake2b(struct.pack(fmt, *sig[i * r:(i + 1) * r]),
+                                digest_size=8).digest()
+            yield int.from_bytes(d, 'little', signed=True)
+
+    def _init_db(self):
+        db = self._db
+        with db:
+            db.execute('CREATE TABLE IF NOT EXISTS meta '
+                       '(key TEXT PRIMARY KEY, value TEXT)')
+            db.execute('CREATE TABLE IF NOT EXISTS files '
+                       '(rowid INTEGER PRIMARY KEY, id TEXT UNIQUE, '
+                       'signature BLOB)')
+            db.execute('CREATE TABLE IF NOT EXISTS bands '
+                       '(band INTEGER, key INTEGER, file INTEGER, '
+                       'PRIMARY KEY (band, key, file)) WITHOUT ROWID')
+            db.execute('CREATE INDEX IF NOT EXISTS bands_file '
+                       'ON bands (file)')
+            params = {'format': _format_version,
+                      'num_perm': str(self.num_perm),
+                      'bands': str(self.bands), 'seed': str(self.seed)}
+            stored = dict(db.execute('SELECT key, value FROM meta'))
+            if not stored:
+                db.executemany('INSERT INTO meta VALUES (?, ?)',
+                               params.items())
+            elif stored != params:
+                raise ValueError('{}: index created with {}'.format(
+                    self.path, ', '.join('{}={}'.format(k, v) for k, v in
+                                         sorted(stored.items()))))
+
+
+_permutation_cache = dict()
+
+
+def _permutations(num_perm, seed):
+    key = (num_perm, seed)
+    try:
+        return _permutation_cache[key]
+    except KeyError:
+        pass
+    rnd = random.Random(seed)
+    a = [rnd.randrange(1, _prime) for _ in range(num_perm)]
+    b = [rnd.randrange(0, _prime) for _ in range(num_perm)]
+    _permutation_cache[key] = a, b
+    return a, b
+
+
+def _hash32(s):
+    return int.from_bytes(hashlib.blake2b(s.encode('utf-8'),
+                                          digest_size=4).digest(), 'little')
+
+
+def _normalize(name):
+    name = _vendor_re.sub('', name)
+    name = _inst_re.sub('', name)
+    return _closure_re.sub(r'.\1', name)
+
+
+def _is_empty(sig):
+    return all(v == _empty for v in sig)
+
+
+def _pack(sig):
+    return struct.pack('<{}I'.format(len(sig)), *sig)
+
+
+def _unpack(blob):
+    return array('I', struct.unpack('<{}I'.format(len(blob) // 4), blob))
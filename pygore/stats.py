@@ -0,0 +1,101 @@
+# Copyright 2019 The GoRE.tk Authors. All rights reserved.
+# Use of this source code is governed by the license that
+# can be found in the LICENSE file.
+
+
+class ExtractionStats:
+    '''
+    ExtractionStats collects timings and counters for the extractions done
+    by a GoFile.
+
+    Phases are named after what they do: calls into libgore are prefixed
+    with 'ffi:' and conversions into Python objects with 'convert:', for
+    example 'ffi:types' and 'convert:types'. Counters are updated when a
+    phase finishes. Hooks are called with the phase name, the wall time in
+    seconds and a dict of the counters the phase added, so the data can be
+    forwarded to a metrics system as it is produced.
+
+    Attributes
+    ----------
+    timings : dict of str to float
+        the accumulated wall time in seconds for each phase.
+    calls : dict of str to int
+        the number of times each phase has run.
+    counters : dict of str to int
+        the accumulated counters, for example 'types_converted',
+        'type_cache_hits', 'struct_fields', 'type_methods', 'functions',
+        'methods' and 'strings_decoded'. 'types_converted' counts every
+        type converted, including the ones only referenced from other
+        types, and not only the types returned.
+    '''
+    def __init__(self, hook=None):
+        '''
+        Parameters
+        ----------
+        hook : callable
+            optional hook called as hook(phase, seconds, counters) after
+            every phase.
+        '''
+        self.timings = dict()
+        self.calls = dict()
+        self.counters = dict()
+        self._hooks = []
+        if hook is not None:
+            self._hooks.append(hook)
+
+    def add_hook(self, hook):
+        '''
+        Adds a hook that is called as hook(phase, seconds, counters) after
+        every phase.
+        '''
+        self._hooks.append(hook)
+
+    def remove_hook(self, hook):
+        '''
+        Removes a hook added with add_hook.
+        '''
+        self._hooks.remove(hook)
+
+    def record(self, phase, seconds, counters=None):
+        '''
+        Records that phase took seconds and added counters.
+        '''
+        self.timings[phase] = self.timings.get(phase, 0.0) + seconds
+        self.calls[phase] = self.calls.get(phase, 0) + 1
+        if counters is None:
+            counters = dict()
+        for name, n in counters.items():
+            self.counters[name] = self.counters.get(name, 0) + n
+        for hook in self._hooks:
+            hook(phase, seconds, counters)
+
+    def count(self, name, n=1):
+        '''
+        Adds n to the counter name outside of any phase.
+        '''
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    @property
+    def total_time(self):
+        '''
+        The total wall time in seconds of all phases.
+        '''
+        return sum(self.timings.values())
+
+    def reset(self):
+        '''
+        Clears all timings and counters.
+        '''
+        self.timings.clear()
+        self.calls.clear()
+        self.counters.clear()
+
+    def as_dict(self):
+        '''
+        Returns the timings, calls and counters as a dict of dicts.
+        '''
+        return {
+            'timings': dict(self.timings),
+            'calls': dict(self.calls),
+            'counters': dict(self.counters),
+        }
@@ -0,0 +1,395 @@
+# Copyright 2019 The GoRE.tk Authors. All rights reserved.
+# Use of this source code is governed by the license that
+# can be found in the LICENSE file.
+
+import mmap
+import struct
+
+# Executable headers. Go binaries are ELF, PE or Mach-O files.
+_magics = (b'\x7fELF', b'MZ', b'\xfe\xed\xfa\xce', b'\xce\xfa\xed\xfe',
+           b'\xfe\xed\xfa\xcf', b'\xcf\xfa\xed\xfe')
+
+# The magic of the different pclntab versions, searched for in files
+# without section headers that have no build id or build info.
+_pclntab_magics = (b'\xfb\xff\xff\xff\x00\x00', b'\xfa\xff\xff\xff\x00\x00',
+                   b'\xf0\xff\xff\xff\x00\x00', b'\xf1\xff\xff\xff\x00\x00')
+
+_buildinfo_magic = b'\xff Go buildinf:'
+_buildid_marker = b'\xff Go build ID: "'
+
+# Sections only Go binaries have, which tell Go binaries apart without
+# searching the file when the section headers are present.
+_go_sections = frozenset((
+    '.gopclntab', '.data.rel.ro.gopclntab', '.gosymtab',
+    '.data.rel.ro.gosymtab', '.go.buildinfo', '.note.go.buildid',
+    '__gopclntab', '__gosymtab', '__go_buildinfo'))
+
+_PT_LOAD = 1
+_PF_X = 1
+_PF_W = 2
+_SHT_NOBITS = 8
+_NT_GO_BUILD_ID = 4
+
+
+class Triage:
+    '''
+    Triage is what triage found out about a file from its headers and the
+    markers of Go binaries, without an analysis.
+
+    Attributes
+    ----------
+    path : str
+        path to the file.
+    format : str
+        'elf', 'pe' or 'macho', or None if the file is not an executable.
+    is_go : bool
+        True if the file is an executable with a marker of Go binaries.
+    build_id : str
+        the Go build id, or None if it was not found.
+    go_version : str
+        the version of Go the binary was built with, for example
+        'go1.21.6', or None. It is read from the build info, which binaries
+        built before Go 1.13 do not have.
+    module : str
+        the path of the main module from the build info, or None.
+    '''
+    __slots__ = ('path', 'format', 'is_go', 'build_id', 'go_version',
+                 'module')
+
+    def __init__(self, path, format=None, is_go=False, build_id=None,
+                 go_version=None, module=None):
+        self.path = path
+        self.format = format
+        self.is_go = is_go
+        self.build_id = build_id
+        self.go_version = go_version
+        self.module = module
+
+
+def triage(path):
+    '''
+    Returns a Triage for the file at path.
+
+    The file is memory-mapped and only the headers and the pages holding the
+    build id and the build info are read, so a Go binary takes microseconds.
+    A file that is not an executable is rejected after reading four bytes,
+    and an ELF or Mach-O file by its section names. Only PE files and files
+    without section headers are searched for the markers of Go binaries.
+    The build id and Go version are the ones GoFile extracts, so a GoFile
+    only needs to be opened for the files that pass. Files that can not be
+    read are reported as not being executables.
+    '''
+    t = Triage(path)
+    try:
+        with open(path, 'rb') as f:
+            t.format = _format(f.read(4))
+            if t.format is None:
+                return t
+            m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return t
+    with m:
+        try:
+            exe = _formats[t.format](m)
+        except (ValueError, IndexError, struct.error):
+            exe = None
+        if isinstance(exe, (_ELF, _MachO)) and exe.sections and \
+                _go_sections.isdisjoint(exe.sections):
+            return t
+        try:
+            version, mod = _read_build_info(m, exe)
+            build_id = _build_id(m, exe)
+        except (ValueError, IndexError, struct.error):
+            version, mod, build_id = '', '', ''
+        t.go_version = version or None
+        t.module = _main_module(mod)
+        t.build_id = build_id or None
+        t.is_go = bool(version or build_id) or any(
+            m.find(magic) >= 0 for magic in _pclntab_magics)
+    return t
+
+
+def is_go_binary(path):
+    '''
+    Returns True if triage finds the file at path to be a Go binary.
+    '''
+    return triage(path).is_go
+
+
+def _format(head):
+    if head == b'\x7fELF':
+        return 'elf'
+    if head.startswith(b'MZ'):
+        return 'pe'
+    if head in _magics:
+        return 'macho'
+    return None
+
+
+def _main_module(mod):
+    for line in mod.split('\n'):
+        fields = line.split('\t')
+        if len(fields) >= 2 and fields[0] == 'mod':
+            return fields[1]
+    return None
+
+
+def _build_id(m, exe):
+    # Returns the Go build id from the ELF note, or from the string the
+    # linker puts at the start of the text of other formats.
+    if isinstance(exe, _ELF):
+        note = exe.sections.get('.note.go.buildid')
+        if note is not None and note.offset is not None:
+            namesz, descsz, typ = struct.unpack_from(exe.order + 'III', m,
+                                                     note.offset)
+            name = note.offset + 12
+            desc = name + (namesz + 3 & ~3)
+            if typ == _NT_GO_BUILD_ID and m[name:name + 2] == b'Go':
+                return m[desc:desc + descsz].decode('utf-8', 'replace')
+    i = m.find(_buildid_marker)
+    if i < 0:
+        return ''
+    i += len(_buildid_marker)
+    j = m.find(b'"', i, i + 1024)
+    return m[i:j].decode('utf-8', 'replace') if j >= 0 else ''
+
+
+def _read_build_info(m, exe):
+    # Returns the version and module strings of the build info, which is
+    # searched for in the first 64 KiB of the data like debug/buildinfo.
+    # Without usable headers the whole file is searched.
+    start = exe.data_start() if exe is not None else None
+    if start is None:
+        start, end = 0, len(m)
+    else:
+        end = min(start + 65536, len(m))
+    i = m.find(_buildinfo_magic, start, end)
+    while i >= 0 and (i - start) % 16:
+        i = m.find(_buildinfo_magic, i + 1, end)
+    if i < 0 or end - i < 32:
+        return '', ''
+
+    ptrsize, flags = m[i + 14], m[i + 15]
+    if flags & 2:
+        version, p = _uvarint_string(m, i + 32)
+        mod, _ = _uvarint_string(m, p)
+    else:
+        if ptrsize not in (4, 8) or exe is None:
+            return '', ''
+        ptr = ('>' if flags else '<') + ('Q' if ptrsize == 8 else 'I')
+        version = _go_string(m, exe, ptr, struct.unpack_from(
+            ptr, m, i + 16)[0])
+        mod = _go_string(m, exe, ptr, struct.unpack_from(
+            ptr, m, i + 16 + ptrsize)[0])
+    version = version.decode('utf-8', 'replace')
+    mod = mod.decode('utf-8', 'replace')
+    if len(mod) >= 33 and mod[-17] == '\n':
+        # Strip the sentinels around the module information.
+        mod = mod[16:-16]
+    else:
+        mod = ''
+    return version, mod
+
+
+def _uvarint_string(m, p):
+    n, p = _uvarint(m, p)
+    return m[p:p + n], p + n
+
+
+def _go_string(m, exe, ptr, addr):
+    off = exe.offset(addr)
+    if off is None:
+        return b''
+    data, n = struct.unpack_from(ptr + ptr[1], m, off)
+    off = exe.offset(data)
+    if off is None:
+        return b''
+    return m[off:off + n]
+
+
+def _uvarint(m, p):
+    v = shift = 0
+    while True:
+        b = m[p]
+        p += 1
+        v |= (b & 0x7f) << shift
+        if b < 0x80:
+            return v, p
+        shift += 7
+
+
+class _Section:
+    __slots__ = ('addr', 'offset', 'size')
+
+    def __init__(self, addr, offset, size):
+        self.addr = addr
+        self.offset = offset
+        self.size = size
+
+
+class _ELF:
+    # The section and program headers of an ELF file.
+
+    def __init__(self, m):
+        if m[:4] != b'\x7fELF':
+            raise ValueError('not an ELF file')
+        elfclass, data = m[4], m[5]
+        if elfclass not in (1, 2) or data not in (1, 2):
+            raise ValueError('unsupported ELF class or data encoding')
+        o = self.order = '<' if data == 1 else '>'
+        self.ptrsize = 4 * elfclass
+        if elfclass == 2:
+            phoff, shoff = struct.unpack_from(o + 'QQ', m, 32)
+            phentsize, phnum, shentsize, shnum, shstrndx = \
+                struct.unpack_from(o + 'HHHHH', m, 54)
+            ph, sh = o + 'IIQQQQ', o + 'IIQQQQ'
+        else:
+            phoff, shoff = struct.unpack_from(o + 'II', m, 28)
+            phentsize, phnum, shentsize, shnum, shstrndx = \
+                struct.unpack_from(o + 'HHHHH', m, 42)
+            ph, sh = o + 'IIIIIII', o + 'IIIIII'
+
+        self.segments = []
+        for i in range(phnum):
+            h = struct.unpack_from(ph, m, phoff + i * phentsize)
+            if elfclass == 2:
+                typ, flags, off, vaddr, _, filesz = h
+            else:
+                typ, off, vaddr, _, filesz, _, flags = h
+            if typ == _PT_LOAD:
+                self.segments.append((vaddr, off, filesz, flags))
+
+        self.sections = dict()
+        headers = [struct.unpack_from(sh, m, shoff + i * shentsize)
+                   for i in range(shnum)]
+        if shstrndx < len(headers):
+            strtab = headers[shstrndx][4]
+            for name, typ, _, addr, off, size in headers:
+                name += strtab
+                name = m[name:m.find(b'\x00', name)].decode(
+                    'ascii', 'replace')
+                self.sections[name] = _Section(
+                    addr, None if typ == _SHT_NOBITS else off, size)
+
+    def offset(self, addr):
+        '''
+        Returns the file offset of the virtual address addr, or None if it
+        is not backed by the file.
+        '''
+        for vaddr, off, filesz, _ in self.segments:
+            if vaddr <= addr < vaddr + filesz:
+                return off + addr - vaddr
+        return None
+
+    def address(self, offset):
+        '''
+        Returns the virtual address the file offset is loaded at, or None.
+        '''
+        for vaddr, off, filesz, _ in self.segments:
+            if off <= offset < off + filesz:
+                return vaddr + offset - off
+        return None
+
+    def data_start(self):
+        '''
+        Returns the file offset of the build info section, or of the first
+        writable data segment, or None.
+        '''
+        sec = self.sections.get('.go.buildinfo')
+        if sec is not None and sec.offset is not None:
+            return sec.offset
+        return next((off for _, off, _, flags in self.segments
+                     if flags & (_PF_X | _PF_W) == _PF_W), None)
+
+
+class _PE:
+    # The section table of a PE file.
+
+    def __init__(self, m):
+        pe = struct.unpack_from('<I', m, 0x3c)[0]
+        if m[pe:pe + 4] != b'PE\x00\x00':
+            raise ValueError('not a PE file')
+        nsections, optsize = struct.unpack_from('<2xH12xH', m, pe + 4)
+        opt = pe + 24
+        magic = struct.unpack_from('<H', m, opt)[0]
+        if magic == 0x20b:
+            self.ptrsize = 8
+            self.image_base = struct.unpack_from('<Q', m, opt + 24)[0]
+        else:
+            self.ptrsize = 4
+            self.image_base = struct.unpack_from('<I', m, opt + 28)[0]
+        self.order = '<'
+        # (virtual address, file offset, size in the file, characteristics)
+        self.sections = []
+        for i in range(nsections):
+            va, size, off, flags = struct.unpack_from(
+                '<12xIII12xI', m, opt + optsize + i * 40)
+            self.sections.append((va, off, size, flags))
+
+    def offset(self, addr):
+        rva = addr - self.image_base
+        for va, off, size, _ in self.sections:
+            if va <= rva < va + size:
+                return off + rva - va
+        return None
+
+    def data_start(self):
+        # The first initialized, readable and writable data section.
+        want = 0x40 | 0x40000000 | 0x80000000
+        return next((off for va, off, size, flags in self.sections
+                     if va and size and flags & want == want), None)
+
+
+class _MachO:
+    # The segments and sections of a Mach-O file.
+
+    def __init__(self, m):
+        magic = m[:4]
+        if magic in (b'\xfe\xed\xfa\xce', b'\xfe\xed\xfa\xcf'):
+            self.order = '>'
+        elif magic in (b'\xce\xfa\xed\xfe', b'\xcf\xfa\xed\xfe'):
+            self.order = '<'
+        else:
+            raise ValueError('not a Mach-O file')
+        o = self.order
+        self.ptrsize = 8 if magic[0] == 0xcf or magic[3] == 0xcf else 4
+        ncmds = struct.unpack_from(o + 'I', m, 16)[0]
+        if self.ptrsize == 8:
+            p, lc_segment = 32, 0x19
+            seg, sect, sectsize = o + 'II16sQQQQii', o + '16s16sQQI', 80
+        else:
+            p, lc_segment = 28, 0x1
+            seg, sect, sectsize = o + 'II16sIIIIii', o + '16s16sIII', 68
+        segsize = struct.calcsize(seg) + 8
+        # (address, file offset, size in the file, protection)
+        self.segments = []
+        self.sections = dict()
+        for _ in range(ncmds):
+            cmd, cmdsize = struct.unpack_from(o + 'II', m, p)
+            if cmd == lc_segment:
+                _, _, _, addr, _, off, filesz, maxprot, prot = \
+                    struct.unpack_from(seg, m, p)
+                nsects = struct.unpack_from(o + 'I', m, p + segsize - 8)[0]
+                self.segments.append((addr, off, filesz, maxprot, prot))
+                for i in range(nsects):
+                    name, _, addr, size, off = struct.unpack_from(
+                        sect, m, p + segsize + i * sectsize)
+                    name = name.rstrip(b'\x00').decode('ascii', 'replace')
+                    self.sections[name] = _Section(addr, off, size)
+            p += cmdsize
+
+    def offset(self, addr):
+        for vaddr, off, filesz, _, _ in self.segments:
+            if vaddr <= addr < vaddr + filesz:
+                return off + addr - vaddr
+        return None
+
+    def data_start(self):
+        sec = self.sections.get('__go_buildinfo')
+        if sec is not None:
+            return sec.offset
+        return next((off for _, off, filesz, maxprot, prot in self.segments
+                     if off and filesz and maxprot == prot == 3), None)
+
+
+_formats = {'elf': _ELF, 'pe': _PE, 'macho': _MachO}
@@ -22,4 +22,7 @@ setuptools.setup(
     ],
     package_data={'': ['libgore.so', 'libgore.dll', 'libgore.dylib']},
     include_package_data=True,
+    entry_points={
+        'console_scripts': ['pygore=pygore.cli:main'],
+    },
 )
@@ -1,13 +1,38 @@
 import unittest
+import asyncio
+import gc
+import json
 import os
+import pickle
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 import pygore
+import pygore.cli
+from pygore.lib import _walk_types
 
 golden_file = os.path.dirname(__file__) + '/' + 'resources/golden'
 gold_build_id = ('W11rzA8dxCieF64mk9rO/wmqBULPx6tMOdPbSBabM/X40xrZ4nVRHkrWOKb'
                  'wZw/JpQDPeWBsrG9Rn_jzf3s')
 
 
+def deep_types(n):
+    # A chain of n pointer types that is deeper than the recursion limit,
+    # with a struct field and a method on the first type.
+    types = [pygore.Type(kind=pygore.Kind.Ptr, name='*t%d' % i, addr=i)
+             for i in range(n)]
+    for t, element in zip(types, types[1:]):
+        t.element = element
+    types[-1].funcArgs = [types[0]]
+    types[0].fields = [pygore.Type(kind=pygore.Kind.Int, name='int',
+                                   addr=n - 1, fieldName='x')]
+    types[0].methods = [pygore.Method_Type('M', types[-1], 1, 2)]
+    return types
+
+
 class TestPyGore(unittest.TestCase):
     def setUp(self):
         self.file = pygore.GoFile(golden_file)
@@ -29,6 +54,18 @@ class TestPyGore(unittest.TestCase):
         self.assertEqual(m.name, 'String', msg='Wrong method name')
         self.assertEqual(m.receiver, '(*simpleStruct)', msg='Wrong receiver')
 
+    def test_iter_packages(self):
+        pkgs = list(self.file.iter_packages())
+        self.assertEqual(len(pkgs), 1, msg='Wrong number of packages')
+        self.assertEqual(pkgs[0].filepath, '/build', msg='Wrong path')
+        funcs = list(self.file.iter_functions())
+        self.assertEqual(len(funcs), 3, msg='Should have 3 funcs and meths')
+        self.assertEqual(funcs[-1].receiver, '(*simpleStruct)')
+
+    def test_iter_types(self):
+        names = [t.name for t in self.file.get_types()]
+        self.assertEqual([t.name for t in self.file.iter_types()], names)
+
     def test_types(self):
         typs = self.file.get_types()
         ss = None
@@ -44,10 +81,732 @@ class TestPyGore(unittest.TestCase):
         self.assertIsNotNone(ss, msg='Types should include simpleStruct')
         self.assertIsNotNone(cs, msg='Types should include myComplexStruct')
 
+    def test_field_anon(self):
+        for t in self.file.get_types():
+            if t.name != 'main.myComplexStruct':
+                continue
+            for f in t.fields:
+                self.assertIn(f.fieldAnon, (True, False))
+                self.assertEqual(f.fieldAnon, f.typeAnon)
+
+    def test_lazy_types(self):
+        typs = self.file.get_types()
+        lazy = self.file.get_types(lazy=True)
+        self.assertEqual(len(typs), len(lazy))
+        for t, lt in zip(typs, lazy):
+            self.assertEqual(t.addr, lt.addr)
+            self.assertEqual(t.name, lt.name)
+            self.assertEqual(t.kind, lt.kind)
+            if t.element is not None:
+                self.assertEqual(t.element.addr, lt.element.addr)
+        by_addr = {t.addr: t for t in lazy}
+        for t in lazy:
+            if t.element is not None and t.element.addr in by_addr:
+                self.assertIs(t.element, by_addr[t.element.addr])
+
+    def test_lazy_types_after_close(self):
+        lazy = self.file.get_types(lazy=True)
+        name = lazy[0].name
+        self.file.close()
+        # Decoded attributes stay usable.
+        self.assertEqual(lazy[0].name, name)
+        with self.assertRaises(ValueError):
+            lazy[0].kind
+
+    def test_get_all(self):
+        a = self.file.get_all()
+        self.assertEqual(a.compiler_version.name, 'go1.12')
+        self.assertEqual(a.build_id, gold_build_id)
+        self.assertEqual(len(a.packages[pygore.PackageClass.Main]), 1)
+        self.assertEqual(len(a.all_packages()),
+                         sum(len(v) for v in a.packages.values()))
+        self.assertIs(a.types[0], self.file.get_types()[0])
+
+    def test_memoized(self):
+        a = self.file.get_types()
+        b = self.file.get_types()
+        self.assertIsNot(a, b)
+        for x, y in zip(a, b):
+            self.assertIs(x, y)
+        self.assertIn('types', self.file.memoized)
+        self.file.clear_memo()
+        self.assertEqual(self.file.memoized, frozenset())
+        self.assertIsNot(self.file.get_types()[0], a[0])
+
+    def test_resolve_methods(self):
+        self.file.resolve_methods()
+        resolved = [m for t in self.file.get_types() for m in t.methods or ()
+                    if m.function is not None]
+        self.assertGreater(len(resolved), 0)
+        for m in resolved:
+            self.assertTrue(m.function.name.endswith(m.name),
+                            msg='{} resolved to {}'.format(m.name,
+                                                           m.function.name))
+
     def test_build_id(self):
         build_id = self.file.get_build_id()
         self.assertEqual(gold_build_id, build_id)
 
+
+class TestStringTable(unittest.TestCase):
+    def test_shared_strings(self):
+        table = pygore.StringTable()
+        pkgs = []
+        for _ in range(2):
+            f = pygore.GoFile(golden_file, strings=table)
+            pkgs.append(f.get_std_lib_packages())
+            f.close()
+        self.assertGreater(len(table), 0)
+        for a, b in zip(*pkgs):
+            self.assertIs(a.name, b.name)
+            self.assertIs(a.filepath, b.filepath)
+
+    def test_decode(self):
+        table = pygore.StringTable()
+        s = table.decode(b'runtime')
+        self.assertEqual(s, 'runtime')
+        self.assertIs(table.decode(b'runtime'), s)
+        self.assertEqual(table.decode(None), '')
+
+
+class TestAddressIndex(unittest.TestCase):
+    def setUp(self):
+        self.file = pygore.GoFile(golden_file)
+
+    def tearDown(self):
+        self.file.close()
+
+    def test_lookup(self):
+        pkgs = self.file.get_packages()
+        idx = pygore.AddressIndex(pkgs)
+        c_idx = pygore.AddressIndex.from_file(self.file,
+                                              [pygore.PackageClass.Main])
+        self.assertEqual(len(idx), 3)
+        self.assertEqual(len(c_idx), 3)
+        for f in pkgs[0].functions + pkgs[0].methods:
+            for i in (idx, c_idx):
+                self.assertEqual(i.lookup(f.offset).name, f.name)
+                self.assertEqual(i.lookup(f.end - 1).name, f.name)
+        self.assertIsNone(idx.lookup(0))
+        m = pkgs[0].methods[0]
+        found = c_idx.lookup_many([0, m.offset])
+        self.assertIsNone(found[0])
+        self.assertEqual(found[1].receiver, m.receiver)
+
+    def test_lookup_after_close(self):
+        f = self.file.get_packages()[0].functions[0]
+        idx = pygore.AddressIndex.from_file(self.file)
+        self.file.close()
+        # The positions are held by the index and can still be found.
+        self.assertGreaterEqual(idx.find(f.offset), 0)
+        with self.assertRaises(ValueError):
+            idx.lookup(f.offset)
+
+
+class TestTypeIndex(unittest.TestCase):
+    def test_type_index(self):
+        with pygore.GoFile(golden_file) as f:
+            typs = f.get_types()
+        idx = pygore.TypeIndex(typs)
+        self.assertGreaterEqual(len(idx), len(typs))
+        for t in typs:
+            self.assertIs(idx.get(t.addr), t)
+            self.assertIn(t, idx.by_name(t.name))
+            self.assertIn(t, idx.by_kind(t.kind))
+            self.assertIn(t, idx.by_package(t.packagePath))
+        for t in idx:
+            if t.element is not None:
+                refs = idx.referrers(t.element, 'element')
+                self.assertIn(t, [r.type for r in refs])
+            for i, f in enumerate(t.fields or ()):
+                self.assertIn(pygore.TypeRef(t, 'field', i),
+                              idx.referrers(f.addr))
+
+
+class TestScan(unittest.TestCase):
+    def test_scan(self):
+        results = list(pygore.scan([golden_file, golden_file], workers=2))
+        self.assertEqual(len(results), 2)
+        for r in results:
+            self.assertTrue(r.ok, msg=r.error)
+            self.assertEqual(r.path, golden_file)
+            self.assertEqual(r.build_id, gold_build_id)
+            self.assertEqual(r.compiler_version.name, 'go1.12')
+            pkgs = r.packages[pygore.PackageClass.Main]
+            self.assertEqual(len(pkgs), 1, msg='Wrong number of packages')
+            self.assertIsNotNone(r.types)
+
+    def test_scan_without_types(self):
+        r = next(pygore.scan([golden_file], workers=1, types=False))
+        self.assertTrue(r.ok, msg=r.error)
+        self.assertIsNone(r.types)
+
+    def test_deep_type_graph(self):
+        n = sys.getrecursionlimit() * 2
+        r = pygore.ScanResult(golden_file)
+        r.types = deep_types(n)[:1]
+        r = pickle.loads(pickle.dumps(r, pickle.HIGHEST_PROTOCOL))
+        types = list(_walk_types(r.types))
+        self.assertEqual(len(types), n)
+        self.assertEqual([t.addr for t in types], list(range(n)))
+        self.assertIs(types[-1].funcArgs[0], r.types[0])
+        self.assertIs(types[0].methods[0].type, types[-1])
+        self.assertEqual(types[0].fields[0].fieldName, 'x')
+        self.assertIsNot(types[0].fields[0], types[-1])
+
+
+class TestTriage(unittest.TestCase):
+    def test_go_binary(self):
+        t = pygore.triage(golden_file)
+        self.assertEqual(t.path, golden_file)
+        self.assertEqual(t.format, 'elf')
+        self.assertTrue(t.is_go)
+        self.assertEqual(t.build_id, gold_build_id)
+        # go1.12 binaries have no build info.
+        self.assertIsNone(t.go_version)
+        self.assertTrue(pygore.cli.is_go_binary(golden_file))
+
+    def test_not_go_binary(self):
+        for path in (__file__, os.path.dirname(__file__), '/nonexistent'):
+            t = pygore.triage(path)
+            self.assertIsNone(t.format)
+            self.assertFalse(t.is_go)
+            self.assertIsNone(t.build_id)
+        # An executable that is not written in Go.
+        for path in (__file__, sys.executable):
+            self.assertFalse(pygore.cli.is_go_binary(path))
+
+
+class TestNativeBackend(unittest.TestCase):
+    def setUp(self):
+        self.file = pygore.GoFile(golden_file, backend='native')
+
+    def tearDown(self):
+        self.file.close()
+
+    def test_compiler_and_build_id(self):
+        self.assertEqual(self.file.backend, 'native')
+        self.assertEqual(self.file.get_compiler_version().name, 'go1.12')
+        self.assertEqual(self.file.get_build_id(), gold_build_id)
+        self.assertIsNone(self.file._handle, msg='libgore was opened')
+
+    def test_package(self):
+        pkgs = self.file.get_packages()
+        self.assertEqual(len(pkgs), 1, msg='Wrong number of packages')
+        self.assertEqual(pkgs[0].filepath, '/build', msg='Wrong path')
+        self.assertEqual(len(pkgs[0].functions), 2, msg='Should have 2 funcs')
+        self.assertEqual(len(pkgs[0].methods), 1, msg='Should have 1 meth')
+        m = pkgs[0].methods[0]
+        self.assertEqual(m.name, 'String', msg='Wrong method name')
+        self.assertEqual(m.receiver, '(*simpleStruct)', msg='Wrong receiver')
+
+    def test_same_functions(self):
+        def functions(f):
+            return {(fn.package_name, getattr(fn, 'receiver', None),
+                     fn.name, fn.offset, fn.end)
+                    for cls in pygore.PackageClass
+                    for fn in f.iter_functions(cls)}
+
+        with pygore.GoFile(golden_file) as f:
+            expected = functions(f)
+        self.assertLessEqual(expected, functions(self.file))
+
+    def test_types(self):
+        types = self.file.get_types()
+        self.assertIn('main.simpleStruct', [t.name for t in types])
+        self.file.resolve_methods()
+
+    def test_auto(self):
+        with pygore.GoFile(golden_file, backend='auto') as f:
+            self.assertEqual(f.backend, 'native')
+        with self.assertRaises(ValueError):
+            pygore.GoFile(__file__, backend='native')
+        with self.assertRaises(ValueError):
+            pygore.GoFile(golden_file, backend='unknown')
+
+    def test_incomplete_backend(self):
+        class Incomplete(pygore.Backend):
+            name = 'incomplete'
+
+            def build_id(self):
+                return ''
+
+        with self.assertRaises(TypeError):
+            pygore.register_backend(Incomplete)
+        with self.assertRaises(TypeError):
+            pygore.GoFile(golden_file, backend=Incomplete)
+        self.assertNotIn('incomplete', pygore.backend.backends)
+
+
+class TestHandles(unittest.TestCase):
+    def test_shared_path(self):
+        a = pygore.GoFile(golden_file)
+        b = pygore.GoFile(golden_file)
+        path = a.path
+        self.assertEqual(pygore.handles.registry.refs(path), 2)
+        a.close()
+        self.assertEqual(len(b.get_packages()), 1)
+        self.assertEqual(b.get_build_id(), gold_build_id)
+        b.close()
+        self.assertEqual(pygore.handles.registry.refs(path), 0)
+
+    def test_threads(self):
+        def analyze(_):
+            f = pygore.GoFile(golden_file)
+            try:
+                return len(f.get_all().types)
+            finally:
+                f.close()
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            counts = set(executor.map(analyze, range(8)))
+        self.assertEqual(len(counts), 1)
+
+
+class TestLifecycle(unittest.TestCase):
+    def test_context_manager(self):
+        with pygore.GoFile(golden_file) as f:
+            path = f.path
+            self.assertEqual(f.native_bytes, 0)
+            typs = f.get_types()
+            f.get_packages()
+            self.assertGreater(f.native_bytes, 0)
+            self.assertEqual(pygore.native_memory(), f.native_bytes)
+        self.assertTrue(f.closed)
+        self.assertEqual(f.native_bytes, 0)
+        self.assertEqual(pygore.handles.registry.refs(path), 0)
+        self.assertEqual(pygore.native_memory(), 0)
+        self.assertGreater(len(typs), 0)
+        f.close()
+
+    def test_after_close(self):
+        f = pygore.GoFile(golden_file)
+        pkgs = f.get_packages()
+        it = f.iter_types()
+        next(it)
+        f.close()
+        # Memoized results stay usable.
+        self.assertEqual(len(f.get_packages()), len(pkgs))
+        with self.assertRaises(ValueError):
+            next(it)
+        std = pygore.PackageClass.Std
+        for call in (f.get_all, f.get_types, f.get_build_id,
+                     f.get_std_lib_packages, f.iter_types,
+                     lambda: f.iter_packages(std),
+                     lambda: f.iter_functions(std)):
+            with self.assertRaises(ValueError):
+                list(call())
+
+    def test_finalizer(self):
+        f = pygore.GoFile(golden_file)
+        path = f.path
+        del f
+        gc.collect()
+        self.assertEqual(pygore.handles.registry.refs(path), 0)
+
+    def test_dropped_file(self):
+        f = pygore.GoFile(golden_file)
+        path = f.path
+        names = [t.name for t in f.get_types()]
+        addrs = [fn.offset for p in f.get_packages() for fn in p.functions]
+        typs = f.get_types(lazy=True)
+        idx = pygore.AddressIndex.from_file(f, [pygore.PackageClass.Main])
+        del f
+        gc.collect()
+        # The lazy types and the index keep the file open.
+        self.assertEqual(pygore.handles.registry.refs(path), 1)
+        self.assertEqual([t.name for t in typs], names)
+        self.assertEqual([idx.lookup(a).offset for a in addrs], addrs)
+        del typs, idx
+        gc.collect()
+        self.assertEqual(pygore.handles.registry.refs(path), 0)
+
+
+class TestSandbox(unittest.TestCase):
+    def setUp(self):
+        self.pool = pygore.SandboxPool(workers=1, timeout=60, max_files=2)
+
+    def tearDown(self):
+        self.pool.close()
+
+    def test_sandboxed_file(self):
+        for _ in range(3):
+            with pygore.SandboxedGoFile(golden_file, self.pool) as f:
+                self.assertEqual(f.get_build_id(), gold_build_id)
+                self.assertEqual(f.get_compiler_version().name, 'go1.12')
+                pkgs = f.get_packages()
+                self.assertEqual(len(pkgs), 1, msg='Wrong number of packages')
+                self.assertGreater(len(f.get_types()), 0)
+
+    def test_analysis_error(self):
+        f = pygore.SandboxedGoFile(golden_file, self.pool)
+        with self.assertRaises(pygore.AnalysisError):
+            f.set_compiler_version(None)
+        self.assertEqual(f.get_build_id(), gold_build_id)
+        f.close()
+
+    def test_shared_worker(self):
+        # The second file waits for the only worker longer than its timeout,
+        # which must not count against it.
+        first = pygore.SandboxedGoFile(golden_file, self.pool)
+        first.get_build_id()
+        second = pygore.SandboxedGoFile(golden_file, self.pool, timeout=1)
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            fut = executor.submit(second.get_build_id)
+            time.sleep(1.5)
+            first.close()
+            self.assertEqual(fut.result(), gold_build_id)
+        self.assertLess(second.elapsed, 1)
+        second.close()
+
+
+class TestAsyncGoFile(unittest.IsolatedAsyncioTestCase):
+    async def test_async_file(self):
+        executor = pygore.AsyncExecutor(max_workers=2, max_files=2)
+        async with await pygore.AsyncGoFile.open(golden_file,
+                                                 executor) as f:
+            cv, build_id, pkgs = await asyncio.gather(
+                f.get_compiler_version(), f.get_build_id(),
+                f.get_packages())
+        executor.close()
+        self.assertEqual(cv.name, 'go1.12', msg='Wrong version')
+        self.assertEqual(build_id, gold_build_id)
+        self.assertEqual(len(pkgs), 1, msg='Wrong number of packages')
+
+
+class TestAsyncExecutor(unittest.TestCase):
+    def test_event_loops(self):
+        executor = pygore.AsyncExecutor(max_workers=1, max_files=1)
+
+        async def versions():
+            async def version():
+                async with await pygore.AsyncGoFile.open(golden_file,
+                                                         executor) as f:
+                    return await f.get_compiler_version()
+            return await asyncio.gather(*(version() for _ in range(3)))
+
+        # Both loops wait on the semaphores, which must not be bound to the
+        # first loop.
+        for _ in range(2):
+            cvs = asyncio.run(versions())
+            self.assertEqual([cv.name for cv in cvs], ['go1.12'] * 3)
+        executor.close()
+
+
+class TestResultCache(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.cache = pygore.ResultCache(self.dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_cache_hit(self):
+        f = pygore.GoFile(golden_file, cache=self.cache)
+        pkgs = f.get_packages()
+        typs = f.get_types()
+        f.close()
+        self.assertGreater(self.cache.size, 0)
+
+        # A hit is served from the cache without opening libgore.
+        opened = []
+        c_open = pygore.internal._c_open
+        pygore.internal._c_open = lambda path: opened.append(path) or \
+            c_open(path)
+        try:
+            f = pygore.GoFile(golden_file, cache=self.cache)
+            key = self.cache.key(f.path)
+            cached = self.cache.get(key, 'packages-main')
+            self.assertEqual([p.name for p in cached],
+                             [p.name for p in pkgs])
+            self.assertEqual([p.name for p in f.get_packages()],
+                             [p.name for p in pkgs])
+            self.assertEqual(len(f.get_types()), len(typs))
+            f.close()
+        finally:
+            pygore.internal._c_open = c_open
+        self.assertEqual(opened, [])
+
+    def test_deep_type_graph(self):
+        n = sys.getrecursionlimit() * 2
+        key = '{:064x}'.format(0)
+        self.assertTrue(self.cache.put(key, 'types', deep_types(n)[:1]))
+        types = list(_walk_types(self.cache.get(key, 'types')))
+        self.assertEqual([t.addr for t in types], list(range(n)))
+        self.assertIs(types[0].methods[0].type, types[-1])
+
+    def test_unserializable(self):
+        with self.assertWarns(RuntimeWarning):
+            self.assertFalse(self.cache.put('{:064x}'.format(0), 'data',
+                                            (i for i in ())))
+
+    def test_orphaned_tmp(self):
+        d = os.path.join(self.dir, 'ab')
+        os.makedirs(d)
+        old = os.path.join(d, 'old.tmp')
+        new = os.path.join(d, 'new.tmp')
+        for path in (old, new):
+            with open(path, 'wb') as fp:
+                fp.write(b'x')
+        os.utime(old, (0, 0))
+        self.cache.put('{:064x}'.format(0), 'data', b'x')
+        self.assertFalse(os.path.exists(old))
+        self.assertTrue(os.path.exists(new))
+
+    def test_compiler_version_in_key(self):
+        k1 = self.cache.key(golden_file)
+        k2 = self.cache.key(golden_file, 'go1.13')
+        self.assertNotEqual(k1, k2)
+
+    def test_eviction(self):
+        self.cache.max_size = 1024
+        for i in range(4):
+            self.cache.put('{:064x}'.format(i), 'data', b'x' * 512)
+        self.assertLessEqual(self.cache.size, 1024)
+        self.assertIsNone(self.cache.get('{:064x}'.format(0), 'data'))
+
+
+class TestExtractionStats(unittest.TestCase):
+    def test_stats(self):
+        phases = []
+        stats = pygore.ExtractionStats(
+            hook=lambda phase, seconds, counters: phases.append(phase))
+        f = pygore.GoFile(golden_file, stats=stats)
+        typs = f.get_types()
+        pkgs = f.get_packages()
+        f.get_types()
+        f.close()
+        self.assertIn('ffi:open', stats.timings)
+        self.assertIn('ffi:types', stats.timings)
+        self.assertIn('convert:types', stats.timings)
+        self.assertIn('ffi:close', stats.timings)
+        self.assertEqual(stats.calls['convert:types'], 1)
+        self.assertEqual(stats.counters['types_converted'],
+                         len(list(_walk_types(typs))))
+        self.assertEqual(stats.counters['functions'],
+                         sum(len(p.functions) for p in pkgs))
+        self.assertEqual(stats.counters['memo_hits'], 1)
+        self.assertEqual(phases, list(stats.calls))
+
+    def test_strings_decoded(self):
+        table = pygore.StringTable()
+        with pygore.GoFile(golden_file, strings=table) as f:
+            f.get_packages()
+        stats = pygore.ExtractionStats()
+        with pygore.GoFile(golden_file, strings=table, stats=stats) as f:
+            pkgs = f.get_packages()
+        # The other strings are in the table, only the function names are
+        # decoded again.
+        self.assertEqual(stats.counters['strings_decoded'],
+                         sum(len(p.functions) for p in pkgs))
+
+
+class TestExport(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_jsonl(self):
+        with pygore.GoFile(golden_file) as f:
+            a = f.get_all()
+        with pygore.Exporter(self.dir, shard='0', batch_size=10) as e:
+            e.add(a, 'golden')
+        self.assertEqual(e.rows['files'], 1)
+        self.assertEqual(e.rows['functions'], sum(
+            len(p.functions) for p in a.all_packages()))
+        with open(e.path('packages')) as fp:
+            rows = [json.loads(line) for line in fp]
+        self.assertEqual(len(rows), e.rows['packages'])
+        main = [r for r in rows if r['class'] == 'main']
+        self.assertEqual(len(main), 1)
+        self.assertEqual(main[0]['file'], 'golden')
+        with open(e.path('types')) as fp:
+            addrs = {json.loads(line)['addr'] for line in fp}
+        with open(e.path('edges')) as fp:
+            for line in fp:
+                self.assertIn(json.loads(line)['dst_addr'], addrs)
+
+
+class TestCorpusStore(unittest.TestCase):
+    def setUp(self):
+        with pygore.GoFile(golden_file) as f:
+            self.analysis = f.get_all()
+        self.store = pygore.CorpusStore()
+        self.store.add(self.analysis, 'a')
+        self.store.add(self.analysis, 'b')
+
+    def test_shared(self):
+        sizes = self.store.sizes()
+        self.assertEqual(sizes['files'], 2)
+        self.assertEqual(sizes['packages'], 2 * sizes['unique_packages'])
+        self.assertEqual(sizes['types'], 2 * sizes['unique_types'])
+        self.assertEqual(sizes['unique_packages'],
+                         len(self.analysis.all_packages()))
+        with self.assertRaises(ValueError):
+            self.store.add(self.analysis, 'a')
+
+    def test_analysis(self):
+        a = self.store.analysis('b')
+        self.assertEqual(a.build_id, gold_build_id)
+        for cls in pygore.PackageClass:
+            want = [(f.name, f.offset, f.end) for p in
+                    self.analysis.packages[cls] for f in p.functions]
+            got = [(f.name, f.offset, f.end) for p in a.packages[cls]
+                   for f in p.functions]
+            self.assertEqual(got, want)
+        self.assertEqual([(t.addr, t.name) for t in a.types],
+                         [(t.addr, t.name) for t in self.analysis.types])
+
+    def test_resolved_methods(self):
+        with pygore.GoFile(golden_file) as f:
+            f.resolve_methods()
+            a = f.get_all()
+        store = pygore.CorpusStore()
+        store.add(a)
+
+        def resolved(types):
+            return [(m.name, getattr(m.function, 'name', None),
+                     getattr(m.function, 'offset', None),
+                     getattr(m.ifaceFunction, 'offset', None))
+                    for t in _walk_types(types) for m in t.methods or ()]
+
+        want = resolved(a.types)
+        self.assertTrue(any(r[1] is not None for r in want))
+        self.assertEqual(resolved(store.analysis(a.path).types), want)
+
+    def test_export(self):
+        d = tempfile.mkdtemp()
+        try:
+            rows = self.store.export(d)
+        finally:
+            shutil.rmtree(d)
+        sizes = self.store.sizes()
+        self.assertEqual(rows['files'], 2)
+        self.assertEqual(rows['packages'], sizes['unique_packages'])
+        self.assertEqual(rows['types'], sizes['unique_types'])
+        self.assertEqual(rows['file_types'], sizes['types'])
+
+
+class TestSimilarityIndex(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'index.db')
+        with pygore.GoFile(golden_file) as f:
+            self.analysis = f.get_all()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_fingerprint(self):
+        symbols = pygore.fingerprint(self.analysis)
+        self.assertIn('p:main', symbols)
+        self.assertIn('f:main.main', symbols)
+        self.assertEqual(pygore.minhash(symbols),
+                         pygore.minhash(set(symbols)))
+
+    def test_minhash(self):
+        # More symbols than NumPy hashes at a time.
+        symbols = {'f:main.func{}'.format(i) for i in range(10000)}
+        sig = pygore.minhash(symbols)
+        numpy = pygore.similarity.numpy
+        pygore.similarity.numpy = None
+        try:
+            self.assertEqual(pygore.minhash(symbols), sig)
+        finally:
+            pygore.similarity.numpy = numpy
+        half = set(sorted(symbols)[:5000])
+        self.assertAlmostEqual(pygore.jaccard(sig, pygore.minhash(half)),
+                               0.5, delta=0.15)
+
+    def test_query(self):
+        with pygore.SimilarityIndex(self.path) as idx:
+            idx.add('gold', self.analysis)
+            idx.add('other', pygore.Analysis('other'))
+            self.assertEqual(len(idx), 2)
+            self.assertEqual(idx.query(self.analysis), [('gold', 1.0)])
+        with pygore.SimilarityIndex(self.path) as idx:
+            self.assertIn('gold', idx)
+            self.assertEqual(idx.query(self.analysis), [('gold', 1.0)])
+            self.assertTrue(idx.remove('gold'))
+            self.assertEqual(idx.query(self.analysis), [])
+        with self.assertRaises(ValueError):
+            pygore.SimilarityIndex(self.path, num_perm=64)
+
+
+class TestDiff(unittest.TestCase):
+    def setUp(self):
+        self.file = pygore.GoFile(golden_file)
+
+    def tearDown(self):
+        self.file.close()
+
+    def test_same(self):
+        d = pygore.diff(self.file.get_all(), self.file)
+        self.assertFalse(d)
+        self.assertEqual(d.summary()['types'],
+                         {'added': 0, 'removed': 0, 'changed': 0})
+
+    def test_changes(self):
+        old = pickle.loads(pickle.dumps(self.file.get_all()))
+        main = old.packages[pygore.PackageClass.Main][0]
+        removed = main.functions.pop()
+        main.methods[0].end += 16
+        for t in old.types:
+            if t.name == 'main.simpleStruct':
+                t.fields = t.fields[:-1]
+        d = pygore.diff(old, self.file, types=True)
+        self.assertEqual([f.name for f in d.functions.added],
+                         [removed.name])
+        self.assertEqual(len(d.methods.changed), 1)
+        self.assertEqual([n.name for _, (_, n) in d.packages.changed],
+                         [main.name])
+        self.assertIn('main.simpleStruct',
+                      [n.name for _, n in d.types.changed])
+        self.assertIsNone(pygore.diff(old, self.file, types=False).types)
+
+
+class TestCLI(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_scan_and_resume(self):
+        out = os.path.join(self.dir, 'out.jsonl')
+        args = ['-j', '1', '-o', out, golden_file, __file__]
+        self.assertEqual(pygore.cli.main(args), 0)
+        with open(out) as fp:
+            recs = {r['path']: r for r in map(json.loads, fp)}
+        self.assertTrue(recs[golden_file]['ok'])
+        self.assertEqual(recs[golden_file]['build_id'], gold_build_id)
+        self.assertTrue(recs[__file__]['skipped'])
+
+        self.assertEqual(pygore.cli.main(args + ['--resume']), 0)
+        with open(out) as fp:
+            self.assertEqual(len(fp.readlines()), 2)
+
+    def test_resume_killed_run(self):
+        out = os.path.join(self.dir, 'out.jsonl')
+        table = os.path.join(self.dir, 'files-0.parquet')
+        with open(table, 'wb') as fp:
+            fp.write(b'PAR1 without a footer')
+        with open(out, 'w') as fp:
+            fp.write(json.dumps({'path': golden_file, 'ok': True,
+                                 'export': table}) + '\n')
+            fp.write('{"path": "' + __file__)
+        args = ['-j', '1', '-o', out, '--resume', golden_file, __file__]
+        self.assertEqual(pygore.cli.main(args), 0)
+        with open(out) as fp:
+            recs = [json.loads(line) for line in fp]
+        # The file in the unreadable table is analyzed again, and the
+        # partial line is replaced.
+        self.assertEqual(sorted(r['path'] for r in recs),
+                         sorted([golden_file, golden_file, __file__]))
+        self.assertTrue(any(r['ok'] for r in recs[1:]))
+
+
 class TestBug14(unittest.TestCase):
     def setUp(self):
         golden_file = os.path.dirname(__file__) + '/' + 'resources/bettercap'